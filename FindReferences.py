@@ -0,0 +1,215 @@
+"""すべての参照を検索する（定義へ移動と同じ方法で解決し、同じ定義を指す識別子だけを集める）"""
+import os
+import threading
+from PySide6.QtCore import QObject, Signal
+from Highlight.Semantic import Semantic, module_cache
+from Highlight.References import identifier_positions, reference_index
+from Highlight.Workspace import workspace_index
+from GoToDefinition import DefinitionFinder, owner_at
+
+class Source:
+	"""検索する開いているタブ（key はファイルの絶対パス、無題なら tab ごとの文字列）"""
+	def __init__(self, tab, file_path, text, semantic=None):
+		self.tab = tab
+		self.file_path = file_path
+		self.key = os.path.abspath(file_path) if file_path else f"untitled:{id(tab)}"
+		self.text = text
+		self.semantic = semantic
+
+class ReferenceFinder:
+	"""GUIを使わずに参照を探す（別スレッドから使う）。
+
+	参照は識別子の索引で候補を絞り、候補ごとにDefinitionFinder.resolveで定義を求める。
+	定義が同じスコープの同じ名前の束縛（再代入も含む）なら同じシンボルとみなす。
+	型の分からない obj.name はクラスのメンバーのnameとみなす（attribute_key参照）。
+	"""
+	def __init__(self, sources, paths):
+		self.sources = sources  # 開いているタブ（未保存の内容を使う）
+		self.paths = paths  # ワークスペースのファイル
+		self._open = {source.key: source for source in sources}
+		self._finder = DefinitionFinder(None)
+		self._members = {}  # 名前 -> ワークスペースのクラスのメンバーとしてのシンボル
+
+	def semantic_of(self, key):
+		"""keyのファイルのSemantic（開いているタブならその内容のもの）"""
+		source = self._open.get(key)
+		if source is not None:
+			if source.semantic is None or source.semantic.text != source.text:
+				previous = source.semantic
+				chunks = previous.chunks if previous is not None and previous.chunks is not None else {}
+				source.semantic = Semantic(source.text, chunks)
+			return source.semantic
+		if key.startswith("untitled:"):
+			return None
+		return module_cache.get(key)
+
+	def symbol_key(self, path, line, word, source_key=None):
+		"""定義位置を比較できる形 (ファイル, 束縛の最初の行) にする"""
+		key = os.path.abspath(path) if path else source_key
+		semantic = self.semantic_of(key) if key else None
+		if semantic is not None:
+			# 同じスコープで再代入された名前は最初の束縛にそろえる
+			for lines, _ in (semantic.definition_index().get(word) or {}).values():
+				if line in lines:
+					line = lines[0]
+					break
+		return key, line
+
+	def attribute_key(self, semantic, source_key, word, line):
+		"""型の分からない obj.word のシンボル。
+
+		囲んでいるクラス、同じファイルのクラス、ワークスペースでwordを定義している
+		唯一のクラスの順にメンバーを探す。見つからなければ属性wordとしてまとめる。
+		"""
+		entries = semantic.definition_index().get(word) if semantic is not None else None
+		if entries:
+			scope = semantic.find_scope(line)
+			while scope:
+				if scope.scope_type == "class" and scope in entries:
+					return source_key, entries[scope][0][0]
+				scope = scope.parent
+			members = [lines[0] for scope, (lines, _) in entries.items() if scope.scope_type == "class"]
+			if members:
+				return source_key, min(members)
+		if word not in self._members:
+			members = workspace_index.members(word)
+			if len(members) == 1:
+				path, member_line, _ = members[0]
+				self._members[word] = self.symbol_key(path, member_line, word)
+			else:
+				self._members[word] = ("attribute", word)
+		return self._members[word]
+
+	def resolve_key(self, text, semantic, source_key, file_path, word, line, owner):
+		if owner:
+			# module.name はインポート先の定義
+			location = self._finder.find_import_target(text, word, line, file_path, owner, semantic)
+			if location:
+				return self.symbol_key(location[0], location[1], word)
+			return self.attribute_key(semantic, source_key, word, line)
+		definition = self._finder.resolve(text, semantic, word, line, None, file_path)
+		if definition is None:
+			# 組み込み関数など
+			return None, word
+		return self.symbol_key(definition['file_path'], definition['line'], word, source_key)
+
+	def target(self, source, word, line, owner):
+		"""sourceのline行のwordが指すシンボル"""
+		return self.resolve_key(source.text, self.semantic_of(source.key), source.key, source.file_path, word, line, owner)
+
+	def matches(self, key, file_path, text, semantic, word, positions, target):
+		"""positionsのうちtargetを指すものを [(行, 列, 行の内容)] で返す"""
+		lines = text.split('\n')
+		found = []
+		for line, col in positions:
+			if line > len(lines):
+				continue
+			line_text = lines[line - 1]
+			if self.resolve_key(text, semantic, key, file_path, word, line, owner_at(line_text, col)) == target:
+				found.append((line, col, line_text))
+		return found
+
+	def search(self, word, target, cancelled):
+		"""(Source か ファイルのパス, [(行, 列, 行の内容)]) をファイルごとに順に返す"""
+		for source in self.sources:
+			if cancelled():
+				return
+			positions = identifier_positions(source.text).get(word)
+			if not positions:
+				continue
+			found = self.matches(source.key, source.file_path, source.text, self.semantic_of(source.key), word, positions, target)
+			if found:
+				yield source, found
+
+		paths = [path for path in self.paths if path not in self._open]
+		for path, positions in reference_index.find(word, paths):
+			if cancelled():
+				return
+			semantic = module_cache.get(path)
+			if semantic is None:
+				continue
+			try:
+				with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+					text = f.read()
+			except OSError:
+				continue
+			found = self.matches(path, path, text, semantic, word, positions, target)
+			if found:
+				yield path, found
+
+class ReferenceSearch(QObject):
+	"""参照の検索を別スレッドで行い、見つかったファイルごとにfoundで知らせる。
+
+	新しい検索を始めるかcancelを呼ぶと、前の検索の結果は届かなくなる。
+	"""
+	found = Signal(int, object, object)  # 検索番号, Source か パス, [(行, 列, 行の内容)]
+	finished = Signal(int, int)  # 検索番号, 見つかった数
+
+	def __init__(self, parent=None):
+		super().__init__(parent)
+		self.generation = 0
+
+	def start(self, sources, source, word, line, owner):
+		"""sources（開いているタブ）とワークスペースからsourceのline行のwordの参照を探し、検索番号を返す"""
+		self.generation += 1
+		generation = self.generation
+		# 開始したタブから先に探す
+		sources = [source] + [other for other in sources if other is not source]
+		finder = ReferenceFinder(sources, workspace_index.paths())
+
+		def cancelled():
+			return generation != self.generation
+
+		def run():
+			count = 0
+			try:
+				target = finder.target(source, word, line, owner)
+				for location, found in finder.search(word, target, cancelled):
+					if cancelled():
+						return
+					count += len(found)
+					self.found.emit(generation, location, found)
+			except Exception as e:
+				print(f"Error finding references: {e}")
+			if not cancelled():
+				self.finished.emit(generation, count)
+		threading.Thread(target=run, daemon=True).start()
+		return generation
+
+	def cancel(self):
+		self.generation += 1
+
+def editor_sources(window):
+	"""開いているPythonのタブをSourceにする"""
+	sources = {}
+	for tab in window.tablist:
+		highlighter = getattr(tab, 'highlighter', None)
+		if highlighter is None or not hasattr(tab, 'document'):
+			continue
+		file_path = getattr(tab, 'file_path', None)
+		is_python = highlighter.lexer is not None and highlighter.lexer.name == "Python"
+		if not is_python and not (file_path and file_path.endswith(".py")):
+			continue
+		text = tab.document().toPlainText()
+		sources[tab] = Source(tab, file_path, text, highlighter.semantic)
+	return sources
+
+def find_references(window):
+	"""カーソル位置のシンボルのすべての参照を検索サイドバーに表示する"""
+	current_index = window.tabs.currentIndex()
+	if current_index < 0 or current_index >= len(window.tablist):
+		return
+	editor = window.tablist[current_index]
+	if not hasattr(editor, 'textCursor'):
+		return
+
+	sources = editor_sources(window)
+	symbol = DefinitionFinder(window).symbol_at_cursor(editor)
+	if editor not in sources or not symbol:
+		window.statusBar().showMessage("参照を検索できるシンボルがありません", 3000)
+		return
+
+	word, line, owner = symbol
+	if not (window.sidebar.isVisible() and window.sidebar.currentWidget() is window.sidebar.search):
+		window.open_search_sidebar()
+	window.sidebar.search.find_references(list(sources.values()), sources[editor], word, line, owner)
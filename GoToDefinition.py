@@ -1,8 +1,26 @@
 """定義へ移動機能モジュール"""
-import ast
 import os
 import re
-from Highlight.Semantic import Semantic, SymbolKind, SymbolInfo, get_module_file
+from Highlight.Semantic import Semantic, SymbolKind, SymbolInfo, get_module_file, get_module_semantic
+from Highlight.Workspace import workspace_index
+
+
+def owner_at(text, col):
+    """行のcol列にある単語の前の a.b. の部分を "a.b" で返す（無ければNone）"""
+    start = min(col, len(text))
+    while start > 0 and (text[start - 1].isalnum() or text[start - 1] == '_'):
+        start -= 1
+    
+    end = start
+    while start > 0 and text[start - 1] == '.':
+        start -= 1
+        while start > 0 and (text[start - 1].isalnum() or text[start - 1] == '_'):
+            start -= 1
+    
+    owner = text[start:end].rstrip('.')
+    if not owner or not all(part.isidentifier() for part in owner.split('.')):
+        return None
+    return owner
 
 
 class DefinitionFinder:
@@ -10,6 +28,8 @@ class DefinitionFinder:
     
     def __init__(self, window):
         self.window = window
+        self._lines = None  # (テキスト, 行のリスト)
+        self._import_map = None  # (Semantic, ファイル, インポートの対応)
     
     def get_word_at_position(self, editor, line, col):
         """カーソル位置の単語を取得"""
@@ -38,48 +58,36 @@ class DefinitionFinder:
         
         return text[start:end]
     
-    def find_definition_in_text(self, text, symbol_name, current_line=None):
-        """テキスト内でシンボルの定義位置を検索（スコープ対応）"""
-        # Semanticを使用してスコープを解析
-        semantic = Semantic(text)
-        
-        if current_line is not None:
-            # 現在の行からスコープチェーンを辿って検索
-            symbol_info = semantic.lookup(symbol_name, current_line)
-            if symbol_info and isinstance(symbol_info, SymbolInfo):
-                return symbol_info.lineno, self._get_name_col(text, symbol_info.lineno, symbol_name)
-        
-        # スコープで見つからない場合、従来の方法で検索
-        try:
-            tree = ast.parse(text)
-        except SyntaxError:
+    def get_owner_at_position(self, editor, line, col):
+        """カーソル位置の単語の前にある a.b. の部分を "a.b" で返す（無ければNone）"""
+        block = editor.document().findBlockByNumber(line)
+        if not block.isValid():
             return None
+        return owner_at(block.text(), col)
+    
+    def get_semantic(self, editor, text):
+        """エディタのハイライターが解析したSemanticを使う（無ければ解析する）"""
+        highlighter = getattr(editor, 'highlighter', None)
+        if highlighter is not None and hasattr(highlighter, 'current_semantic'):
+            return highlighter.current_semantic(text)
+        return Semantic(text)
+    
+    def find_definition_in_text(self, text, symbol_name, current_line=None, semantic=None):
+        """テキスト内でシンボルの定義位置を検索（スコープ対応）"""
+        if semantic is None:
+            semantic = Semantic(text)
         
-        for node in ast.walk(tree):
-            # クラス定義
-            if isinstance(node, ast.ClassDef) and node.name == symbol_name:
-                return node.lineno, self._get_name_col(text, node.lineno, node.name)
-            
-            # 関数定義
-            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and node.name == symbol_name:
-                return node.lineno, self._get_name_col(text, node.lineno, node.name)
-            
-            # 変数代入
-            if isinstance(node, ast.Assign):
-                for target in node.targets:
-                    if isinstance(target, ast.Name) and target.id == symbol_name:
-                        return node.lineno, self._get_name_col(text, node.lineno, target.id)
-            
-            # 型注釈付き変数
-            if isinstance(node, ast.AnnAssign):
-                if isinstance(node.target, ast.Name) and node.target.id == symbol_name:
-                    return node.lineno, self._get_name_col(text, node.lineno, node.target.id)
-        
+        # 現在の行から見える定義（同じスコープで何度も代入されていれば直前のもの）
+        symbol_info = semantic.definition(symbol_name, current_line or 1)
+        if symbol_info and isinstance(symbol_info, SymbolInfo):
+            return symbol_info.lineno, self._get_name_col(text, symbol_info.lineno, symbol_name)
         return None
     
     def _get_name_col(self, text, lineno, name):
         """指定行でシンボル名の列位置を取得"""
-        lines = text.splitlines()
+        if self._lines is None or self._lines[0] is not text:
+            self._lines = (text, text.splitlines())
+        lines = self._lines[1]
         if lineno <= len(lines):
             line = lines[lineno - 1]
             match = re.search(rf'\b{re.escape(name)}\b', line)
@@ -87,45 +95,68 @@ class DefinitionFinder:
                 return match.start()
         return 0
     
-    def find_import_target(self, text, symbol_name, current_line=None):
-        """インポート文からシンボルのモジュールを検索（スコープ対応）"""
-        try:
-            tree = ast.parse(text)
-        except SyntaxError:
-            return None, None
-        
-        for node in ast.walk(tree):
-            # import module
-            if isinstance(node, ast.Import):
-                for alias in node.names:
-                    actual_name = alias.asname or alias.name
-                    if actual_name == symbol_name:
-                        module_file = get_module_file(alias.name)
-                        if module_file:
-                            return module_file, 1
-            
-            # from module import name
-            if isinstance(node, ast.ImportFrom):
-                for alias in node.names:
-                    actual_name = alias.asname or alias.name
-                    if actual_name == symbol_name:
-                        module_file = get_module_file(node.module)
-                        if module_file:
-                            # モジュールファイル内でシンボルを検索（スコープなしで検索）
-                            try:
-                                with open(module_file, 'r', encoding='utf-8') as f:
-                                    module_text = f.read()
-                                result = self.find_definition_in_text(module_text, alias.name, None)
-                                if result:
-                                    return module_file, result[0]
-                            except:
-                                pass
-                            return module_file, 1
-        
-        return None, None
+    def get_import_map(self, semantic, file_path=None):
+        """インポートで束縛される名前 -> 修飾名（相対インポートはワークスペースの索引で解決）"""
+        if self._import_map is not None and self._import_map[0] is semantic and self._import_map[1] == file_path:
+            return self._import_map[2]
+        names = {}
+        for name, (_, module_name, target) in semantic.imports.items():
+            level = len(module_name) - len(module_name.lstrip('.'))
+            if level:
+                module_name = workspace_index.resolve_relative(file_path, module_name[level:], level)
+            if not module_name:
+                continue
+            names[name] = f"{module_name}.{target}" if target else module_name
+        self._import_map = (semantic, file_path, names)
+        return names
     
-    def find_definition(self, editor):
-        """カーソル位置のシンボルの定義を検索（スコープ対応）"""
+    def locate(self, qualname):
+        """修飾名の定義位置 (ファイル, 行, 列) を返す"""
+        # ワークスペース内の定義は索引から引く
+        location = workspace_index.find(qualname)
+        if location:
+            return location
+        
+        module_name, _, name = qualname.rpartition('.')
+        if module_name:
+            module_file = workspace_index.module_file(module_name) or get_module_file(module_name)
+            if module_file:
+                # 共有キャッシュのSemanticからモジュール直下のシンボルを検索
+                module = get_module_semantic(module_name)
+                if module:
+                    symbol_info = module.root.lookup_local(name)
+                    if symbol_info:
+                        return module_file, symbol_info.lineno, 0
+                # from package import submodule
+                return get_module_file(qualname) or module_file, 1, 0
+        
+        module_file = get_module_file(qualname)
+        if module_file:
+            return module_file, 1, 0
+        return None
+    
+    def find_import_target(self, text, symbol_name, current_line=None, file_path=None, owner=None, semantic=None):
+        """インポート文からシンボルの定義位置 (ファイル, 行, 列) を検索する。
+
+        ownerを渡すと owner.symbol_name（例: module.func）としてownerの先頭の名前から辿る。
+        """
+        if semantic is None:
+            semantic = Semantic(text)
+        
+        names = self.get_import_map(semantic, file_path)
+        if owner:
+            head, _, rest = owner.partition('.')
+            if head not in names:
+                return None
+            qualname = '.'.join(part for part in (names[head], rest, symbol_name) if part)
+        elif symbol_name in names:
+            qualname = names[symbol_name]
+        else:
+            return None
+        return self.locate(qualname)
+    
+    def symbol_at_cursor(self, editor):
+        """カーソル位置の (単語, 行番号（1-indexed）, 前にある a.b の部分) を返す（単語が無ければNone）"""
         cursor = editor.textCursor()
         line = cursor.blockNumber()
         col = cursor.columnNumber()
@@ -134,38 +165,62 @@ class DefinitionFinder:
         word = self.get_word_at_position(editor, line, col)
         if not word:
             return None
-        
+        return word, line + 1, self.get_owner_at_position(editor, line, col)
+    
+    def find_definition(self, editor):
+        """カーソル位置のシンボルの定義を検索（スコープ対応）"""
+        symbol = self.symbol_at_cursor(editor)
+        if not symbol:
+            return None
+        word, current_line, owner = symbol
         text = editor.document().toPlainText()
-        file_path = getattr(editor, 'file_path', None)
-        
-        # 現在の行番号（1-indexed）
-        current_line = line + 1
+        return self.resolve(text, self.get_semantic(editor, text), word, current_line, owner, getattr(editor, 'file_path', None))
+    
+    def resolve(self, text, semantic, word, current_line, owner=None, file_path=None):
+        """current_line行のwordの定義を検索する（GUIを使わないので別スレッドからも呼べる）"""
+        # module.name の形ならインポート先から検索
+        if owner:
+            location = self.find_import_target(text, word, current_line, file_path, owner, semantic)
+            if location:
+                return self._external_definition(location, word, file_path)
         
         # スコープを使用して定義を検索
-        result = self.find_definition_in_text(text, word, current_line)
+        result = self.find_definition_in_text(text, word, current_line, semantic)
         if result:
-            def_line, def_col = result
-            return {
-                'file_path': file_path,
-                'line': def_line,
-                'col': def_col,
-                'symbol': word,
-                'same_file': True
-            }
+            return self._local_definition(result, word, file_path)
         
         # インポートされたモジュールを検索
-        module_file, module_line = self.find_import_target(text, word)
-        if module_file:
-            return {
-                'file_path': module_file,
-                'line': module_line,
-                'col': 0,
-                'symbol': word,
-                'same_file': False
-            }
+        location = self.find_import_target(text, word, current_line, file_path, semantic=semantic)
+        if location:
+            return self._external_definition(location, word, file_path)
+        
+        # obj.attr などはスコープに関係なく探す
+        symbol_info = semantic.any_definition(word, current_line)
+        if symbol_info:
+            return self._local_definition((symbol_info.lineno, self._get_name_col(text, symbol_info.lineno, word)), word, file_path)
         
         return None
     
+    def _local_definition(self, result, word, file_path):
+        def_line, def_col = result
+        return {
+            'file_path': file_path,
+            'line': def_line,
+            'col': def_col,
+            'symbol': word,
+            'same_file': True
+        }
+    
+    def _external_definition(self, location, word, file_path):
+        module_file, module_line, module_col = location
+        return {
+            'file_path': module_file,
+            'line': module_line,
+            'col': module_col,
+            'symbol': word,
+            'same_file': bool(file_path) and os.path.abspath(module_file) == os.path.abspath(file_path)
+        }
+    
     def navigate_to_definition(self, definition):
         """定義位置へ移動"""
         if not definition:
@@ -223,9 +278,23 @@ def go_to_definition(window):
         return
     
     finder = DefinitionFinder(window)
-    definition = finder.find_definition(editor)
     
-    if definition:
-        finder.navigate_to_definition(definition)
-    else:
-        window.statusBar().showMessage("定義が見つかりませんでした", 3000)
+    def navigate(definition):
+        # 解決を待つ間に別のタブへ移った場合は何もしない
+        if window.tabs.currentIndex() < 0 or window.tablist[window.tabs.currentIndex()] is not editor:
+            return
+        if definition:
+            finder.navigate_to_definition(definition)
+        else:
+            window.statusBar().showMessage("定義が見つかりませんでした", 3000)
+    
+    # 先読みした結果があればそれを使い、無ければ別スレッドで解決する
+    if hasattr(editor, 'request_definition'):
+        symbol = finder.symbol_at_cursor(editor)
+        if not symbol:
+            navigate(None)
+            return
+        editor.request_definition(symbol, navigate)
+        return
+    
+    navigate(finder.find_definition(editor))
@@ -0,0 +1,130 @@
+"""行単位で再開可能な字句解析"""
+from pygments.lexer import RegexLexer, ExtendedRegexLexer
+from pygments.token import _TokenType, Whitespace, Error
+
+ROOT_STATE = ('root',)
+
+# QSyntaxHighlighterのブロックの状態(int)とLexerの状態スタックの対応表
+_STATE_STACKS = [ROOT_STATE]
+_STATE_IDS = {ROOT_STATE: 0}
+
+def state_id(stack):
+	"""状態スタックをブロックの状態に使う番号に変換"""
+	sid = _STATE_IDS.get(stack)
+	if sid is None:
+		sid = _STATE_IDS[stack] = len(_STATE_STACKS)
+		_STATE_STACKS.append(stack)
+	return sid
+
+def state_stack(sid):
+	"""ブロックの状態を状態スタックに戻す（未設定の-1などは"root"）"""
+	if 0 <= sid < len(_STATE_STACKS):
+		return _STATE_STACKS[sid]
+	return ROOT_STATE
+
+def supports_incremental(lexer):
+	"""行頭の状態から字句解析を再開できるLexerかどうか"""
+	if not isinstance(lexer, RegexLexer) or isinstance(lexer, ExtendedRegexLexer):
+		return False
+	# get_tokens_unprocessedを上書きして後処理しているLexer(C系など)は対象外
+	return type(lexer).get_tokens_unprocessed is RegexLexer.get_tokens_unprocessed
+
+def lex(lexer, text, pos=0, stack=ROOT_STATE):
+	"""RegexLexer.get_tokens_unprocessedと同じ解析をposから行う。
+
+	(pos, token, value) に加えて、トークン境界で行頭に達した時点の
+	状態スタックを (pos, None, stack) として返す。
+	"""
+	tokendefs = lexer._tokens
+	statestack = list(stack)
+	statetokens = tokendefs[statestack[-1]]
+	length = len(text)
+	while pos < length:
+		for rexmatch, action, new_state in statetokens:
+			m = rexmatch(text, pos)
+			if m:
+				if action is not None:
+					if type(action) is _TokenType:
+						yield pos, action, m.group()
+					else:
+						yield from action(lexer, m)
+				start = pos
+				pos = m.end()
+				if new_state is not None:
+					if isinstance(new_state, tuple):
+						for state in new_state:
+							if state == '#pop':
+								if len(statestack) > 1:
+									statestack.pop()
+							elif state == '#push':
+								statestack.append(statestack[-1])
+							else:
+								statestack.append(state)
+					elif isinstance(new_state, int):
+						if abs(new_state) >= len(statestack):
+							del statestack[1:]
+						else:
+							del statestack[new_state:]
+					elif new_state == '#push':
+						statestack.append(statestack[-1])
+					statetokens = tokendefs[statestack[-1]]
+				if pos > start and text[pos - 1] == '\n':
+					yield pos, None, tuple(statestack)
+				break
+		else:
+			if text[pos] == '\n':
+				# 行末では"root"に戻る
+				statestack = ['root']
+				statetokens = tokendefs['root']
+				yield pos, Whitespace, '\n'
+				pos += 1
+				yield pos, None, ROOT_STATE
+				continue
+			yield pos, Error, text[pos]
+			pos += 1
+
+def lex_all(lexer, text):
+	"""Lexerに合わせて全体を解析する（再開できないLexerは状態を返さない）"""
+	if supports_incremental(lexer):
+		return lex(lexer, text)
+	return lexer.get_tokens_unprocessed(text)
+
+def line_offset(text, line):
+	"""line行目の先頭位置を返す"""
+	pos = 0
+	for _ in range(line):
+		pos = text.index('\n', pos) + 1
+	return pos
+
+def splice_range(lines, first, last, end, delta):
+	"""行範囲 (first, last) を、編集前のfirst行からend行の手前がfirst行からlast行に
+	なった編集に合わせてずらし、編集された行を含めて返す（linesがNoneなら編集された行のみ）
+	"""
+	if not lines:
+		return first, last
+	f, l = lines
+	if f >= end:
+		f += delta
+	if l >= end:
+		l += delta
+	return min(f, first), max(l, last)
+
+def rebase_runs(journal, start, end):
+	"""編集前のstart行からend行の手前が、journalの編集の後にどこへ移ったかを返す。
+
+	journalは (first, end, count) の並び（first行からend行の手前がcount行になった）。
+	書き換えられた行を除いた (旧開始行, 旧終了行, 新開始行) のリストを返す。
+	"""
+	runs = [(start, end, start)]
+	for first, stop, count in journal:
+		delta = count - (stop - first)
+		moved = []
+		for a, b, s in runs:
+			t = s + (b - a)
+			if s < first:
+				moved.append((a, a + min(t, first) - s, s))
+			if t > stop:
+				lo = max(s, stop)
+				moved.append((a + lo - s, b, lo + delta))
+		runs = moved
+	return runs
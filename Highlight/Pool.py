@@ -0,0 +1,145 @@
+"""トークナイズを別プロセスで実行するバックエンド"""
+from concurrent.futures import Future
+from array import array
+import itertools
+import os
+import sys
+import pickle
+import queue
+import subprocess
+import threading
+from pygments.lexers import get_lexer_by_name
+from pygments.token import string_to_tokentype
+from utils import get_startupinfo
+from Highlight.Resolver import module_resolver
+from Highlight.Workspace import workspace_index
+
+POOL_MIN_LINES = 1000  # これ以上の行数の全体解析をワーカーに任せる
+
+class WorkerDied(Exception):
+	"""ワーカープロセスが異常終了した"""
+
+def encode_replace(replace):
+	"""Highlighter.replaceをワーカーに渡せる形に変換"""
+	return {name: tuple((values, str(token)) for values, token in items) for name, items in replace.items()}
+
+def decode_replace(replace):
+	return {name: tuple((values, string_to_tokentype(token)) for values, token in items) for name, items in replace.items()}
+
+def pack(result):
+	"""TokenizeResultをワーカーから返せる形に詰める（状態スタックは番号にまとめる）"""
+	stacks = {}
+	states = array('i', (-1 if state is None else stacks.setdefault(state, len(stacks)) for state in result.states))
+	return result.start, result.end, result.lines, result.cache, list(stacks), states, array('B', result.depths), result.key
+
+def unpack(table, generation=0):
+	"""packした結果をTokenizeResultに戻す"""
+	from Highlight import TokenizeResult
+	start, end, lines, cache, stacks, states, depths, key = table
+	states = [None if index < 0 else stacks[index] for index in states]
+	changed = None if end is None else list(range(start, end))
+	return TokenizeResult(start, end, lines, states, list(depths), cache, changed, key, generation)
+
+def configure(interpreter, root, modules):
+	"""ワーカー側で、親プロセスと同じインタープリターとワークスペースからインポート先のモジュールを探すようにする。
+
+	modulesはワークスペースのモジュールの一覧（前回から変わっていなければNone）。
+	"""
+	module_resolver.set_interpreter(interpreter)
+	if modules is not None:
+		workspace_index.use_modules(root, modules)
+
+def tokenize_table(text, lexer_name, replace, lines=None):
+	"""ワーカー側でトークナイズしてpackした結果を返す。linesを指定するとその行範囲だけを解析する"""
+	from Highlight import Tokenizer
+	tokenizer = Tokenizer(text, get_lexer_by_name(lexer_name), decode_replace(replace))
+	return pack(tokenizer.tokenize() if lines is None else tokenizer.tokenize_lines(*lines))
+
+class TokenizePool:
+	"""全Highlighterで共有する常駐ワーカープロセス群。
+
+	ジョブはconcurrent.futures.Futureで返す。開始前のジョブはcancel()で取り消せる。
+	行範囲を指定したジョブ（表示範囲の先行解析）は全体の解析より先に処理する。
+	ワーカーが落ちた場合はWorkerDiedを設定し、次のジョブで起動し直す。
+	ジョブには選択中のインタープリターとワークスペースを付けて送る（モジュールの一覧は変わったときだけ）。
+	"""
+	def __init__(self, workers=None):
+		self.workers = workers or max(1, min(2, (os.cpu_count() or 1) - 1))
+		self._jobs = queue.PriorityQueue()
+		self._order = itertools.count()
+		self._threads = []
+		self._lock = threading.Lock()
+
+	def submit(self, text, lexer_name, replace, lines=None):
+		future = Future()
+		with self._lock:
+			if not self._threads:
+				for i in range(self.workers):
+					thread = threading.Thread(target=self._dispatch, daemon=True, name=f"tokenize-pool-{i}")
+					thread.start()
+					self._threads.append(thread)
+		priority = 1 if lines is None else 0
+		self._jobs.put((priority, next(self._order), future, (text, lexer_name, encode_replace(replace), lines)))
+		return future
+
+	def _spawn(self):
+		return subprocess.Popen(
+			[sys.executable, "-c", "from Highlight.Pool import main; main()"],
+			stdin=subprocess.PIPE,
+			stdout=subprocess.PIPE,
+			cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+			startupinfo=get_startupinfo()
+		)
+
+	def _dispatch(self):
+		process = None
+		sent = None  # このワーカーに送ったワークスペースのモジュールの一覧のversion
+		while True:
+			_, _, future, job = self._jobs.get()
+			if not future.set_running_or_notify_cancel():
+				continue
+			try:
+				if process is None or process.poll() is not None:
+					process = self._spawn()
+					sent = None
+				version, modules = workspace_index.version, None
+				if version != sent:
+					version, modules = workspace_index.modules()
+				context = (module_resolver.interpreter, workspace_index.root, modules)
+				pickle.dump(job + context, process.stdin, protocol=pickle.HIGHEST_PROTOCOL)
+				process.stdin.flush()
+				sent = version
+				table, error = pickle.load(process.stdout)
+			except Exception as e:
+				if process is not None:
+					process.kill()
+				process = None
+				future.set_exception(WorkerDied(str(e)))
+				continue
+			if error:
+				future.set_exception(RuntimeError(error))
+			else:
+				future.set_result(table)
+
+tokenize_pool = TokenizePool()
+
+def main():
+	stdin = sys.stdin.buffer
+	stdout = sys.stdout.buffer
+	# print()の出力で通信が壊れないようにする
+	sys.stdout = sys.stderr
+	while True:
+		try:
+			text, lexer_name, replace, lines, *context = pickle.load(stdin)
+		except EOFError:
+			break
+		try:
+			configure(*context)
+			reply = (tokenize_table(text, lexer_name, replace, lines), None)
+		except Exception as e:
+			reply = (None, f"{e.__class__.__name__}: {e}")
+		pickle.dump(reply, stdout, protocol=pickle.HIGHEST_PROTOCOL)
+		stdout.flush()
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,133 @@
+"""識別子 -> 出現位置の索引（すべての参照を検索で候補のファイルと位置を引く）"""
+import io
+import keyword
+import os
+import re
+import threading
+import tokenize
+from Highlight.Store import semantic_store
+from Highlight.Workspace import workspace_index
+
+IDENTIFIER = re.compile(r"(?!\d)\w+")
+
+def identifier_positions(text):
+	"""識別子ごとの出現位置 {名前: [(行（1-indexed）, 列), ...]} を返す（文字列とコメントの中は除く）"""
+	positions = {}
+	try:
+		for token in tokenize.generate_tokens(io.StringIO(text).readline):
+			if token.type == tokenize.NAME and not keyword.iskeyword(token.string):
+				positions.setdefault(token.string, []).append(token.start)
+	except (tokenize.TokenError, IndentationError, SyntaxError):
+		# 閉じていない括弧などで字句解析できない間は行ごとに正規表現で拾う
+		positions = {}
+		for lineno, line in enumerate(text.split('\n'), 1):
+			for match in IDENTIFIER.finditer(line.split('#', 1)[0]):
+				word = match.group()
+				if not keyword.iskeyword(word):
+					positions.setdefault(word, []).append((lineno, match.start()))
+	return positions
+
+class ReferenceIndex:
+	"""ワークスペースのファイルごとの識別子の出現位置と、名前 -> ファイルの逆引き。
+
+	ファイルは (更新時刻, サイズ) が変わった場合だけ字句解析し直す。storeを指定すると
+	出現位置を保存し、次回開いたときはファイルを読まない。
+	"""
+	VERSION = 1
+
+	def __init__(self, store=None):
+		self.store = store
+		self._files = {}  # path -> (stamp, {名前: [(行, 列)]})
+		self._names = {}  # 名前 -> {path}
+		self._lock = threading.Lock()
+		self._generation = 0
+
+	def positions(self, path):
+		"""ファイルの識別子の出現位置（読めなければNone）"""
+		try:
+			st = os.stat(path)
+		except OSError:
+			self.remove(path)
+			return None
+		stamp = (st.st_mtime_ns, st.st_size)
+		entry = self._files.get(path)
+		if entry and entry[0] == stamp:
+			return entry[1]
+		positions = self.store.load(path, "identifiers", self.VERSION, stamp) if self.store else None
+		if positions is None:
+			try:
+				with open(path, 'rb') as f:
+					data = f.read()
+			except OSError:
+				return None
+			# 更新時刻だけ変わった場合は内容のハッシュで保存済みの結果を使う
+			positions = self.store.load(path, "identifiers", self.VERSION, stamp, data) if self.store else None
+			if positions is None:
+				positions = identifier_positions(data.decode('utf-8', errors='ignore'))
+				if self.store:
+					self.store.save(path, "identifiers", self.VERSION, stamp, data, positions)
+		with self._lock:
+			self._remove(path)
+			self._files[path] = (stamp, positions)
+			for name in positions:
+				self._names.setdefault(name, set()).add(path)
+		return positions
+
+	def remove(self, path):
+		with self._lock:
+			self._remove(path)
+
+	def _remove(self, path):
+		entry = self._files.pop(path, None)
+		if not entry:
+			return
+		for name in entry[1]:
+			paths = self._names.get(name)
+			if paths is not None:
+				paths.discard(path)
+				if not paths:
+					del self._names[name]
+
+	def find(self, name, paths):
+		"""pathsのうちnameが出てくるファイルを (path, [(行, 列)]) で順に返す。
+
+		索引済みでnameが出てこないファイルは、更新されていなければ読まずに飛ばす。
+		"""
+		with self._lock:
+			known = self._names.get(name, set()).copy()
+		for path in paths:
+			entry = self._files.get(path)
+			if entry is not None and path not in known:
+				# 更新されたかだけを確かめる
+				try:
+					st = os.stat(path)
+				except OSError:
+					self.remove(path)
+					continue
+				if entry[0] == (st.st_mtime_ns, st.st_size):
+					continue
+			positions = self.positions(path)
+			if positions and name in positions:
+				yield path, positions[name]
+
+	def warm(self, paths=None):
+		"""pathsを裏で索引しておく（最初の検索で全ファイルを読まないように）。
+
+		pathsを省略するとワークスペースの走査が終わるのを待ってその全ファイルを索引する。
+		"""
+		with self._lock:
+			self._generation += 1
+			generation = self._generation
+
+		def run():
+			nonlocal paths
+			if paths is None:
+				workspace_index.wait()
+				paths = workspace_index.paths()
+			for path in paths:
+				if generation != self._generation:
+					return
+				self.positions(path)
+		threading.Thread(target=run, daemon=True).start()
+
+reference_index = ReferenceIndex(semantic_store)
@@ -0,0 +1,170 @@
+"""モジュール名からソースファイルを探す（インポートせずにsys.pathのディレクトリを調べる）"""
+import json
+import os
+import sys
+import threading
+import time
+
+SOURCE_SUFFIXES = (".py", ".pyi")
+EXTENSION_SUFFIXES = (".pyd", ".so")
+# 実行時に別名で登録されるモジュール
+ALIASES = {"os.path": "ntpath" if os.name == 'nt' else "posixpath"}
+MISSING_TTL = 30  # 見つからなかったモジュールを探し直すまでの秒数（エディタを開いたままのインストールに追従する）
+
+class ModuleResolver:
+	"""選択されたPythonインタープリターのsys.pathからモジュールのファイルを探す。
+
+	importlib.util.find_specと違い、親パッケージをインポートしない。結果はモジュール名ごとに
+	保持し、インタープリターかこのプロセスのsys.pathが変わったら捨てる。見つからなかった
+	モジュールはMISSING_TTL秒たったら探し直す。ディレクトリの一覧は更新時刻が変わるまで使い回す。
+	"""
+	def __init__(self, interpreter=None):
+		self.interpreter = interpreter
+		self._paths = None  # インタープリターのsys.path
+		self._key = None
+		self._modules = {}  # モジュール名 -> ファイル
+		self._missing = {}  # 見つからなかった（ソースの無い拡張モジュールを含む）モジュール名 -> 探した時刻
+		self._listings = {}  # ディレクトリ -> (更新時刻, 名前の集合)
+		self._lock = threading.Lock()
+
+	def set_interpreter(self, interpreter):
+		"""解決に使うインタープリターを変える（Noneならこのプロセス）。sys.pathは先に裏で調べておく"""
+		with self._lock:
+			if interpreter == self.interpreter:
+				return
+			self.interpreter = interpreter
+			self._reset()
+		threading.Thread(target=self.search_path, daemon=True).start()
+
+	def invalidate(self):
+		"""パッケージをインストールした後などに、覚えている結果を捨てる"""
+		with self._lock:
+			self._reset()
+			self._listings.clear()
+
+	def _reset(self):
+		self._key = None
+		self._paths = None
+		self._modules.clear()
+		self._missing.clear()
+
+	def _is_current(self, interpreter):
+		if not interpreter:
+			return True
+		try:
+			return os.path.samefile(interpreter, sys.executable)
+		except OSError:
+			return False
+
+	def search_path(self):
+		"""モジュールを探すディレクトリのリスト"""
+		while True:
+			with self._lock:
+				key = (self.interpreter, tuple(sys.path))
+				if key != self._key:
+					self._reset()
+					self._key = key
+				if self._paths is not None:
+					return self._paths
+			# 別のインタープリターの起動は時間がかかるので、ロックを持たずに問い合わせて後で差し替える
+			paths = self._query_paths(key[0])
+			with self._lock:
+				if self._key == key:
+					if self._paths is None:
+						self._paths = paths
+					return self._paths
+			# 問い合わせ中にインタープリターが変わったので調べ直す
+
+	def _query_paths(self, interpreter):
+		if self._is_current(interpreter):
+			paths = sys.path
+		else:
+			# 別のインタープリターは起動してsys.pathだけを聞く
+			# （utilsはPySide6を読み込むので、ここで初めて読み込む。tools/index_workspace.py参照）
+			from utils import run_subprocess
+			try:
+				result = run_subprocess(
+					[interpreter, "-c", "import sys, json; print(json.dumps(sys.path))"],
+					capture_output=True, text=True, timeout=10
+				)
+				paths = json.loads(result.stdout)
+			except Exception as e:
+				print(f"Error querying sys.path of {interpreter}: {e}")
+				paths = sys.path
+		return [os.path.abspath(path or os.curdir) for path in paths if path is not None]
+
+	def _listing(self, directory):
+		"""ディレクトリ内の名前の集合（読めなければ空）"""
+		try:
+			mtime = os.stat(directory).st_mtime_ns
+		except OSError:
+			return frozenset()
+		entry = self._listings.get(directory)
+		if entry and entry[0] == mtime:
+			return entry[1]
+		try:
+			names = frozenset(os.listdir(directory))
+		except OSError:
+			names = frozenset()
+		self._listings[directory] = (mtime, names)
+		return names
+
+	def find(self, module):
+		"""モジュールのソース（拡張モジュールならスタブ）のパス。見つからなければNone"""
+		if not module:
+			return None
+		paths = self.search_path()
+		cached = self._modules.get(module, False)
+		if cached is not False:
+			return cached
+		missing = self._missing.get(module)
+		if missing is not None and time.monotonic() - missing < MISSING_TTL:
+			return None
+		parts = ALIASES.get(module, module).split('.')
+		if not all(part.isidentifier() for part in parts):
+			result = None
+		else:
+			result = self._find(parts, paths)
+		with self._lock:
+			if self._paths is paths:
+				if result is None:
+					self._missing[module] = time.monotonic()
+				else:
+					self._modules[module] = result
+		return result
+
+	def _find(self, parts, directories):
+		name, rest = parts[0], parts[1:]
+		namespace = []
+		for directory in directories:
+			names = self._listing(directory)
+			if name in names:
+				package = os.path.join(directory, name)
+				children = self._listing(package)
+				init = next((f"__init__{suffix}" for suffix in SOURCE_SUFFIXES if f"__init__{suffix}" in children), None)
+				if init:
+					# 通常のパッケージ
+					return self._find(rest, [package]) if rest else os.path.join(package, init)
+				if children:
+					namespace.append(package)
+			found, file = self._module_file(directory, names, name)
+			if found:
+				return None if rest else file
+		if namespace and rest:
+			# 名前空間パッケージ（__init__.pyがない）は全ての部分を探す
+			return self._find(rest, namespace)
+		return None
+
+	def _module_file(self, directory, names, name):
+		"""(見つかったか, ファイル) を返す。ソースもスタブもない拡張モジュールはファイルがNone"""
+		# 拡張モジュールも隣にスタブ（.pyi）があればそれを使う
+		for suffix in SOURCE_SUFFIXES:
+			if name + suffix in names:
+				return True, os.path.join(directory, name + suffix)
+		prefix = name + "."
+		for entry in names:
+			if entry.startswith(prefix) and entry.endswith(EXTENSION_SUFFIXES):
+				return True, None
+		return False, None
+
+module_resolver = ModuleResolver()
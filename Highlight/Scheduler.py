@@ -0,0 +1,91 @@
+"""再ハイライトを表示範囲から優先して少しずつ行うスケジューラ"""
+import time
+from PySide6.QtCore import QObject, QTimer
+
+class RehighlightScheduler(QObject):
+	"""再ハイライト待ちの行を覚えておき、アイドル時に少しずつ塗り直す。
+
+	毎回まず表示範囲（と前後margin行）の待ち行を処理し、残りは前回の続きから
+	budget秒まで処理する。スクロールすると次の回から新しい表示範囲が優先される。
+	"""
+	def __init__(self, highlighter, margin=50, budget=0.008):
+		super().__init__(highlighter)
+		self.highlighter = highlighter
+		self.margin = margin
+		self.budget = budget
+		self.pending = bytearray()  # 行ごとの再ハイライト待ちフラグ
+		self.remaining = 0
+		self.position = 0  # 表示範囲外を次に処理する行
+		self.timer = QTimer(self)
+		self.timer.setInterval(0)
+		self.timer.timeout.connect(self.process)
+
+	def schedule(self, lines=None):
+		"""linesの行（Noneなら全行）を再ハイライト待ちにする"""
+		count = self.highlighter.document().blockCount()
+		if lines is None or len(self.pending) != count:
+			# 行数が合わない場合は位置が分からないので全行を待ちにする
+			flag = 1 if lines is None or self.remaining else 0
+			self.pending = bytearray([flag]) * count
+		if lines is not None:
+			pending = self.pending
+			for line in lines:
+				if line < count:
+					pending[line] = 1
+		self.remaining = self.pending.count(1)
+		if self.remaining:
+			self.timer.start()
+
+	def splice(self, first, last, block_count):
+		"""編集に合わせて待ち行をずらす（first行からlast行は呼び出し側で塗り直す）"""
+		if not self.remaining:
+			return
+		delta = block_count - len(self.pending)
+		end = last - delta + 1
+		if first < end <= len(self.pending):
+			self.pending[first:end] = bytearray(last - first + 1)
+			self.remaining = self.pending.count(1)
+		else:
+			self.schedule(None)
+
+	def cancel(self):
+		self.pending = bytearray()
+		self.remaining = 0
+		self.timer.stop()
+
+	def process(self):
+		if len(self.pending) != self.highlighter.document().blockCount():
+			self.schedule(None)
+		deadline = time.perf_counter() + self.budget
+		first, last = self.highlighter.visible_range
+		try:
+			with self.highlighter.batched_updates():
+				self._rehighlight(max(0, first - self.margin), last + self.margin)
+				while self.remaining and time.perf_counter() < deadline:
+					line = self.pending.find(1, self.position)
+					if line < 0:
+						line = self.pending.find(1)
+					self.position = self._rehighlight(line, len(self.pending) - 1, deadline)
+		finally:
+			# 失敗しても待ち行が無ければタイマーを止める（0msのタイマーが回り続けないように）
+			if not self.remaining:
+				self.timer.stop()
+
+	def _rehighlight(self, line, last, deadline=None):
+		"""line行からlast行までの待ち行を塗り直し、次に処理する行を返す"""
+		pending = self.pending
+		last = min(last, len(pending) - 1)
+		line = pending.find(1, line, last + 1)
+		if line < 0:
+			return last + 1
+		block = self.highlighter.document().findBlockByNumber(line)
+		while block.isValid() and line <= last:
+			if pending[line]:
+				pending[line] = 0
+				self.remaining -= 1
+				self.highlighter.rehighlightBlock(block)
+				if deadline is not None and time.perf_counter() > deadline:
+					return line + 1
+			block = block.next()
+			line += 1
+		return line
@@ -1,22 +1,127 @@
 from enum import Enum, auto
+from collections import OrderedDict
 import ast
-import importlib.util
+import copy
+import gc
 import inspect
+import os
+import sys
+import threading
+import types
+from bisect import bisect_right
+from Highlight.Store import semantic_store
+from Highlight.Resolver import module_resolver
+from Highlight.Workspace import workspace_index
 
 class SymbolKind(Enum):
 	Class = auto()
 	Function = auto()
 	Variable = auto()
 
+def class_signature(node):
+	"""クラス定義の基底クラス部分"""
+	bases = [ast.unparse(base) for base in node.bases] if node.bases else []
+	return f"({', '.join(bases)})" if bases else ""
+
+def function_signature(node):
+	"""関数定義の引数と戻り値の型"""
+	args = []
+	defaults_offset = len(node.args.args) - len(node.args.defaults)
+	
+	for i, arg in enumerate(node.args.args):
+		arg_str = arg.arg
+		if arg.annotation:
+			arg_str += f": {ast.unparse(arg.annotation)}"
+		default_idx = i - defaults_offset
+		if default_idx >= 0 and default_idx < len(node.args.defaults):
+			arg_str += f" = {ast.unparse(node.args.defaults[default_idx])}"
+		args.append(arg_str)
+	
+	if node.args.vararg:
+		vararg_str = f"*{node.args.vararg.arg}"
+		if node.args.vararg.annotation:
+			vararg_str += f": {ast.unparse(node.args.vararg.annotation)}"
+		args.append(vararg_str)
+	
+	if node.args.kwarg:
+		kwarg_str = f"**{node.args.kwarg.arg}"
+		if node.args.kwarg.annotation:
+			kwarg_str += f": {ast.unparse(node.args.kwarg.annotation)}"
+		args.append(kwarg_str)
+	
+	signature = f"({', '.join(args)})"
+	if node.returns:
+		signature += f" -> {ast.unparse(node.returns)}"
+	return signature
+
+def detail_node(node):
+	"""シグネチャとドキュメント文字列を作るのに要る部分だけを持つ定義ノードの複製（本体の構文木は持たない）"""
+	stub = copy.copy(node)
+	first = node.body[0] if node.body else None
+	is_docstring = isinstance(first, ast.Expr) and isinstance(first.value, ast.Constant) and isinstance(first.value.value, str)
+	stub.body = [first] if is_docstring else []
+	stub.decorator_list = []
+	return stub
+
 class SymbolInfo:
-	"""シンボルの詳細情報を保持するクラス"""
-	def __init__(self, name, kind, lineno=0, signature=None, docstring=None, type_hint=None):
+	"""シンボルの詳細情報を保持するクラス。
+
+	nodeを渡すと、signatureとdocstringは最初に参照されたときにnodeから作る
+	（ツールチップを出すまでast.unparseを行わない）。
+	"""
+	def __init__(self, name, kind, lineno=0, signature=None, docstring=None, type_hint=None, node=None):
 		self.name = name
 		self.kind = kind
 		self.lineno = lineno
-		self.signature = signature
-		self.docstring = docstring
+		self._signature = signature
+		self._docstring = docstring
 		self.type_hint = type_hint
+		self._node = node  # signatureとdocstringを作る前の定義ノード
+	
+	def _describe(self):
+		node = self._node
+		self._node = None
+		if isinstance(node, ast.ClassDef):
+			self._signature = class_signature(node)
+		else:
+			self._signature = function_signature(node)
+		self._docstring = ast.get_docstring(node)
+	
+	@property
+	def signature(self):
+		if self._node is not None:
+			self._describe()
+		return self._signature
+	
+	@signature.setter
+	def signature(self, value):
+		self._node = None
+		self._signature = value
+	
+	@property
+	def docstring(self):
+		if self._node is not None:
+			self._describe()
+		return self._docstring
+	
+	@docstring.setter
+	def docstring(self, value):
+		self._node = None
+		self._docstring = value
+	
+	def __getstate__(self):
+		# 構文木は保存しない
+		if self._node is not None:
+			self._describe()
+		return self.__dict__
+	
+	def moved(self, delta):
+		"""行番号をdeltaだけずらした複製を返す"""
+		# copy.copyは__getstate__を通るので、作っていないシグネチャをここで作らないよう直接複製する
+		info = SymbolInfo.__new__(SymbolInfo)
+		info.__dict__.update(self.__dict__)
+		info.lineno += delta
+		return info
 	
 	def to_tooltip(self):
 		"""ツールチップ用のテキストを生成"""
@@ -52,7 +157,8 @@ class Scope:
 		self.start = start
 		self.end = end
 		self.scope_type = scope_type  # "module", "class", "function"
-		self.symbols = {}  # name -> SymbolInfo
+		self.symbols = {}  # name -> SymbolInfo（最後に束縛したもの）
+		self.redefined = {}  # 2回以上束縛された名前 -> 束縛した順のSymbolInfoのリスト
 		self.children = []  # 子スコープのリスト
 		if parent:
 			parent.children.append(self)
@@ -60,10 +166,30 @@ class Scope:
 	def contains(self, lineno):
 		return self.start <= lineno <= self.end
 	
+	def moved(self, delta, parent):
+		"""子スコープも含めて行番号をdeltaだけずらした複製をparentの下に作る"""
+		scope = Scope(parent, self.start + delta, self.end + delta, self.scope_type)
+		scope.symbols = {name: info.moved(delta) for name, info in self.symbols.items()}
+		for name, infos in self.redefined.items():
+			scope.redefined[name] = [info.moved(delta) for info in infos[:-1]] + [scope.symbols[name]]
+		for child in self.children:
+			child.moved(delta, scope)
+		return scope
+	
 	def add_symbol(self, name, symbol_info):
 		"""シンボルをスコープに追加"""
+		previous = self.symbols.get(name)
+		if previous is not None:
+			self.redefined.setdefault(name, [previous]).append(symbol_info)
 		self.symbols[name] = symbol_info
 	
+	def bindings(self, name):
+		"""このスコープでnameを束縛したSymbolInfoを束縛した順に返す"""
+		if name in self.redefined:
+			return self.redefined[name]
+		info = self.symbols.get(name)
+		return [info] if info is not None else []
+	
 	def lookup_local(self, name):
 		"""現在のスコープ内のみで検索"""
 		return self.symbols.get(name)
@@ -76,13 +202,23 @@ class Scope:
 			return self.parent.lookup(name)
 		return None
 
+# 文を含みうるノード（式の中に文は現れない）。match_caseはPython 3.10から
+STATEMENT_NODES = tuple(getattr(ast, name) for name in ("stmt", "excepthandler", "match_case") if hasattr(ast, name))
+
 class ScopeCollector(ast.NodeVisitor):
-	def __init__(self, text):
+	"""スコープとシンボルを集める。
+
+	detailsがFalseの場合は色分けに必要な名前と種別だけを集め、
+	シグネチャ・ドキュメント文字列・型注釈は作らない。
+	"""
+	def __init__(self, text, details=True):
 		self.text = text
+		self.details = details
 		self.root = Scope(scope_type="module")
 		self.current = self.root
 		self.modules = {}
 		self.imported = set()
+		self.imports = {}  # インポートで束縛された名前 -> (行, モジュール, インポートした名前またはNone)
 
 	# ---------- scope helpers ----------
 	def push_scope(self, node, scope_type):
@@ -98,19 +234,23 @@ class ScopeCollector(ast.NodeVisitor):
 	def pop_scope(self):
 		self.current = self.current.parent
 
+	def generic_visit(self, node):
+		# 集めるのは文だけなので、式の中には入らない
+		for field in node._fields:
+			value = getattr(node, field, None)
+			if isinstance(value, list):
+				for item in value:
+					if isinstance(item, STATEMENT_NODES):
+						self.visit(item)
+
 	# ---------- definitions ----------
 	def visit_ClassDef(self, node):
-		# クラスの情報を収集
-		docstring = ast.get_docstring(node)
-		bases = [ast.unparse(base) for base in node.bases] if node.bases else []
-		signature = f"({', '.join(bases)})" if bases else ""
-		
+		# クラスの情報を収集（シグネチャとドキュメント文字列は参照時に作る）
 		symbol_info = SymbolInfo(
 			name=node.name,
 			kind=SymbolKind.Class,
 			lineno=node.lineno,
-			signature=signature,
-			docstring=docstring
+			node=detail_node(node) if self.details else None
 		)
 		self.current.add_symbol(node.name, symbol_info)
 		
@@ -125,51 +265,19 @@ class ScopeCollector(ast.NodeVisitor):
 		self._visit_function(node)
 
 	def _visit_function(self, node):
-		# 関数の情報を収集
-		docstring = ast.get_docstring(node)
-		
-		# シグネチャを構築
-		args = []
-		defaults_offset = len(node.args.args) - len(node.args.defaults)
-		
-		for i, arg in enumerate(node.args.args):
-			arg_str = arg.arg
-			if arg.annotation:
-				arg_str += f": {ast.unparse(arg.annotation)}"
-			default_idx = i - defaults_offset
-			if default_idx >= 0 and default_idx < len(node.args.defaults):
-				arg_str += f" = {ast.unparse(node.args.defaults[default_idx])}"
-			args.append(arg_str)
-		
-		if node.args.vararg:
-			vararg_str = f"*{node.args.vararg.arg}"
-			if node.args.vararg.annotation:
-				vararg_str += f": {ast.unparse(node.args.vararg.annotation)}"
-			args.append(vararg_str)
-		
-		if node.args.kwarg:
-			kwarg_str = f"**{node.args.kwarg.arg}"
-			if node.args.kwarg.annotation:
-				kwarg_str += f": {ast.unparse(node.args.kwarg.annotation)}"
-			args.append(kwarg_str)
-		
-		signature = f"({', '.join(args)})"
-		if node.returns:
-			signature += f" -> {ast.unparse(node.returns)}"
-		
+		# 関数の情報を収集（シグネチャとドキュメント文字列は参照時に作る）
 		symbol_info = SymbolInfo(
 			name=node.name,
 			kind=SymbolKind.Function,
 			lineno=node.lineno,
-			signature=signature,
-			docstring=docstring
+			node=detail_node(node) if self.details else None
 		)
 		self.current.add_symbol(node.name, symbol_info)
 		
 		# 関数の引数もローカルスコープに追加
 		self.push_scope(node, "function")
 		for arg in node.args.args:
-			arg_type = ast.unparse(arg.annotation) if arg.annotation else None
+			arg_type = ast.unparse(arg.annotation) if arg.annotation and self.details else None
 			arg_info = SymbolInfo(
 				name=arg.arg,
 				kind=SymbolKind.Variable,
@@ -213,7 +321,7 @@ class ScopeCollector(ast.NodeVisitor):
 
 	def visit_AnnAssign(self, node):
 		if isinstance(node.target, ast.Name):
-			type_hint = ast.unparse(node.annotation) if node.annotation else None
+			type_hint = ast.unparse(node.annotation) if node.annotation and self.details else None
 			var_info = SymbolInfo(
 				name=node.target.id,
 				kind=SymbolKind.Variable,
@@ -228,31 +336,288 @@ class ScopeCollector(ast.NodeVisitor):
 		for alias in node.names:
 			self.modules[alias.name] = {}
 			self.imported.add(alias.asname or alias.name)
+			if alias.asname:
+				self.imports.setdefault(alias.asname, (node.lineno, alias.name, None))
+			else:
+				# import a.b は a を束縛する
+				head = alias.name.split('.')[0]
+				self.imports.setdefault(head, (node.lineno, head, None))
 
 	def visit_ImportFrom(self, node):
 		if node.module:
 			self.modules.setdefault(node.module, {})
 			for alias in node.names:
 				self.imported.add(alias.asname or alias.name)
+		# 相対インポートはモジュール名の前に点を付けて残す
+		module = '.' * node.level + (node.module or "")
+		for alias in node.names:
+			if alias.name != '*':
+				self.imports.setdefault(alias.asname or alias.name, (node.lineno, module, alias.name))
+
+class SemanticChunk:
+	"""最上位の文（同じ行にかかる文はまとめる）1つ分の解析結果。startは先頭の行番号"""
+	def __init__(self, start, scope, modules, imported, imports):
+		self.start = start
+		self.scope = scope  # この文で定義されたシンボルと子スコープを持つモジュールスコープ
+		self.modules = modules
+		self.imported = imported
+		self.imports = imports
+
+	def moved(self, start):
+		"""先頭がstart行に移った結果を返す"""
+		if start == self.start:
+			return self
+		delta = start - self.start
+		scope = self.scope.moved(delta, None)
+		imports = {name: (lineno + delta, module, target) for name, (lineno, module, target) in self.imports.items()}
+		return SemanticChunk(start, scope, self.modules, self.imported, imports)
+
+def split_statements(tree):
+	"""最上位の文を (先頭行, 最終行, ノード) に分ける（デコレータを含め、行が重なる文はまとめる）"""
+	pieces = []
+	for node in tree.body:
+		start = min([node.lineno] + [decorator.lineno for decorator in getattr(node, "decorator_list", ())])
+		end = node.end_lineno
+		if pieces and start <= pieces[-1][1]:
+			pieces[-1][1] = max(pieces[-1][1], end)
+			pieces[-1][2].append(node)
+		else:
+			pieces.append([start, end, [node]])
+	return pieces
+
+def group_statements(statements, pieces):
+	"""split_lines の区切りごとに split_statements の文をまとめ、(先頭行, 最終行, ノード) のリストを返す。
+
+	文が複数の区切りにまたがる（複数行の文字列の途中の行が区切りになった）場合は区切りをつなげる。
+	合わせられなければNone。
+	"""
+	grouped = []
+	index = 0
+	reach = 0  # まとめた文の最終行
+	for start, end in pieces:
+		if grouped and start <= reach:
+			grouped[-1][1] = end
+		else:
+			grouped.append([start, end, []])
+		while index < len(statements) and statements[index][0] <= end:
+			grouped[-1][2].extend(statements[index][2])
+			reach = max(reach, statements[index][1])
+			index += 1
+	if index < len(statements) or reach > (grouped[-1][1] if grouped else 0) or not all(nodes for _, _, nodes in grouped):
+		return None
+	return grouped
+
+def chunk_spans(chunks):
+	"""複数行の文の 先頭行 -> 行数の集合（いくつかの区切りにまたがる文を解析せずに見つけるのに使う）"""
+	spans = {}
+	for source in chunks:
+		head, newline, _ = source.partition('\n')
+		if newline:
+			spans.setdefault(head, set()).add(source.count('\n') + 1)
+	return spans
+
+def is_unfinished(error):
+	"""構文エラーが、文が途中で終わっている（複数行の文字列や括弧が閉じていない）ためのものか"""
+	message = error.msg or ""
+	return "never closed" in message or "unterminated triple-quoted" in message or "EOF" in message
+
+CONTINUATION_KEYWORDS = ("else", "elif", "except", "finally")
+MERGE_LIMIT = 16  # 解析できない文を後ろの区切りとつなげて解析してみる数
+
+def split_lines(lines):
+	"""インデントされていない行で文を区切る（変わった文だけを解析する場合と、構文エラーがある場合に使う）。
+
+	(先頭行, 最終行) のリストを返す。末尾の空行とコメント行は文に含めない。
+	"""
+	starts = [0]
+	decorated = lines[0].startswith('@') if lines else False
+	for num in range(1, len(lines)):
+		line = lines[num]
+		head = line[:1]
+		if not head or not (head.isalpha() or head in '_@'):
+			continue
+		if line.split(None, 1)[0].rstrip(':') in CONTINUATION_KEYWORDS:
+			continue
+		if decorated:
+			# デコレータの後のdef/classは同じ文
+			decorated = head == '@'
+			continue
+		decorated = head == '@'
+		starts.append(num)
+	pieces = []
+	for start, stop in zip(starts, starts[1:] + [len(lines)]):
+		end = stop
+		while end > start and (not lines[end - 1].strip() or lines[end - 1].lstrip().startswith('#')):
+			end -= 1
+		if end > start:
+			pieces.append((start + 1, end))
+	return pieces
 
 class Semantic:
-	def __init__(self, text):
+	"""detailsがFalseの場合は色分け用にシンボルの名前と種別だけを集める（ScopeCollector参照）"""
+	def __init__(self, text, chunks=None, details=True):
 		self.text = text
+		self.details = details
 		self.root = Scope(scope_type="module")
 		self.modules = {}
 		self.imported = set()
-		self.analyze(text)
+		self.imports = {}  # ScopeCollector.imports
+		# 最上位の文ごとの解析結果 {文のソース: SemanticChunk}。chunksを渡した場合のみ保持する
+		self.chunks = None
+		self._scope_index = None  # 行番号 -> 最も内側のスコープ（find_scopeで作る）
+		self._definitions = None  # definition_indexで作る
+		self.analyze(text, chunks)
 
-	def analyze(self, text):
-		try:
-			tree = ast.parse(text)
-		except SyntaxError:
-			return
-		collector = ScopeCollector(text)
-		collector.visit(tree)
-		self.root = collector.root
-		self.modules = collector.modules
-		self.imported = collector.imported
+	def analyze(self, text, chunks=None):
+		"""解析する。chunks（前回のSemanticのchunks）を渡すと、最上位の文ごとに
+		前回と同じソースの文は解析結果を使い回し、変わった文だけを解析する。
+
+		前回の結果がある場合は全体を解析せず、インデントされていない行で区切った文（split_lines）の
+		うち変わったものだけを解析する。解析できない文が残った場合だけ全体を解析し、解析できれば
+		文の境界で分け直す。全体にも構文エラーがある場合は解析できた文だけを使う。
+		"""
+		self._scope_index = None
+		self._definitions = None
+		lines = text.split('\n')
+		tree = None
+		if chunks:
+			used, collected, unfinished = self.collect_pieces(text, lines, split_lines(lines), chunks)
+			if unfinished:
+				try:
+					tree = ast.parse(text)
+				except SyntaxError:
+					pass
+			if tree is None:
+				for chunk in collected:
+					self.add_chunk(chunk)
+				self.chunks = used
+				return
+		else:
+			try:
+				tree = ast.parse(text)
+			except SyntaxError:
+				pass
+			if tree is not None and chunks is None:
+				collector = ScopeCollector(text, self.details)
+				collector.visit(tree)
+				self.root = collector.root
+				self.modules = collector.modules
+				self.imported = collector.imported
+				self.imports = collector.imports
+				return
+		
+		if tree is None:
+			pieces = split_lines(lines)
+		else:
+			# 次の解析で同じ文を見つけられるように、できるだけsplit_linesの区切りで分ける
+			statements = split_statements(tree)
+			pieces = group_statements(statements, split_lines(lines)) or statements
+		used, collected, _ = self.collect_pieces(text, lines, pieces, chunks or {})
+		for chunk in collected:
+			self.add_chunk(chunk)
+		if chunks is not None:
+			self.chunks = used
+	
+	def collect_pieces(self, text, lines, pieces, chunks):
+		"""piecesの文ごとの解析結果を作る。chunksに同じソースの文があれば使い回す。
+
+		構文木のない文が途中で終わっていて解析できなければ（複数行の文字列や括弧が閉じていない）、
+		後ろの区切りに続いているとみてつなげる（reuse_merged, merge_pieces）。それ以外の構文エラーの文は飛ばす。
+		({文のソース: SemanticChunk}, 文の順のSemanticChunkのリスト, つなげても解析できなかった文の数) を返す。
+		"""
+		used = {}
+		collected = []
+		unfinished = 0
+		spans = None
+		index = 0
+		while index < len(pieces):
+			start, end, *nodes = pieces[index]
+			index += 1
+			source = '\n'.join(lines[start - 1:end])
+			chunk = used.get(source) or chunks.get(source)
+			if chunk is not None:
+				chunk = chunk.moved(start)
+			elif nodes:
+				chunk = self.collect(text, source, start, nodes[0])
+			else:
+				if spans is None:
+					spans = chunk_spans(chunks)
+				merged = self.reuse_merged(lines, pieces, index, used, chunks, spans)
+				if merged is None:
+					try:
+						chunk = self.collect(text, source, start)
+					except SyntaxError as e:
+						if is_unfinished(e):
+							merged = self.merge_pieces(text, lines, pieces, index, used, chunks)
+							if merged is None:
+								unfinished += 1
+				if merged is not None:
+					chunk, source, index = merged
+			if chunk is None:
+				continue
+			used[source] = chunk
+			collected.append(chunk)
+		return used, collected, unfinished
+	
+	def reuse_merged(self, lines, pieces, index, used, chunks, spans):
+		"""index - 1番目の区切りから始まり、前回いくつかの区切りをつないで解析した文があれば、解析せずに使い回す。
+
+		(SemanticChunk, ソース, 次の区切りの位置) を返す（無ければNone）。
+		"""
+		start = pieces[index - 1][0]
+		for count in spans.get(lines[start - 1], ()):
+			last = start - 1 + count
+			following = index
+			while following < len(pieces) and pieces[following][1] <= last:
+				following += 1
+			if following > index and pieces[following - 1][1] == last:
+				source = '\n'.join(lines[start - 1:last])
+				chunk = used.get(source) or chunks.get(source)
+				if chunk is not None:
+					return chunk.moved(start), source, following
+		return None
+	
+	def merge_pieces(self, text, lines, pieces, index, used, chunks):
+		"""途中で終わっているindex - 1番目の区切りを、MERGE_LIMIT個までの後ろの区切りとつなげて解析する。
+
+		(SemanticChunk, ソース, 次の区切りの位置) を返す（解析できなければNone）。
+		"""
+		start = pieces[index - 1][0]
+		for following in range(index, min(len(pieces), index + MERGE_LIMIT)):
+			source = '\n'.join(lines[start - 1:pieces[following][1]])
+			chunk = used.get(source) or chunks.get(source)
+			if chunk is not None:
+				return chunk.moved(start), source, following + 1
+			try:
+				return self.collect(text, source, start), source, following + 1
+			except SyntaxError as e:
+				if not is_unfinished(e):
+					return None
+		return None
+	
+	def collect(self, text, source, start, nodes=None):
+		"""1つの文を解析する。nodesがない場合はsourceを解析する（構文エラーならSyntaxErrorを送出する）"""
+		if nodes is None:
+			tree = ast.parse(source)
+			ast.increment_lineno(tree, start - 1)
+			nodes = tree.body
+		collector = ScopeCollector(text, self.details)
+		for node in nodes:
+			collector.visit(node)
+		return SemanticChunk(start, collector.root, collector.modules, collector.imported, collector.imports)
+	
+	def add_chunk(self, chunk):
+		for name in chunk.scope.symbols:
+			for info in chunk.scope.bindings(name):
+				self.root.add_symbol(name, info)
+		for child in chunk.scope.children:
+			child.parent = self.root
+			self.root.children.append(child)
+		for module in chunk.modules:
+			self.modules.setdefault(module, {})
+		self.imported.update(chunk.imported)
+		for name, entry in chunk.imports.items():
+			self.imports.setdefault(name, entry)
 
 	def lookup(self, name, lineno):
 		"""指定された行番号のスコープでシンボルを検索"""
@@ -261,6 +626,85 @@ class Semantic:
 			return scope.lookup(name)
 		return None
 	
+	def symbol_info(self, name, lineno):
+		"""ホバー用にlineno行でのnameの情報を返す。
+
+		スコープで見つからなければインポート先、それも無ければ他のスコープの定義
+		（obj.methodのような属性）を探す。
+		"""
+		return self.definition(name, lineno) or self.import_info(name) or self.any_definition(name, lineno)
+	
+	def definition_index(self):
+		"""名前 -> {スコープ: (行番号のリスト, SymbolInfoのリスト)} の索引（行番号順）"""
+		index = self._definitions
+		if index is None:
+			index = {}
+			stack = [self.root]
+			while stack:
+				scope = stack.pop()
+				redefined = scope.redefined
+				for name, info in scope.symbols.items():
+					if name in redefined:
+						infos = sorted(redefined[name], key=lambda info: info.lineno)
+						entry = ([info.lineno for info in infos], infos)
+					else:
+						entry = ((info.lineno,), (info,))
+					entries = index.get(name)
+					if entries is None:
+						index[name] = {scope: entry}
+					else:
+						entries[scope] = entry
+				stack.extend(scope.children)
+			self._definitions = index
+		return index
+	
+	def definition(self, name, lineno):
+		"""lineno行から見えるnameの定義を返す。
+
+		内側のスコープから順に探し（メソッドの中からクラスの本体の名前は見えない）、
+		同じスコープで何度も束縛されていればlineno行より前の最後のものを返す。
+		"""
+		entries = self.definition_index().get(name)
+		if not entries:
+			return None
+		inner = scope = self.find_scope(lineno)
+		while scope:
+			if scope is inner or scope.scope_type != "class":
+				found = entries.get(scope)
+				if found:
+					lines, infos = found
+					return infos[max(bisect_right(lines, lineno) - 1, 0)]
+			scope = scope.parent
+		return None
+	
+	def any_definition(self, name, lineno=0):
+		"""スコープに関係なくnameの定義を返す（lineno行を囲むクラスのもの、無ければ最初のもの）"""
+		entries = self.definition_index().get(name)
+		if not entries:
+			return None
+		# self.nameなどは囲んでいるクラスのメンバーを優先する
+		scope = self.find_scope(lineno)
+		while scope:
+			if scope.scope_type == "class" and scope in entries:
+				return entries[scope][1][0]
+			scope = scope.parent
+		return min((infos[0] for _, infos in entries.values()), key=lambda info: info.lineno)
+	
+	def import_info(self, name):
+		"""インポートされた名前の情報（インポート先のモジュールは共有キャッシュから引く）"""
+		entry = self.imports.get(name)
+		if entry is None:
+			return None
+		lineno, module_name, target = entry
+		if target is None:
+			return SymbolInfo(name=name, kind=SymbolKind.Variable, lineno=lineno, type_hint=f"module '{module_name}'")
+		module = get_module_semantic(module_name, details=True)
+		if module:
+			info = module.root.lookup_local(target)
+			if info:
+				return info
+		return SymbolInfo(name=name, kind=SymbolKind.Variable, lineno=lineno, type_hint=f"from {module_name}")
+	
 	def lookup_local(self, name, lineno):
 		"""指定された行番号のスコープ内のみでシンボルを検索"""
 		scope = self.find_scope(lineno)
@@ -268,20 +712,31 @@ class Semantic:
 			return scope.lookup_local(name)
 		return None
 
-	def find_scope(self, lineno, scope=None):
+	def find_scope(self, lineno):
 		"""指定された行番号を含む最も内側のスコープを取得"""
-		if scope is None:
-			scope = self.root
-		
-		if not scope.contains(lineno):
-			return None
-		
-		# 子スコープを検索
-		for child in scope.children:
-			if child.contains(lineno):
-				return self.find_scope(lineno, child)
-		
-		return scope
+		index = self._scope_index
+		if index is None:
+			index = self._scope_index = self.build_scope_index()
+		if 0 <= lineno < len(index):
+			return index[lineno]
+		return self.root if self.root.contains(lineno) else None
+	
+	def build_scope_index(self):
+		"""行番号から最も内側のスコープを引くリストを作る"""
+		size = 0
+		stack = list(self.root.children)
+		while stack:
+			scope = stack.pop()
+			size = max(size, scope.end + 1)
+			stack.extend(scope.children)
+		index = [self.root] * size
+		# 親を先に書き、子で上書きする。兄弟が同じ行にかかる場合は先のスコープを優先する
+		stack = list(self.root.children)
+		while stack:
+			scope = stack.pop()
+			index[scope.start:scope.end + 1] = [scope] * (scope.end - scope.start + 1)
+			stack.extend(scope.children)
+		return index
 	
 	def get_scope_chain(self, lineno):
 		"""指定された行番号のスコープチェーンを取得（内側から外側へ）"""
@@ -292,6 +747,27 @@ class Semantic:
 			scope = scope.parent
 		return chain
 	
+	def describe_all(self):
+		"""すべてのシンボルのシグネチャとドキュメント文字列を作り、定義ノードを手放す"""
+		stack = [self.root]
+		while stack:
+			scope = stack.pop()
+			for name in scope.symbols:
+				for info in scope.bindings(name):
+					if info._node is not None:
+						info._describe()
+			stack.extend(scope.children)
+	
+	def symbol_key(self):
+		"""行番号に依存しないスコープ構成とシンボル種別のキーを返す"""
+		key = []
+		stack = [self.root]
+		while stack:
+			scope = stack.pop()
+			key.append((scope.scope_type, len(scope.children), frozenset((name, info.kind) for name, info in scope.symbols.items())))
+			stack.extend(reversed(scope.children))
+		return tuple(key), frozenset(self.imported), tuple(self.modules)
+
 	def get_all_symbols_at_line(self, lineno):
 		"""指定された行で利用可能なすべてのシンボルを取得"""
 		symbols = {}
@@ -301,167 +777,119 @@ class Semantic:
 			scope = scope.parent
 		return symbols
 
+# 多くのオブジェクトから参照され、1つの解析結果の大きさには数えないもの
+SHARED_TYPES = (type, types.ModuleType, types.FunctionType, Enum)
+
+def retained_size(root):
+	"""rootからたどれるオブジェクトのバイト数の合計（ModuleCacheの見積もりに使う）"""
+	seen = set()
+	stack = [root]
+	total = 0
+	while stack:
+		obj = stack.pop()
+		if id(obj) in seen or isinstance(obj, SHARED_TYPES):
+			continue
+		seen.add(id(obj))
+		total += sys.getsizeof(obj)
+		stack.extend(gc.get_referents(obj))
+	return total
+
 def get_module_file(module):
-	try:
-		spec = importlib.util.find_spec(module)
-		if spec and spec.origin:
-			if spec.origin.endswith('.pyd'):
-				return spec.origin.rstrip('.pyd') + '.pyi'
-			elif spec.origin == 'built-in' or spec.origin == 'frozen':
-				return None
-			return spec.origin
-		return None
-	except:
-		return None
+	"""モジュールのソースファイルのパス（インポートはしない。Resolver参照）"""
+	return module_resolver.find(module)
 
+class ModuleCache:
+	"""インポート先モジュールのSemanticをプロセス全体で共有するLRUキャッシュ。
 
-def get_symbol_info(text, symbol_name, lineno=1):
-	"""テキスト内のシンボルの詳細情報を取得"""
-	try:
-		tree = ast.parse(text)
-	except SyntaxError:
-		return None
-	
-	for node in ast.walk(tree):
-		# クラス定義
-		if isinstance(node, ast.ClassDef) and node.name == symbol_name:
-			docstring = ast.get_docstring(node)
-			bases = [ast.unparse(base) for base in node.bases] if node.bases else []
-			signature = f"({', '.join(bases)})" if bases else ""
-			return SymbolInfo(
-				name=symbol_name,
-				kind=SymbolKind.Class,
-				lineno=node.lineno,
-				signature=signature,
-				docstring=docstring
-			)
-		
-		# 関数定義
-		if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)) and node.name == symbol_name:
-			docstring = ast.get_docstring(node)
-			# シグネチャを構築
-			args = []
-			defaults_offset = len(node.args.args) - len(node.args.defaults)
-			
-			for i, arg in enumerate(node.args.args):
-				arg_str = arg.arg
-				if arg.annotation:
-					arg_str += f": {ast.unparse(arg.annotation)}"
-				default_idx = i - defaults_offset
-				if default_idx >= 0 and default_idx < len(node.args.defaults):
-					arg_str += f" = {ast.unparse(node.args.defaults[default_idx])}"
-				args.append(arg_str)
-			
-			if node.args.vararg:
-				vararg_str = f"*{node.args.vararg.arg}"
-				if node.args.vararg.annotation:
-					vararg_str += f": {ast.unparse(node.args.vararg.annotation)}"
-				args.append(vararg_str)
-			
-			if node.args.kwarg:
-				kwarg_str = f"**{node.args.kwarg.arg}"
-				if node.args.kwarg.annotation:
-					kwarg_str += f": {ast.unparse(node.args.kwarg.annotation)}"
-				args.append(kwarg_str)
-			
-			signature = f"({', '.join(args)})"
-			if node.returns:
-				signature += f" -> {ast.unparse(node.returns)}"
-			
-			return SymbolInfo(
-				name=symbol_name,
-				kind=SymbolKind.Function,
-				lineno=node.lineno,
-				signature=signature,
-				docstring=docstring
-			)
+	(パス, 更新時刻, サイズ) が一致する間は再解析しない。解析結果がたどれるオブジェクトの
+	大きさ（retained_size。ソースの十倍ほどになる）でメモリ量を見積もり、max_bytesを超えたら
+	古いものから破棄する。
+	storeを指定すると解析結果を保存し、次回起動時に再利用する（SemanticStore参照）。
+
+	通常は色分け用（details=False）のSemanticを返す。ツールチップのために
+	シグネチャやドキュメント文字列が必要な場合はdetails=Trueで取得する
+	（すべて作ってから構文木を手放す。保存はしない）。
+	"""
+	VERSION = 5
+
+	def __init__(self, max_bytes=64 * 1024 * 1024, store=None):
+		self.max_bytes = max_bytes
+		self.store = store
+		self._entries = OrderedDict()  # (path, details) -> (stamp, size, semantic)
+		self._total = 0
+		self._lock = threading.Lock()
+
+	def get(self, path, details=False):
+		"""ファイルのSemanticを取得（読み込めない場合はNone）"""
+		try:
+			st = os.stat(path)
+		except OSError:
+			return None
+		stamp = (st.st_mtime_ns, st.st_size)
+		key = (path, details)
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry and entry[0] == stamp:
+				self._entries.move_to_end(key)
+				return entry[2]
 		
-		# 変数代入（型注釈付き）
-		if isinstance(node, ast.AnnAssign):
-			if isinstance(node.target, ast.Name) and node.target.id == symbol_name:
-				type_hint = ast.unparse(node.annotation) if node.annotation else None
-				return SymbolInfo(
-					name=symbol_name,
-					kind=SymbolKind.Variable,
-					lineno=node.lineno,
-					type_hint=type_hint
-				)
+		store = None if details else self.store
+		semantic = store.load(path, "semantic", self.VERSION, stamp) if store else None
+		if semantic is None:
+			try:
+				with open(path, 'rb') as f:
+					data = f.read()
+				# 更新時刻だけ変わった場合は内容のハッシュで保存済みの結果を使う
+				semantic = store.load(path, "semantic", self.VERSION, stamp, data) if store else None
+				if semantic is None:
+					semantic = Semantic(data.decode('utf-8', errors='ignore'), details=details)
+					# モジュールの本文は保持しない
+					semantic.text = None
+					if details:
+						semantic.describe_all()
+					if store:
+						store.save(path, "semantic", self.VERSION, stamp, data, semantic)
+			except Exception as e:
+				print(f"Error loading module from {path}: {e}")
+				return None
+		size = retained_size(semantic)
 		
-		# 通常の変数代入
-		if isinstance(node, ast.Assign):
-			for target in node.targets:
-				if isinstance(target, ast.Name) and target.id == symbol_name:
-					# 値から型を推測
-					type_hint = None
-					if isinstance(node.value, ast.Constant):
-						type_hint = type(node.value.value).__name__
-					elif isinstance(node.value, ast.List):
-						type_hint = "list"
-					elif isinstance(node.value, ast.Dict):
-						type_hint = "dict"
-					elif isinstance(node.value, ast.Set):
-						type_hint = "set"
-					elif isinstance(node.value, ast.Tuple):
-						type_hint = "tuple"
-					elif isinstance(node.value, ast.Call):
-						if isinstance(node.value.func, ast.Name):
-							type_hint = node.value.func.id
-						elif isinstance(node.value.func, ast.Attribute):
-							type_hint = node.value.func.attr
-					
-					return SymbolInfo(
-						name=symbol_name,
-						kind=SymbolKind.Variable,
-						lineno=node.lineno,
-						type_hint=type_hint
-					)
-	
-	return None
+		with self._lock:
+			old = self._entries.pop(key, None)
+			if old:
+				self._total -= old[1]
+			self._entries[key] = (stamp, size, semantic)
+			self._total += size
+			while self._total > self.max_bytes and len(self._entries) > 1:
+				_, (_, size, _) = self._entries.popitem(last=False)
+				self._total -= size
+		return semantic
+
+	def get_module(self, module, details=False):
+		"""モジュール名からSemanticを取得（ワークスペース内のモジュールを優先する）"""
+		file = (workspace_index.module_file(module) or get_module_file(module)) if module else None
+		if not file:
+			return None
+		return self.get(file, details)
+
+	def clear(self):
+		with self._lock:
+			self._entries.clear()
+			self._total = 0
+
+module_cache = ModuleCache(store=semantic_store)
+
+def get_module_semantic(module, details=False):
+	"""共有キャッシュからモジュールのSemanticを取得（detailsはModuleCache参照）"""
+	return module_cache.get_module(module, details)
+
+
+def get_symbol_info(text, symbol_name, lineno=1):
+	"""テキスト内のシンボルの詳細情報を取得（lineno行のスコープから見える定義を優先する）"""
+	semantic = Semantic(text)
+	return semantic.definition(symbol_name, lineno) or semantic.any_definition(symbol_name, lineno)
 
 
 def get_import_info(text, symbol_name):
 	"""インポートされたシンボルの情報を取得"""
-	try:
-		tree = ast.parse(text)
-	except SyntaxError:
-		return None
-	
-	for node in ast.walk(tree):
-		# import module
-		if isinstance(node, ast.Import):
-			for alias in node.names:
-				actual_name = alias.asname or alias.name
-				if actual_name == symbol_name:
-					return SymbolInfo(
-						name=symbol_name,
-						kind=SymbolKind.Variable,
-						lineno=node.lineno,
-						type_hint=f"module '{alias.name}'"
-					)
-		
-		# from module import name
-		if isinstance(node, ast.ImportFrom):
-			for alias in node.names:
-				actual_name = alias.asname or alias.name
-				if actual_name == symbol_name:
-					module_name = node.module or ""
-					# インポート先のモジュールから情報を取得
-					module_file = get_module_file(module_name)
-					if module_file:
-						try:
-							with open(module_file, 'r', encoding='utf-8') as f:
-								module_text = f.read()
-							info = get_symbol_info(module_text, alias.name)
-							if info:
-								return info
-						except:
-							pass
-					
-					return SymbolInfo(
-						name=symbol_name,
-						kind=SymbolKind.Variable,
-						lineno=node.lineno,
-						type_hint=f"from {module_name}"
-					)
-	
-	return None
+	return Semantic(text).import_info(symbol_name)
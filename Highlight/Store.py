@@ -0,0 +1,119 @@
+"""解析結果をファイルごとに保存するsqliteの永続キャッシュ"""
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+
+def default_cache_dir():
+	"""解析結果を保存するユーザーキャッシュディレクトリ"""
+	base = os.environ.get("LOCALAPPDATA") or os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+	return os.path.join(base, "PyCode2", "semantic")
+
+def content_hash(data):
+	return hashlib.sha1(data).hexdigest()
+
+class SemanticStore:
+	"""(パス, 種類) ごとに解析結果をpickleで保存する。
+
+	保存時の (更新時刻, サイズ) が一致すればファイルを読まずに返す。一致しなくても
+	内容のハッシュが同じなら有効とみなす（チェックアウトなどで更新時刻だけ
+	変わった場合に解析し直さない）。versionが違う結果は使わない。
+	"""
+	def __init__(self, path):
+		self.path = path
+		self._conn = None
+		self._failed = False
+		self._lock = threading.Lock()
+
+	def _connect(self):
+		if self._conn is None and not self._failed:
+			try:
+				os.makedirs(os.path.dirname(self.path), exist_ok=True)
+				conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+				conn.execute("PRAGMA journal_mode=WAL")
+				conn.execute(
+					"CREATE TABLE IF NOT EXISTS entries ("
+					"path TEXT NOT NULL, kind TEXT NOT NULL, version INTEGER NOT NULL, "
+					"mtime_ns INTEGER NOT NULL, size INTEGER NOT NULL, hash TEXT NOT NULL, data BLOB NOT NULL, "
+					"PRIMARY KEY (path, kind))"
+				)
+				conn.commit()
+				self._conn = conn
+			except Exception as e:
+				print(f"Error opening semantic store {self.path}: {e}")
+				self._failed = True
+		return self._conn
+
+	def load(self, path, kind, version, stamp, data=None):
+		"""保存された結果を返す（無い、古い場合はNone）。dataはファイルの内容（bytes）"""
+		with self._lock:
+			conn = self._connect()
+			if conn is None:
+				return None
+			try:
+				row = conn.execute(
+					"SELECT version, mtime_ns, size, hash, data FROM entries WHERE path = ? AND kind = ?",
+					(path, kind)
+				).fetchone()
+				if row is None or row[0] != version:
+					return None
+				if (row[1], row[2]) != tuple(stamp):
+					if data is None or content_hash(data) != row[3]:
+						return None
+					conn.execute(
+						"UPDATE entries SET mtime_ns = ?, size = ? WHERE path = ? AND kind = ?",
+						(stamp[0], stamp[1], path, kind)
+					)
+					conn.commit()
+				return pickle.loads(row[4])
+			except Exception:
+				return None
+
+	def save(self, path, kind, version, stamp, data, value):
+		"""結果を保存する。dataはファイルの内容（bytes）"""
+		try:
+			blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+		except Exception as e:
+			print(f"Error saving semantic cache for {path}: {e}")
+			return
+		with self._lock:
+			conn = self._connect()
+			if conn is None:
+				return
+			try:
+				conn.execute(
+					"INSERT OR REPLACE INTO entries (path, kind, version, mtime_ns, size, hash, data) VALUES (?, ?, ?, ?, ?, ?, ?)",
+					(path, kind, version, stamp[0], stamp[1], content_hash(data), blob)
+				)
+				conn.commit()
+			except Exception as e:
+				print(f"Error saving semantic cache for {path}: {e}")
+
+	def prune(self, root=None):
+		"""無くなったファイルの結果を削除し、削除した数を返す（rootを渡すとその下だけ調べる）"""
+		with self._lock:
+			conn = self._connect()
+			if conn is None:
+				return 0
+			try:
+				if root:
+					prefix = os.path.join(root, "")
+					paths = [row[0] for row in conn.execute("SELECT DISTINCT path FROM entries WHERE substr(path, 1, ?) = ?", (len(prefix), prefix))]
+				else:
+					paths = [row[0] for row in conn.execute("SELECT DISTINCT path FROM entries")]
+				stale = [(path,) for path in paths if not os.path.exists(path)]
+				conn.executemany("DELETE FROM entries WHERE path = ?", stale)
+				conn.commit()
+				return len(stale)
+			except Exception:
+				return 0
+
+	def clear(self):
+		with self._lock:
+			conn = self._connect()
+			if conn is not None:
+				conn.execute("DELETE FROM entries")
+				conn.commit()
+
+semantic_store = SemanticStore(os.path.join(default_cache_dir(), "semantic.sqlite3"))
@@ -0,0 +1,119 @@
+"""行ごとのトークンを平坦な配列で保持する"""
+from array import array
+import threading
+from pygments.token import string_to_tokentype
+
+# トークン種別の番号表（プロセス全体で共有）
+TOKEN_TYPES = []
+_TOKEN_IDS = {}
+_lock = threading.Lock()
+
+def token_id(token):
+	"""トークン種別を番号に変換"""
+	tid = _TOKEN_IDS.get(token)
+	if tid is None:
+		with _lock:
+			tid = _TOKEN_IDS.get(token)
+			if tid is None:
+				tid = len(TOKEN_TYPES)
+				TOKEN_TYPES.append(token)
+				_TOKEN_IDS[token] = tid
+	return tid
+
+class TokenTable:
+	"""行ごとの (開始位置, 長さ, 種別番号) を平坦なarray('I')に詰めたトークン表。
+
+	行numのトークンは data[offsets[num]:offsets[num + 1]] に3つずつ並ぶ。
+	validが0の行は未解析（編集されて再解析待ち）を表す。
+	"""
+	def __init__(self, lines=()):
+		self.data = array('I')
+		self.offsets = array('I', [0])
+		for tokens in lines:
+			for token, value, offset in tokens:
+				self.data.extend((offset, len(value), token_id(token)))
+			self.offsets.append(len(self.data))
+		self.valid = bytearray(b'\x01') * (len(self.offsets) - 1)
+
+	def __len__(self):
+		return len(self.valid)
+
+	def __bool__(self):
+		return len(self.valid) > 0
+
+	def copy(self):
+		table = TokenTable()
+		table.data = array('I', self.data)
+		table.offsets = array('I', self.offsets)
+		table.valid = bytearray(self.valid)
+		return table
+
+	def span(self, num):
+		"""行numのdata上の範囲。未解析ならNone"""
+		if num >= len(self.valid) or not self.valid[num]:
+			return None
+		return self.offsets[num], self.offsets[num + 1]
+
+	def tokens(self, num, text):
+		"""行numのトークンを (種別, 文字列, 位置) のリストで返す。textはその行の本文"""
+		data = self.data
+		return [
+			(TOKEN_TYPES[data[i + 2]], text[data[i]:data[i] + data[i + 1]], data[i])
+			for i in range(self.offsets[num], self.offsets[num + 1], 3)
+		]
+
+	def slice(self, start, end):
+		"""start行からend行の手前までを新しい表にして返す"""
+		a = self.offsets[start]
+		table = TokenTable()
+		table.data = self.data[a:self.offsets[end]]
+		table.offsets = array('I', [offset - a for offset in self.offsets[start:end + 1]])
+		table.valid = self.valid[start:end]
+		return table
+
+	def same_line(self, num, other, other_num):
+		"""2つの表の行が同じトークン列かどうか"""
+		if not self.valid[num] or not other.valid[other_num]:
+			return False
+		return self.data[self.offsets[num]:self.offsets[num + 1]] == other.data[other.offsets[other_num]:other.offsets[other_num + 1]]
+
+	def changed_lines(self, other):
+		"""selfの行をotherで置き換えたときにトークン列が変わる行の番号のリスト"""
+		if self.valid == other.valid and self.offsets == other.offsets and self.data == other.data:
+			return []
+		count = len(self.valid)
+		return [num for num in range(len(other)) if num >= count or not other.same_line(num, self, num)]
+
+	def replace(self, start, end, table):
+		"""start行からend行の手前まで（endがNoneなら末尾まで）をtableの行で置き換える"""
+		if end is None:
+			end = len(self.valid)
+		a = self.offsets[start]
+		b = self.offsets[end]
+		shift = len(table.data) - (b - a)
+		self.data[a:b] = table.data
+		tail = self.offsets[end + 1:]
+		if shift:
+			tail = array('I', [offset + shift for offset in tail])
+		self.offsets[start + 1:] = array('I', [offset + a for offset in table.offsets[1:]])
+		self.offsets.extend(tail)
+		self.valid[start:end] = table.valid
+
+	def invalidate(self, start, end, count):
+		"""start行からend行の手前までを未解析のcount行で置き換える"""
+		empty = TokenTable()
+		empty.offsets = array('I', [0]) * (count + 1)
+		empty.valid = bytearray(count)
+		self.replace(start, end, empty)
+
+	def __getstate__(self):
+		# 種別番号はプロセスごとに異なるので名前も渡す
+		return [str(token) for token in TOKEN_TYPES], self.data, self.offsets, self.valid
+
+	def __setstate__(self, state):
+		names, self.data, self.offsets, self.valid = state
+		remap = [token_id(string_to_tokentype(name)) for name in names]
+		if remap != list(range(len(remap))):
+			data = self.data
+			for i in range(2, len(data), 3):
+				data[i] = remap[data[i]]
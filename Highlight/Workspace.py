@@ -0,0 +1,283 @@
+"""ワークスペース（エクスプローラーで開いているフォルダー）のシンボル索引"""
+import ast
+import os
+import threading
+from Highlight.Store import semantic_store
+
+# 索引を作らないディレクトリ
+SKIP_DIRS = {"__pycache__", "node_modules", "site-packages", "build", "dist"}
+
+def module_name(root, path):
+	"""rootからの相対パスをモジュール名にする（root外ならNone）"""
+	rel = os.path.relpath(path, root)
+	if rel.startswith(os.pardir) or os.path.isabs(rel):
+		return None
+	parts = os.path.splitext(rel)[0].split(os.sep)
+	if parts[-1] == "__init__":
+		parts.pop()
+	if not parts or not all(part.isidentifier() for part in parts):
+		return None
+	return ".".join(parts)
+
+def name_col(line, name, start=0):
+	"""行の中でnameが始まる列（見つからなければstart）"""
+	col = line.find(name, start)
+	while col >= 0:
+		end = col + len(name)
+		if (col == 0 or not (line[col - 1].isalnum() or line[col - 1] == '_')) and (end >= len(line) or not (line[end].isalnum() or line[end] == '_')):
+			return col
+		col = line.find(name, end)
+	return start
+
+def collect_definitions(text):
+	"""モジュール直下とクラス直下の定義を (モジュールからの名前, 行, 列) で返す（構文エラーならNone）。
+
+	モジュール自身は名前が空文字列になる。
+	"""
+	try:
+		tree = ast.parse(text)
+	except (SyntaxError, ValueError):
+		return None
+	lines = text.split('\n')
+	definitions = [("", 1, 0)]
+
+	def visit(body, prefix):
+		for node in body:
+			if isinstance(node, (ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)):
+				line = lines[node.lineno - 1] if node.lineno <= len(lines) else ""
+				definitions.append((f"{prefix}{node.name}", node.lineno, name_col(line, node.name, node.col_offset)))
+				if isinstance(node, ast.ClassDef):
+					visit(node.body, f"{prefix}{node.name}.")
+			elif isinstance(node, ast.Assign):
+				for target in node.targets:
+					if isinstance(target, ast.Name):
+						definitions.append((f"{prefix}{target.id}", target.lineno, target.col_offset))
+			elif isinstance(node, ast.AnnAssign):
+				if isinstance(node.target, ast.Name):
+					definitions.append((f"{prefix}{node.target.id}", node.target.lineno, node.target.col_offset))
+			elif isinstance(node, (ast.If, ast.Try)):
+				# if TYPE_CHECKING: や try: import ... の中の定義もモジュール直下として扱う
+				visit(node.body, prefix)
+				visit(node.orelse, prefix)
+				for handler in getattr(node, "handlers", ()):
+					visit(handler.body, prefix)
+
+	visit(tree.body, "")
+	return definitions
+
+class WorkspaceIndex:
+	"""ワークスペース内の*.pyの定義を 修飾名 -> (ファイル, 行, 列) で引く索引。
+
+	set_rootでバックグラウンドのスレッドがフォルダー全体を走査する。ファイルは
+	(更新時刻, サイズ) が変わった場合だけ解析し直す。保存したファイルはupdateで反映する。
+	storeを指定すると定義の一覧を保存し、次回開いたときはファイルを解析しない。
+	"""
+	VERSION = 1
+
+	def __init__(self, store=None):
+		self.store = store
+		self.root = None
+		self._files = {}  # path -> (stamp, module, [修飾名])
+		self._definitions = {}  # 修飾名 -> (path, line, col)
+		self._modules = {}  # モジュール名 -> path
+		self.version = 0  # _modulesが変わるたびに増やす（ワーカープロセスに送り直す。Pool参照）
+		self._lock = threading.Lock()
+		self._generation = 0
+		self._thread = None
+
+	def set_root(self, root):
+		"""索引するフォルダーを変え、バックグラウンドで走査する"""
+		root = os.path.abspath(root) if root else None
+		with self._lock:
+			self._generation += 1
+			generation = self._generation
+			if root != self.root:
+				self.root = root
+				self._files.clear()
+				self._definitions.clear()
+				self._modules.clear()
+				self.version += 1
+		if root:
+			self._thread = threading.Thread(target=self.scan, args=(generation,), daemon=True)
+			self._thread.start()
+
+	def cancel(self):
+		"""走査中なら中断する"""
+		with self._lock:
+			self._generation += 1
+
+	def wait(self, timeout=None):
+		"""走査が終わるまで待つ"""
+		if self._thread is not None:
+			self._thread.join(timeout)
+
+	def files(self):
+		"""ワークスペース内の*.pyを列挙する"""
+		root = self.root
+		if not root:
+			return
+		for dirpath, dirnames, filenames in os.walk(root):
+			# 隠しディレクトリと仮想環境は走査しない
+			dirnames[:] = [
+				name for name in dirnames
+				if not name.startswith('.') and name not in SKIP_DIRS and not os.path.exists(os.path.join(dirpath, name, "pyvenv.cfg"))
+			]
+			for filename in filenames:
+				if filename.endswith(".py"):
+					yield os.path.join(dirpath, filename)
+
+	def scan(self, generation=None):
+		"""ワークスペース全体を索引し、無くなったファイルを取り除く"""
+		seen = set()
+		for path in self.files():
+			if generation is not None and generation != self._generation:
+				return
+			seen.add(path)
+			self.update(path)
+		if generation is not None and generation != self._generation:
+			return
+		for path in [path for path in self._files if path not in seen]:
+			self.remove(path)
+		if self.store:
+			self.store.prune(self.root)
+
+	def update(self, path, text=None):
+		"""ファイルを索引し直す（textを渡すとファイルを読まずにそれを使う）"""
+		root = self.root
+		if not root:
+			return
+		path = os.path.abspath(path)
+		module = module_name(root, path)
+		if module is None or not path.endswith(".py"):
+			return
+		try:
+			st = os.stat(path)
+		except OSError:
+			self.remove(path)
+			return
+		stamp = (st.st_mtime_ns, st.st_size)
+		entry = self._files.get(path)
+		if text is None and entry and entry[0] == stamp:
+			return
+		store = self.store if text is None else None
+		definitions = store.load(path, "definitions", self.VERSION, stamp) if store else None
+		if definitions is None:
+			if text is None:
+				try:
+					with open(path, 'rb') as f:
+						data = f.read()
+				except OSError:
+					return
+				# 更新時刻だけ変わった場合は内容のハッシュで保存済みの結果を使う
+				definitions = store.load(path, "definitions", self.VERSION, stamp, data) if store else None
+				text = data.decode('utf-8', errors='ignore')
+			if definitions is None:
+				definitions = collect_definitions(text)
+				if definitions is None:
+					# 構文エラーの間は前回の定義を残す
+					return
+				if store:
+					store.save(path, "definitions", self.VERSION, stamp, data, definitions)
+		definitions = [(f"{module}.{name}" if name else module, line, col) for name, line, col in definitions]
+		with self._lock:
+			if root != self.root:
+				return
+			previous = self._modules.get(module)
+			self._remove(path)
+			self._files[path] = (stamp, module, [name for name, _, _ in definitions])
+			self._modules.setdefault(module, path)
+			if self._modules[module] != previous:
+				self.version += 1
+			for name, line, col in definitions:
+				self._definitions.setdefault(name, (path, line, col))
+
+	def update_later(self, path):
+		"""バックグラウンドでファイルを索引し直す（保存時に使う）"""
+		if self.root:
+			threading.Thread(target=self.update, args=(path,), daemon=True).start()
+
+	def remove(self, path):
+		with self._lock:
+			if self._remove(os.path.abspath(path)):
+				self.version += 1
+
+	def _remove(self, path):
+		"""pathの索引を取り除き、モジュールの一覧から消した場合はTrueを返す"""
+		entry = self._files.pop(path, None)
+		if not entry:
+			return False
+		_, module, names = entry
+		removed = self._modules.get(module) == path
+		if removed:
+			del self._modules[module]
+		for name in names:
+			if self._definitions.get(name, (None,))[0] == path:
+				del self._definitions[name]
+		return removed
+
+	def paths(self):
+		"""索引済みのファイルの一覧"""
+		with self._lock:
+			return list(self._files)
+
+	def stats(self):
+		"""(索引済みのファイル数, 定義の数)"""
+		with self._lock:
+			return len(self._files), len(self._definitions)
+
+	def members(self, name):
+		"""nameという名前のクラスのメンバーの定義位置 [(ファイル, 行, 列)]"""
+		with self._lock:
+			files = list(self._files.values())
+		suffix = "." + name
+		found = []
+		for _, module, names in files:
+			for qualname in names:
+				if qualname.endswith(suffix) and qualname != module + suffix and qualname.startswith(module + "."):
+					location = self._definitions.get(qualname)
+					if location:
+						found.append(location)
+		return found
+
+	def find(self, qualname):
+		"""修飾名の定義位置 (ファイル, 行, 列) を返す（無ければNone）"""
+		return self._definitions.get(qualname)
+
+	def modules(self):
+		"""(version, {モジュール名: ファイル}) を返す"""
+		with self._lock:
+			return self.version, dict(self._modules)
+
+	def use_modules(self, root, modules):
+		"""走査せずに、ほかのプロセスの索引のモジュールの一覧を使う（トークナイズのワーカープロセス用）"""
+		with self._lock:
+			self._generation += 1
+			self.root = root
+			self._modules = dict(modules)
+
+	def module_file(self, module):
+		"""ワークスペース内のモジュールのファイル（無ければNone）"""
+		return self._modules.get(module) if module else None
+
+	def module_of(self, path):
+		"""ファイルのモジュール名（ワークスペース外ならNone）"""
+		return module_name(self.root, os.path.abspath(path)) if self.root and path else None
+
+	def resolve_relative(self, path, module, level):
+		"""pathのファイルから見た相対インポート（from ..module import）の絶対モジュール名"""
+		if not level:
+			return module
+		current = self.module_of(path)
+		if current is None:
+			return None
+		parts = current.split(".")
+		if not os.path.basename(path).startswith("__init__."):
+			parts.pop()
+		if level - 1 > len(parts):
+			return None
+		parts = parts[:len(parts) - (level - 1)]
+		if module:
+			parts.append(module)
+		return ".".join(parts) or None
+
+workspace_index = WorkspaceIndex(semantic_store)
@@ -1,137 +1,337 @@
 from PySide6.QtGui import QSyntaxHighlighter, QTextCharFormat, QColor, QFont
 from PySide6.QtCore import QTimer, QObject, QThread, Signal
+from contextlib import contextmanager
+from concurrent.futures import CancelledError, TimeoutError as FutureTimeout
 from pygments.lexers import get_lexer_for_filename, get_lexer_by_name
 from pygments.token import Token, Punctuation, Name
 from pygments.util import ClassNotFound
 import json
 from Highlight.Semantic import *
+from Highlight.Incremental import ROOT_STATE, supports_incremental, lex, lex_all, line_offset, splice_range, rebase_runs, state_id, state_stack
+from Highlight.Pool import tokenize_pool, unpack, POOL_MIN_LINES
+from Highlight.TokenTable import TokenTable, TOKEN_TYPES
+from Highlight.Scheduler import RehighlightScheduler
 
 Punctuation.Bracket
 Punctuation.Bracket.Depth0
 Punctuation.Bracket.Depth1
 Punctuation.Bracket.Depth2
 
+BRACKETS = (Punctuation.Bracket.Depth0, Punctuation.Bracket.Depth1, Punctuation.Bracket.Depth2)
+
+VIEWPORT_MARGIN = 50  # 表示範囲の前後で先に解析する行数
+REHIGHLIGHT_BATCH = 500  # これより多くの行が変わった場合はスケジューラで少しずつ塗り直す
+
+class TokenizeResult:
+	"""トークナイズ結果。start行からend行の手前まで（endがNoneなら末尾まで）を置き換える"""
+	def __init__(self, start, end, lines, states, depths, cache, changed, key, generation=0):
+		self.start = start
+		self.end = end
+		self.lines = lines  # Lexerの生トークン (TokenTable)
+		self.states = states  # 行頭のLexer状態（再開できない行はNone）
+		self.depths = depths  # 行頭の括弧の深さ
+		self.cache = cache  # 色分け済みトークン (TokenTable)
+		self.changed = changed  # 再ハイライトする行（Noneなら全体）
+		self.key = key
+		self.generation = generation
+		self.semantic = None  # 解析に使ったSemantic（ワーカープロセスで解析した場合はNone）
+
 class Tokenizer(QObject):
 	finished = Signal(object)
+	partial = Signal(object)  # 全体より先に解析した表示範囲の結果
+	done = Signal()  # 取り消された場合も含めて処理が終わった
 
-	def __init__(self, text, lexer, replace):
+	def __init__(self, text, lexer, replace, previous=None, dirty=None, generation=0, pool=None, viewport=None, chunks=None):
 		super().__init__()
 		self.text = text
 		self.lexer = lexer
 		self.replace = replace
+		# previous: 前回の (lines, states, depths, cache, key)、dirty: 再解析が必要な行範囲
+		self.previous = previous
+		self.dirty = dirty
+		self.generation = generation
+		# pool: 全体解析を任せるTokenizePool
+		self.pool = pool
+		# viewport: 表示中の行範囲 (first, last)。解析中もGUIスレッドから更新される
+		self.viewport = viewport
+		# chunks: 前回のSemantic.chunks（変わっていない文の意味解析を使い回す）
+		self.chunks = chunks
+		self.semantic_analyzer = None
+		self.future = None
+		self.previews = []
+		self.cancelled = False
+	
+	def cancel(self):
+		"""不要になった解析を取り消す"""
+		self.cancelled = True
+		if self.future:
+			self.future.cancel()
+		for future in self.previews:
+			future.cancel()
 	
 	def run(self):
-		tokens = list(self.lexer.get_tokens(self.text))
-		num = 0
-		offset = 0
+		try:
+			result = None
+			if self.pool is not None and self.lexer.aliases:
+				result = self.run_in_pool()
+				if self.cancelled:
+					return
+			if result is None:
+				result = self.tokenize()
+				result.semantic = self.semantic_analyzer
+			if not self.cancelled:
+				self.finished.emit(result)
+		finally:
+			self.done.emit()
+	
+	def run_in_pool(self):
+		"""ワーカープロセスで解析する。失敗した場合はNoneを返す
+
+		表示範囲は別のジョブで先に解析してpartialで送る。解析中にスクロールされたら
+		新しい表示範囲のジョブを追加する。
+		"""
+		alias = self.lexer.aliases[0]
+		covered = bytearray(self.text.count('\n') + 1)  # 先行解析を依頼済みの行
+		self.request_preview(alias, covered)
+		self.future = self.pool.submit(self.text, alias, self.replace)
+		while True:
+			try:
+				table = self.future.result(timeout=0.05)
+				break
+			except FutureTimeout:
+				if self.cancelled:
+					return None
+				self.request_preview(alias, covered)
+				self.emit_previews()
+			except CancelledError:
+				return None
+			except Exception as e:
+				print(f"Tokenize worker failed, falling back to thread: {e}")
+				return None
+		for future in self.previews:
+			future.cancel()
+		return unpack(table, self.generation)
+	
+	def request_preview(self, alias, covered):
+		"""表示範囲にまだ依頼していない行があれば先行解析を依頼する"""
+		if not self.viewport:
+			return
+		first = max(0, self.viewport[0] - VIEWPORT_MARGIN)
+		last = min(len(covered) - 1, self.viewport[1] + VIEWPORT_MARGIN)
+		if first > last or covered.find(0, first, last + 1) < 0:
+			return
+		covered[first:last + 1] = b'\x01' * (last - first + 1)
+		self.previews.append(self.pool.submit(self.text, alias, self.replace, (first, last)))
+	
+	def emit_previews(self):
+		"""終わった先行解析の結果を送る"""
+		for future in [future for future in self.previews if future.done()]:
+			self.previews.remove(future)
+			if future.cancelled() or future.exception() is not None:
+				continue
+			self.partial.emit(unpack(future.result(), self.generation))
+	
+	def analyze(self):
+		"""意味解析を行い、シンボル構成のキーを返す"""
+		semantic_analyzer = Semantic(self.text, self.chunks)
+		self.semantic_analyzer = semantic_analyzer
+		self.imported = semantic_analyzer.imported
+		self.modulefiles = {}
+		for key in semantic_analyzer.modules.keys():
+			module = get_module_semantic(key)
+			if module:
+				self.modulefiles[key] = module
+		return semantic_analyzer.symbol_key()
+	
+	def tokenize_lines(self, first, last):
+		"""first行からlast行までだけを解析する（表示範囲の先行解析用）。
+
+		first行の状態は分からないので、行頭から解析し直した仮の結果になる。
+		"""
+		key = self.analyze()
+		texts = self.text.split('\n')
+		last = min(last, len(texts) - 1)
+		chunk = '\n'.join(texts[first:last + 1]) + '\n'
+		lines, states, depths, cache = self.lex_lines(lex_all(self.lexer, chunk), first, ROOT_STATE, 0, last - first + 1)
+		end = first + len(lines)
+		return TokenizeResult(first, end, TokenTable(lines), states, depths, TokenTable(cache), list(range(first, end)), key, self.generation)
+	
+	def tokenize(self):
+		text = self.text
+		line_count = text.count('\n') + 1
+		lex_text = text if text.endswith('\n') else text + '\n'
+		key = self.analyze()
+
+		if self.previous is None or self.dirty is None or not supports_incremental(self.lexer):
+			lines, states, depths, cache = self.lex_lines(lex_all(self.lexer, lex_text), 0, ROOT_STATE, 0, line_count)
+			return TokenizeResult(0, None, TokenTable(lines), states, depths, TokenTable(cache), None, key, self.generation)
+
+		old_lines, old_states, old_depths, old_cache, old_key = self.previous
+		first, last = self.dirty
+		# 状態が"root"と分かっている行まで遡って再開する。docstringのような複数行にまたがる
+		# 正規表現は後ろの行の編集で一致が変わる（閉じると文字列の途中の行がdocstringになる）ので、
+		# 文字列の途中など"root"以外の状態の行からは再開しない
+		while first > 0 and (old_states[first] != ROOT_STATE or old_depths[first] is None):
+			first -= 1
+		stack = old_states[first] or ROOT_STATE
+		depth = old_depths[first] or 0
+
+		def converged(line, state, brackets):
+			return line > last and line < line_count and old_states[line] == state and old_depths[line] == brackets
+
+		events = lex(self.lexer, lex_text, line_offset(lex_text, first), stack)
+		lines, states, depths, cache = self.lex_lines(events, first, stack, depth, line_count - first, converged)
+		end = first + len(lines)
+		lines = TokenTable(lines)
+
+		if key == old_key:
+			cache = TokenTable(cache)
+			changed = [first + i for i in range(len(cache)) if not cache.same_line(i, old_cache, first + i)]
+			return TokenizeResult(first, end, lines, states, depths, cache, changed, key, self.generation)
+
+		# シンボル構成が変わった場合は全行を分類し直す
+		old_lines.replace(first, end, lines)
+		states = old_states[:first] + states + old_states[end:]
+		texts = text.split('\n')
+		depths = [0] * line_count
 		cache = []
-		token_cache = {}
 		brackets = 0
-		semantic_analyzer = Semantic(self.text)
-		modules = semantic_analyzer.modules
-		imported = semantic_analyzer.imported
-		modulefiles = {}
-		for key in modules.keys():
-			file = get_module_file(key)
-			if file:
-				try:
-					with open(file, 'r', encoding='utf-8', errors='ignore') as f:
-						modulefiles[key] = Semantic(f.read())
-				except Exception as e:
-					print(f"Error loading module {key} from {file}: {e}")
-		index = 0
-		for token, value in tokens:
-			if value in (')', '}', ']') and token == Punctuation:
-				brackets = (brackets - 1)%3
+		for num in range(line_count):
+			depths[num] = brackets
+			classified, brackets = self.classify(old_lines.tokens(num, texts[num]), num + 1, brackets)
+			cache.append(classified)
+		cache = TokenTable(cache)
+		changed = [num for num in range(line_count) if not cache.same_line(num, old_cache, num)]
+		return TokenizeResult(0, line_count, old_lines, states, depths, cache, changed, key, self.generation)
+
+	def lex_lines(self, events, num, stack, brackets, count, stop=None):
+		"""字句解析の結果を行ごとに分割・分類する。stopがTrueを返した行の手前で打ち切る"""
+		lines, states, depths, cache = [], [stack], [brackets], []
+		current = []
+		offset = 0
+		for pos, token, value in events:
+			if token is None:
+				# 行頭の状態（同じ行で最初に得られたものを採用）
+				if not current and states[-1] is None:
+					states[-1] = value
+					if stop and stop(num + len(lines), value, depths[-1]):
+						states.pop()
+						depths.pop()
+						return lines, states, depths, cache
+				continue
 			if '\n' in value:
-				lines = value.split('\n')
-				for i, line in enumerate(lines):
-					if line:
-						cache.append((token, line, offset))
-						offset += len(line)
-					
-					if i < len(lines) - 1:
-						token_cache[num] = cache
-						num += 1
-						cache = []
+				parts = value.split('\n')
+				for i, part in enumerate(parts):
+					if part:
+						current.append((token, part, offset))
+						offset += len(part)
+					if i < len(parts) - 1:
+						lines.append(current)
+						classified, brackets = self.classify(current, num + len(lines), brackets)
+						cache.append(classified)
+						current = []
 						offset = 0
+						states.append(None)
+						depths.append(brackets)
 			else:
-				if value in ('(', ')', '{', '}', '[', ']') and token == Punctuation:
-					if brackets == 0:
-						bracket_token = Punctuation.Bracket.Depth0
-					elif brackets == 1:
-						bracket_token = Punctuation.Bracket.Depth1
-					elif brackets == 2:
-						bracket_token = Punctuation.Bracket.Depth2
-					
-					cache.append((bracket_token, value, offset))
-				elif str(token).replace("Token.", "") in self.replace:
-					flag = False
-					for x, y in self.replace[str(token).replace("Token.", "")]:
-						if value in x:
-							cache.append((y, value, offset))
-							flag = True
-							break
-					if not flag:
-						cache.append((token, value, offset))
-				elif token == Name:
-					kind = None
-					kind_type = "symbol"
-					if self.lexer.name == "Python":
-						kind_type = "module"
-						lineno = num + 1
-						kind = set(module.lookup(value, lineno) for module in modulefiles.values())
-						kind.discard(None)
-						if len(kind) == 1:
-							kind = kind.pop()
-						else:
-							kind_type = "symbol"
-							kind = semantic_analyzer.lookup(value, lineno)
-					token_ = None
-					if kind == SymbolKind.Class:
-						token_ = Name.Class
-					elif index > 0:
-						prev_token, prev_value = tokens[index - 1]
-						if prev_value == '.':
-							next_token, next_value = tokens[index + 1] if index + 1 < len(tokens) else (None, None)
-							if next_value == "(":
-								token_ = Name.Function
-					if not token_:
-						if kind == SymbolKind.Function and (tokens[index + 1][1] if index + 1 < len(tokens) else None) == "(":
-							token_ = Name.Function
-						elif kind == SymbolKind.Variable:
-							if value.upper() == value and kind_type == "symbol":
-								token_ = Name.Constant
-							else:
-								token_ = Name.Variable
-						elif value in imported:
-							token_ = Name.Namespace
-						elif value.upper() == value:
+				current.append((token, value, offset))
+				offset += len(value)
+		lines.append(current)
+		classified, brackets = self.classify(current, num + len(lines), brackets)
+		cache.append(classified)
+		return lines[:count], states[:count], depths[:count], cache[:count]
+
+	def classify(self, tokens, lineno, brackets):
+		"""1行分のトークンを括弧の深さやシンボルの種類で色分けする"""
+		cache = []
+		for index, (token, value, offset) in enumerate(tokens):
+			if value in (')', '}', ']') and token == Punctuation:
+				brackets = (brackets - 1)%3
+			if value in ('(', ')', '{', '}', '[', ']') and token == Punctuation:
+				cache.append((BRACKETS[brackets], value, offset))
+			elif str(token).replace("Token.", "") in self.replace:
+				flag = False
+				for x, y in self.replace[str(token).replace("Token.", "")]:
+					if value in x:
+						cache.append((y, value, offset))
+						flag = True
+						break
+				if not flag:
+					cache.append((token, value, offset))
+			elif token == Name:
+				kind = None
+				kind_type = "symbol"
+				if self.lexer.name == "Python":
+					kind_type = "module"
+					kind = set(module.root.lookup(value) for module in self.modulefiles.values())
+					kind.discard(None)
+					kind = set(info.kind for info in kind)
+					if len(kind) == 1:
+						kind = kind.pop()
+					else:
+						kind_type = "symbol"
+						kind = self.semantic_analyzer.lookup(value, lineno)
+						kind = kind.kind if kind else None
+				token_ = None
+				next_value = tokens[index + 1][1] if index + 1 < len(tokens) else None
+				if kind == SymbolKind.Class:
+					token_ = Name.Class
+				elif index > 0 and tokens[index - 1][1] == '.' and next_value == "(":
+					token_ = Name.Function
+				if not token_:
+					if kind == SymbolKind.Function and next_value == "(":
+						token_ = Name.Function
+					elif kind == SymbolKind.Variable:
+						if value.upper() == value and kind_type == "symbol":
 							token_ = Name.Constant
 						else:
-							token_ = token
-					cache.append((token_, value, offset))
-				else:
-					cache.append((token, value, offset))
-				offset += len(value)
+							token_ = Name.Variable
+					elif value in self.imported:
+						token_ = Name.Namespace
+					elif value.upper() == value:
+						token_ = Name.Constant
+					else:
+						token_ = token
+				cache.append((token_, value, offset))
+			else:
+				cache.append((token, value, offset))
 			if value in ('(', '{', '[') and token == Punctuation:
 				brackets = (brackets + 1)%3
-			index += 1
-		
-		if cache:
-			token_cache[num] = cache
-		self.finished.emit(token_cache)
+		return cache, brackets
 
 class Highlighter(QSyntaxHighlighter):
+	tokenized = Signal()  # 解析結果を反映した（エディタはこれを受けて表示範囲のシンボルを先読みする）
+
 	def __init__(self, window=None, parent=None, filename = "*.txt", style=None, lexer=None):
 		super().__init__(parent)
 		self.win = window
 		self.style = style
 		self.lexer = lexer
+		# 行ごとのキャッシュ（ブロック番号がインデックス）
+		self.token_cache = TokenTable()
+		self.lex_lines = TokenTable()
+		self.lex_states = []
+		self.bracket_depths = []
+		self.semantic_key = None
+		self.semantic = None  # 最後に解析したSemantic
+		self.highlighted = set()  # take_highlightedで最後に取り出してから色付けした行
+		self._dirty = None  # 再解析が必要な行範囲 (first, last)
+		self._full = True  # 次回は全体を解析する
+		self._generation = 0
+		self._edits = 0  # contentsChangeで数えた編集の回数（再ハイライトでは増えない）
+		self._tokenize_edits = 0  # 解析を始めたときの_edits
+		self._block_count = self.document().blockCount()
+		# 解析中の編集の記録 [(first, end, count), ...]。解析中でなければNone
+		self._journal = None
+		self._journal_dirty = None  # 解析中の編集で再解析が必要になった行範囲
+		self._deferred = False  # 解析が終わったらもう一度解析する
+		self.tokenize_thread = None
+		self.tokenize_worker = None
+		self._threads = set()  # 終了待ちのスレッド（実行中に破棄されないように持っておく）
+		self.visible_range = (0, 100)  # エディタから set_visible_range で更新される
+		self.scheduler = RehighlightScheduler(self)
 		self.set_filetype(filename)
-		self.token_cache = {}
 		self.use_cache = False
-		self._signal_connected = False
 		
 		self.tokenize_timer = QTimer()
 		self.tokenize_timer.setSingleShot(True)
@@ -139,20 +339,45 @@ class Highlighter(QSyntaxHighlighter):
 		self.tokenize_timer.timeout.connect(self.tokenize)
 
 		self.document().contentsChange.connect(self.changed)
-		self._signal_connected = True
-		self.tokenize_thread = None
-		self.tokenize_worker = None
 	
 	def changed(self, position, chars_removed, chars_added):
-		if self.tokenize_timer.isActive():
-			self.use_cache = False
-			
-			doc = self.document()
-			start_block = doc.findBlock(position)
-			end_block = doc.findBlock(position + chars_added)
-			
-			block = start_block
-			while block.isValid() and block.blockNumber() <= end_block.blockNumber():
+		self._edits += 1
+		doc = self.document()
+		first = doc.findBlock(position).blockNumber()
+		last = doc.findBlock(position + chars_added).blockNumber()
+		if last < 0:
+			last = doc.blockCount() - 1
+		# 編集前のfirst行からend行の手前が、編集後のfirst行からlast行になった
+		delta = doc.blockCount() - self._block_count
+		end = last - delta + 1
+		count = last - first + 1
+		self._block_count = doc.blockCount()
+		
+		self._dirty = splice_range(self._dirty, first, last, end, delta)
+		if self._journal is not None:
+			# 解析中の編集は、結果を反映するときに行をずらせるよう記録しておく
+			self._journal.append((first, end, count))
+			self._journal_dirty = splice_range(self._journal_dirty, first, last, end, delta)
+		
+		if self.token_cache:
+			# 変更された行を未解析にして、以降の行をずらす
+			old_count = self._block_count - delta
+			if first < end <= old_count == len(self.token_cache):
+				self.token_cache.invalidate(first, end, count)
+				if len(self.lex_lines) == old_count:
+					self.lex_lines.invalidate(first, end, count)
+					self.lex_states[first + 1:end] = [None] * (count - 1)
+					self.bracket_depths[first + 1:end] = [None] * (count - 1)
+			else:
+				self._full = True
+		
+		self.scheduler.splice(first, last, doc.blockCount())
+		if self.use_cache:
+			# QSyntaxHighlighterが古いキャッシュで塗った範囲（削除時は次の1文字を含む）を塗り直す
+			end_block = doc.findBlock(position + chars_added + (1 if chars_removed > 0 else 0))
+			repaint_last = end_block.blockNumber() if end_block.isValid() else doc.blockCount() - 1
+			block = doc.findBlockByNumber(first)
+			while block.isValid() and block.blockNumber() <= max(last, repaint_last):
 				self.rehighlightBlock(block)
 				block = block.next()
 		
@@ -162,6 +387,30 @@ class Highlighter(QSyntaxHighlighter):
 		self.tokenize_timer.stop()
 		self.tokenize_timer.start()
 	
+	def current_semantic(self, text=None):
+		"""文書の今の内容のSemanticを返す（ホバーなどで使う）。
+
+		最後の解析結果が今の内容と同じならそれを使う。違う場合（解析後に編集された、
+		ワーカープロセスで解析した）は前回の結果から変わった文だけを解析し直す。
+		"""
+		if text is None:
+			text = self.document().toPlainText()
+		semantic = self.semantic
+		if semantic is None or semantic.text != text:
+			chunks = semantic.chunks if semantic is not None and semantic.chunks is not None else {}
+			semantic = Semantic(text, chunks)
+			self.semantic = semantic
+		return semantic
+	
+	def set_visible_range(self, first, last):
+		"""エディタの表示範囲を受け取る。解析と再ハイライトはこの範囲を優先する"""
+		self.visible_range = (first, last)
+		if self.tokenize_worker is not None:
+			try:
+				self.tokenize_worker.viewport = self.visible_range
+			except RuntimeError:
+				pass
+	
 	def set_filetype(self, filename):
 		if filename and not(self.lexer):
 			try:
@@ -172,11 +421,19 @@ class Highlighter(QSyntaxHighlighter):
 				print(f"Error getting lexer for {filename}: {e}")
 				self.lexer = get_lexer_by_name("text")
 		lang = str(self.lexer).lstrip("<pygments.lexers.").rstrip("Lexer>")
+		self._line_states = supports_incremental(self.lexer)
+		self._full = True
+		if self._journal is not None:
+			# 解析中の結果は前のLexerのものなので捨てて、終わったら解析し直す
+			self._generation += 1
+			self._deferred = True
+			self.tokenize_worker.cancel()
 		self.formats = {}
 		self.replace = {}
 		self.setup_formats(lang)
 
 	def setup_formats(self, lang="Text"):
+		self.invalidate_formats()
 		if self.style is None:
 			with open(f"{self.win.DIR}/themes/monokai.json", "r") as f:
 				self.style = json.load(f)
@@ -204,80 +461,230 @@ class Highlighter(QSyntaxHighlighter):
 			self.formats[token] = token_format
 	
 	def tokenize(self):
-		# スレッドが実行中の場合は待機
-		try:
-			if self.tokenize_thread and self.tokenize_thread.isRunning():
-				self.tokenize_thread.quit()
-				self.tokenize_thread.wait()
-		except RuntimeError:
-			# C++オブジェクトが既に削除されている場合は無視
-			pass
+		if self._journal is not None:
+			# 解析中なら終わってから続きを解析する（その間の編集は記録してずらす）
+			self._deferred = True
+			return
 		
-		# シグナルが接続されている場合のみ切断
-		if self._signal_connected:
-			try:
-				self.document().contentsChange.disconnect(self.changed)
-				self._signal_connected = False
-			except RuntimeError:
-				pass
+		previous = None
+		if not self._full:
+			if not self._dirty:
+				return
+			previous = (self.lex_lines.copy(), list(self.lex_states), list(self.bracket_depths), self.token_cache.copy(), self.semantic_key)
 		
 		text = self.document().toPlainText()
-		self.token_cache.clear()
+		self._generation += 1
+		self._tokenize_edits = self._edits
+		self._journal = []
+		self._journal_dirty = None
+		
+		# 大きなファイルの全体解析はワーカープロセスで行う
+		pool = tokenize_pool if previous is None and self.document().blockCount() >= POOL_MIN_LINES else None
 		
 		self.tokenize_thread = QThread()
-		self.tokenize_worker = Tokenizer(text, self.lexer, self.replace)
+		# doneの直後に次の解析を始めると前のスレッドはまだ終わっていないので、終わるまで参照を残す
+		thread = self.tokenize_thread
+		self._threads.add(thread)
+		thread.finished.connect(lambda: self._threads.discard(thread))
+		chunks = self.semantic.chunks if self.semantic is not None and self.semantic.chunks is not None else {}
+		self.tokenize_worker = Tokenizer(text, self.lexer, self.replace, previous, self._dirty, self._generation, pool, self.visible_range, chunks)
 		self.tokenize_worker.moveToThread(self.tokenize_thread)
 		self.tokenize_thread.started.connect(self.tokenize_worker.run)
+		self.tokenize_worker.partial.connect(self.on_tokenize_partial)
 		self.tokenize_worker.finished.connect(self.on_tokenize_finished)
-		self.tokenize_worker.finished.connect(self.tokenize_thread.quit)
-		self.tokenize_worker.finished.connect(self.tokenize_worker.deleteLater)
+		self.tokenize_worker.done.connect(self.on_tokenize_done)
+		self.tokenize_worker.done.connect(self.tokenize_thread.quit)
+		self.tokenize_worker.done.connect(self.tokenize_worker.deleteLater)
 		self.tokenize_thread.finished.connect(self.tokenize_thread.deleteLater)
 
 		self.tokenize_thread.start()
 	
-	def on_tokenize_finished(self, token_cache):
-		self.token_cache = token_cache
+	def on_tokenize_done(self):
+		self._journal = None
+		self.tokenize_worker = None
+		if self._deferred:
+			self._deferred = False
+			self.tokenize()
+	
+	def on_tokenize_partial(self, result):
+		"""先に解析された表示範囲だけを反映する（全体の結果が来るまでの仮の色）"""
+		if result.generation != self._generation or self._edits != self._tokenize_edits:
+			return
+		count = self.document().blockCount()
+		if len(self.token_cache) != count:
+			self.token_cache = TokenTable()
+			self.token_cache.invalidate(0, 0, count)
+		self.token_cache.replace(result.start, result.end, result.cache)
+		self.use_cache = True
+		self.scheduler.schedule(result.changed)
+	
+	def on_tokenize_finished(self, result):
+		if result.generation != self._generation:
+			return
+		if self._journal:
+			# 解析中の編集はすべてchangedで記録されている
+			changed = self.apply_rebased(result)
+		else:
+			changed = result.changed
+			if changed is None and self.use_cache:
+				# 全体を解析し直した場合も、今の表示と色が変わる行だけを塗り直す
+				changed = self.token_cache.changed_lines(result.cache)
+			
+			self.token_cache.replace(result.start, result.end, result.cache)
+			self.lex_lines.replace(result.start, result.end, result.lines)
+			self.lex_states[result.start:result.end] = result.states
+			self.bracket_depths[result.start:result.end] = result.depths
+		self.semantic_key = result.key
+		if result.semantic is not None:
+			self.semantic = result.semantic
+		# 解析中に編集された行だけが次の解析の対象として残る
+		self._dirty = self._journal_dirty
+		self._full = False
 
 		self.use_cache = True
-		self.rehighlight()
+		if changed is None or len(changed) > REHIGHLIGHT_BATCH:
+			# 表示範囲から順に少しずつ塗り直す
+			self.scheduler.schedule(changed)
+		else:
+			self.rehighlight_lines(changed)
+		self.tokenized.emit()
+	
+	def apply_rebased(self, result):
+		"""解析中に編集された場合、結果を今の行番号にずらし、編集されていない行だけを反映する。
+
+		編集された行は未解析のまま残り、次の解析で差分として解析される。塗り直す行を返す。
+		"""
+		count = self.document().blockCount()
+		if len(self.token_cache) != count or len(self.lex_lines) != count or len(self.lex_states) != count:
+			self.token_cache = TokenTable()
+			self.token_cache.invalidate(0, 0, count)
+			self.lex_lines = TokenTable()
+			self.lex_lines.invalidate(0, 0, count)
+			self.lex_states = [None] * count
+			self.bracket_depths = [None] * count
 		
-		# シグナルが接続されていない場合のみ接続
-		if not self._signal_connected:
-			try:
-				self.document().contentsChange.connect(self.changed)
-				self._signal_connected = True
-			except RuntimeError:
-				pass
+		start = result.start
+		end = start + len(result.cache)
+		changed = []
+		for a, b, s in rebase_runs(self._journal, start, end):
+			n = b - a
+			cache = result.cache.slice(a - start, b - start)
+			changed.extend(s + num for num in self.token_cache.slice(s, s + n).changed_lines(cache))
+			self.token_cache.replace(s, s + n, cache)
+			self.lex_lines.replace(s, s + n, result.lines.slice(a - start, b - start))
+			self.lex_states[s:s + n] = result.states[a - start:b - start]
+			self.bracket_depths[s:s + n] = result.depths[a - start:b - start]
+		
+		# 編集された先頭行の状態は古い可能性があるので、その手前の行から解析し直す
+		first = self._journal_dirty[0]
+		if 0 < first < count:
+			self.lex_states[first] = None
+			self.bracket_depths[first] = None
+		return changed
+	
+	def rehighlight_lines(self, lines):
+		"""指定された行だけを再ハイライト"""
+		doc = self.document()
+		block = None
+		with self.batched_updates():
+			for line in lines:
+				if block is None or not block.isValid() or block.blockNumber() != line:
+					block = doc.findBlockByNumber(line)
+				if block.isValid():
+					self.rehighlightBlock(block)
+					block = block.next()
+	
+	@contextmanager
+	def batched_updates(self):
+		"""rehighlightBlockごとのレイアウトの更新通知を止め、最後に1回だけ送る"""
+		layout = self.document().documentLayout()
+		if layout is None or layout.signalsBlocked():
+			yield
+			return
+		layout.blockSignals(True)
+		try:
+			yield
+		finally:
+			layout.blockSignals(False)
+			layout.documentSizeChanged.emit(layout.documentSize())
+			# 引数なしのupdateは文書全体を描き直す（PySide6ではQRectFを渡せない）
+			layout.update.emit()
+	
+	def take_highlighted(self):
+		"""前回の呼び出しから色付けした行の集合を返す（ミニマップが塗り直す範囲を決める）"""
+		lines = self.highlighted
+		self.highlighted = set()
+		return lines
 	
 	def highlightBlock(self, text):
 		block_number = self.currentBlock().blockNumber()
+		self.highlighted.add(block_number)
 		
-		if self.use_cache:
-			tokens = self.token_cache.get(block_number, [])
-			for token, value, offset in tokens:
-				format = self.get_format_for_token(token)
+		span = self.token_cache.span(block_number) if self.use_cache else None
+		if span is not None:
+			data = self.token_cache.data
+			formats = self.formats_by_id()
+			for i in range(span[0], span[1], 3):
+				format = formats[data[i + 2]]
 				if format:
-					self.setFormat(offset, len(value), format)
+					self.setFormat(data[i], data[i + 1], format)
+			# 次の行をキャッシュなしで色分けする場合に備えて行末のLexer状態を引き継ぐ
+			if self._line_states and block_number + 1 < len(self.lex_states):
+				state = self.lex_states[block_number + 1]
+				if state is not None:
+					self.setCurrentBlockState(state_id(state))
 		else:
 			try:
-				tokens = list(self.lexer.get_tokens(text))
-				offset = 0
-				for token, value in tokens:
-					length = len(value)
-					if value in ('(', ')', '{', '}', '[', ']'):
-						token = Punctuation.Bracket
-					format = self.get_format_for_token(token)
-					if format:
-						self.setFormat(offset, length, format)
-					offset += length
+				self.highlight_line(text)
 			except Exception as e:
 				print(f"Error in highlightBlock: {e}")
+	
+	def highlight_line(self, text):
+		"""キャッシュのない行をLexerで直接色分けする。
+
+		再開できるLexerでは前の行の状態から解析を始め、行末の状態をブロックの状態として
+		次の行に引き継ぐ（状態が変わるとQSyntaxHighlighterが次の行も塗り直す）。
+		"""
+		if self._line_states:
+			events = lex(self.lexer, text + '\n', 0, state_stack(self.previousBlockState()))
+		else:
+			events = self.lexer.get_tokens_unprocessed(text)
+		end_state = ROOT_STATE
+		for offset, token, value in events:
+			if token is None:
+				end_state = value
+				continue
+			if value in ('(', ')', '{', '}', '[', ']'):
+				token = Punctuation.Bracket
+			format = self.get_format_for_token(token)
+			if format:
+				self.setFormat(offset, len(value), format)
+		if self._line_states:
+			self.setCurrentBlockState(state_id(end_state))
+
+	def invalidate_formats(self):
+		"""トークン種別ごとに解決した書式のキャッシュを捨てる（テーマや種類の変更時）"""
+		self._resolved = {}
+		self._formats_by_id = []
+	
+	def formats_by_id(self):
+		"""TokenTableの種別番号で引ける書式のリスト（新しい種別が増えていたら追加する）"""
+		table = self._formats_by_id
+		while len(table) < len(TOKEN_TYPES):
+			table.append(self.get_format_for_token(TOKEN_TYPES[len(table)]))
+		return table
 
 	def get_format_for_token(self, token):
-		if token in self.formats:
-			return self.formats[token]
-		while token.parent is not None:
-			token = token.parent
-			if token in self.formats:
-				return self.formats[token]
-		return None
\ No newline at end of file
+		try:
+			return self._resolved[token]
+		except KeyError:
+			pass
+		format = None
+		parent = token
+		while parent is not None:
+			if parent in self.formats:
+				format = self.formats[parent]
+				break
+			parent = parent.parent
+		self._resolved[token] = format
+		return format
\ No newline at end of file
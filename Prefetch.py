@@ -0,0 +1,167 @@
+"""表示範囲の識別子のツールチップと定義位置を裏で解決しておく"""
+import itertools
+import keyword
+import queue
+import re
+import threading
+from PySide6.QtCore import QObject, Signal
+from Highlight.Semantic import Semantic
+from GoToDefinition import DefinitionFinder, owner_at
+
+IDENTIFIER = re.compile(r"(?!\d)\w+")
+# 1回の先読みで解決する識別子の上限（巨大な1行などで止まらないように）
+MAX_ITEMS = 2000
+
+def visible_identifiers(document, first, last):
+	"""first〜last行の識別子を (単語, 行番号（1-indexed）, 前にある a.b の部分) で返す"""
+	items = []
+	seen = set()
+	block = document.findBlockByNumber(first)
+	while block.isValid() and block.blockNumber() <= last and len(items) < MAX_ITEMS:
+		text = block.text()
+		line = block.blockNumber() + 1
+		for match in IDENTIFIER.finditer(text):
+			word = match.group()
+			if keyword.iskeyword(word) or keyword.issoftkeyword(word):
+				continue
+			item = (word, line, owner_at(text, match.start()))
+			if item not in seen:
+				seen.add(item)
+				items.append(item)
+		block = block.next()
+	return items
+
+class SymbolPrefetcher(QObject):
+	"""ツールチップと定義位置を別スレッドで解決し、Semanticごとに覚えておく。
+
+	prefetchは表示範囲の識別子をまとめて解決する（新しいprefetchが来たら前のものは途中でやめる）。
+	requestはホバーやF12で必要になった1つを先読みより優先して解決し、結果をGUIスレッドの
+	callbackに渡す。同じ種類のrequestが来るかcancel_requestを呼ぶと前の結果は捨てる。
+	"""
+	resolved = Signal(str, int, object)  # 種類, request番号, 結果
+	analyzed = Signal(object)  # 別スレッドで解析し直したSemantic
+
+	def __init__(self, parent=None):
+		super().__init__(parent)
+		self._jobs = queue.PriorityQueue()
+		self._order = itertools.count()
+		self._thread = None
+		self._generation = 0
+		self._requests = {"tooltip": 0, "definition": 0}
+		self._callbacks = {}
+		self._finder = DefinitionFinder(None)
+		# (Semantic, ツールチップ, 定義位置)。別スレッドから丸ごと差し替える
+		self._cache = (None, {}, {})
+		self.resolved.connect(self._on_resolved)
+
+	def _start(self):
+		if self._thread is None:
+			self._thread = threading.Thread(target=self._run, daemon=True)
+			self._thread.start()
+
+	def prefetch(self, text, semantic, items, file_path=None):
+		"""items（visible_identifiersの結果）のツールチップと定義位置を裏で解決する"""
+		self._generation += 1
+		self._start()
+		self._jobs.put((1, next(self._order), ("prefetch", self._generation, text, semantic, items, file_path)))
+
+	def request(self, kind, text, semantic, item, file_path, callback):
+		"""kind（"tooltip" か "definition"）の結果を裏で求め、callback(結果) を呼ぶ"""
+		self._requests[kind] += 1
+		request_id = self._requests[kind]
+		self._callbacks[kind] = (request_id, callback)
+		self._start()
+		self._jobs.put((0, next(self._order), ("request", kind, request_id, text, semantic, item, file_path)))
+		return request_id
+
+	def cancel_request(self, kind="tooltip"):
+		"""まだ結果が届いていないrequestを取り消す"""
+		self._requests[kind] += 1
+		self._callbacks.pop(kind, None)
+
+	def cached(self, kind, semantic, item):
+		"""先読みした結果を (見つかったか, 結果) で返す。semanticが先読みしたものと違えば見つからない"""
+		cached_semantic, tooltips, definitions = self._cache
+		if semantic is None or semantic is not cached_semantic:
+			return False, None
+		if kind == "tooltip":
+			key = item[:2]
+			return (key in tooltips), tooltips.get(key)
+		return (item in definitions), definitions.get(item)
+
+	def _on_resolved(self, kind, request_id, result):
+		entry = self._callbacks.get(kind)
+		if entry is None or entry[0] != request_id or request_id != self._requests[kind]:
+			return
+		del self._callbacks[kind]
+		entry[1](result)
+
+	def _run(self):
+		while True:
+			_, _, job = self._jobs.get()
+			try:
+				if job[0] == "prefetch":
+					self._prefetch(*job[1:])
+				else:
+					self._resolve(*job[1:])
+			except Exception as e:
+				print(f"Error prefetching symbols: {e}")
+
+	def _semantic(self, text, semantic):
+		"""textのSemantic。渡されたものが古ければ変わった文だけを解析し直して知らせる"""
+		if semantic is not None and semantic.text == text:
+			return semantic
+		cached_semantic = self._cache[0]
+		if cached_semantic is not None and cached_semantic.text == text:
+			return cached_semantic
+		base = semantic if semantic is not None else cached_semantic
+		chunks = base.chunks if base is not None and base.chunks is not None else {}
+		semantic = Semantic(text, chunks)
+		self.analyzed.emit(semantic)
+		return semantic
+
+	def _caches(self, semantic):
+		cache = self._cache
+		if cache[0] is not semantic:
+			cache = (semantic, {}, {})
+			self._cache = cache
+		return cache[1], cache[2]
+
+	def _tooltip(self, semantic, word, line):
+		info = semantic.symbol_info(word, line)
+		return info.to_tooltip() if info else None
+
+	def _prefetch(self, generation, text, semantic, items, file_path):
+		if generation != self._generation:
+			return
+		semantic = self._semantic(text, semantic)
+		tooltips, definitions = self._caches(semantic)
+		for item in items:
+			# 新しい先読みか、優先するrequestが来たら途中でやめる
+			if generation != self._generation:
+				return
+			if not self._jobs.empty() and self._jobs.queue[0][0] == 0:
+				self._jobs.put((1, next(self._order), ("prefetch", generation, text, semantic, items, file_path)))
+				return
+			word, line, owner = item
+			if (word, line) not in tooltips:
+				tooltips[(word, line)] = self._tooltip(semantic, word, line)
+			if item not in definitions:
+				definitions[item] = self._finder.resolve(text, semantic, word, line, owner, file_path)
+
+	def _resolve(self, kind, request_id, text, semantic, item, file_path):
+		if request_id != self._requests[kind]:
+			return
+		semantic = self._semantic(text, semantic)
+		tooltips, definitions = self._caches(semantic)
+		word, line, owner = item
+		if kind == "tooltip":
+			key = (word, line)
+			if key not in tooltips:
+				tooltips[key] = self._tooltip(semantic, word, line)
+			result = tooltips[key]
+		else:
+			if item not in definitions:
+				definitions[item] = self._finder.resolve(text, semantic, word, line, owner, file_path)
+			result = definitions[item]
+		self.resolved.emit(kind, request_id, result)
@@ -1,7 +1,9 @@
+import html
 from PySide6.QtWidgets import *
 from PySide6.QtCore import QTimer, Qt
 from PySide6.QtGui import QTextCharFormat, QBrush, QColor
 from utils import navigate_to_position, perform_search_across_tabs
+from FindReferences import ReferenceSearch
 #from main import window as win
 
 class Search(QWidget):
@@ -41,6 +43,15 @@ class Search(QWidget):
 		self.tree.setHeaderHidden(True)
 		self.tree.itemClicked.connect(self.on_item_clicked)
 
+		self.ress = []
+		# すべての参照を検索（結果はファイルごとに届いた順に追加する）
+		self.references = ReferenceSearch(self)
+		self.references.found.connect(self.add_references)
+		self.references.finished.connect(self.finish_references)
+		self._reference_generation = 0
+		self._reference_word = None
+		self._reference_root = None
+
 		layout.addWidget(title)
 		layout.addWidget(self.search_input)
 		layout.addLayout(rep_layout)
@@ -64,13 +75,63 @@ class Search(QWidget):
 
 		self.ress = perform_search_across_tabs(self.win, self.tree, pattern, create_item_widget=create_widget)
 
+	def find_references(self, sources, source, word, line, owner):
+		"""sourceのline行のwordの参照を探し、見つかったものから順にツリーに表示する"""
+		self.ress = []
+		self.tree.clear()
+		for tab in self.win.tablist:
+			tab.setExtraSelections([])
+		self._reference_word = word
+		self._reference_root = QTreeWidgetItem(self.tree, [f"'{word}' の参照を検索中..."])
+		self._reference_generation = self.references.start(sources, source, word, line, owner)
+
+	def add_references(self, generation, location, found):
+		if generation != self._reference_generation:
+			return
+		search_bg = self.win.STYLE["theme"]["search"]["background"]
+		tab = getattr(location, 'tab', None)
+		if tab is not None:
+			name = location.file_path or "Untitled"
+			# 閉じられたタブはファイルを開き直す
+			target = tab if tab in self.win.tablist else location.file_path
+		else:
+			name = target = location
+		parent = QTreeWidgetItem(self._reference_root, [name])
+		length = len(self._reference_word)
+		for line_num, col, line_text in found:
+			stripped = line_text.lstrip()
+			start = col - (len(line_text) - len(stripped))
+			before = html.escape(stripped[:start])
+			match = html.escape(stripped[start:start + length])
+			after = html.escape(stripped[start + length:])
+			label = QLabel(f'{line_num}: {before}<span style="background-color: {search_bg};">{match}</span>{after}')
+			label.setTextFormat(Qt.TextFormat.RichText)
+			item = QTreeWidgetItem(parent)
+			self.tree.setItemWidget(item, 0, label)
+			item.setData(0, Qt.UserRole, (target, line_num, col))
+		parent.setExpanded(True)
+		self._reference_root.setExpanded(True)
+
+	def finish_references(self, generation, count):
+		if generation != self._reference_generation:
+			return
+		self._reference_root.setText(0, f"'{self._reference_word}' の参照: {count} 件")
+
 	def on_item_clicked(self, item, column):
 		data = item.data(0, Qt.UserRole)
 		if data:
 			tab, line_num, col = data
-			navigate_to_position(self.win, tab, line_num, col)
+			if isinstance(tab, str):
+				# 開いていないファイルの参照
+				if not self.win.focus_existing_tab(tab):
+					self.win.open_(tab)
+				tab = self.win.tablist[self.win.tabs.currentIndex()]
+			if tab in self.win.tablist:
+				navigate_to_position(self.win, tab, line_num, col)
 	
 	def main(self):
+		self.references.cancel()
+		self._reference_generation = 0
 		search = self.search_input.text()
 		self.search(search)
 
@@ -1,6 +1,7 @@
 import sys
 from PySide6.QtWidgets import *
 from utils import run_subprocess
+from Highlight.Resolver import module_resolver
 
 class Settings(QWidget):
 	def __init__(self, window=None):
@@ -80,3 +81,4 @@ class Settings(QWidget):
 			return
 		self.python_interpreter_edit.setText(path)
 		self.win.settings.setValue("pythonInterpreter", path)
+		module_resolver.set_interpreter(path)
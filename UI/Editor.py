@@ -1,8 +1,22 @@
+from collections import OrderedDict
 from PySide6.QtWidgets import QPlainTextEdit, QWidget, QTextEdit, QToolTip
-from PySide6.QtGui import QPainter, QColor, QTextFormat, QFont, QPen, QPolygon, QCursor, QTextCharFormat
-from PySide6.QtCore import Qt, QRect, QSize, QEvent, QPoint, Signal, QTimer
+from PySide6.QtGui import QPainter, QColor, QTextFormat, QFont, QPen, QPolygon, QCursor, QTextCharFormat, QImage, QStaticText, QTextBlock
+from PySide6.QtCore import Qt, QRect, QSize, QEvent, QPoint, QPointF, Signal, QTimer
+from Prefetch import SymbolPrefetcher, visible_identifiers
+from UI.MiniMapRaster import Runs, rasterize
+from UI.Folding import FoldIndex
 
 class MiniMap(QWidget):
+	"""エディタの縮小表示。
+
+	TILE_LINES行ごとにウィジェットの幅のQImageのタイル（MiniMapRaster参照）へ一度だけ描き、
+	paintEventでは表示範囲のタイルを貼るだけにする。編集された行とハイライターが色付けし直した行を含むタイルだけを
+	次の描画で作り直す（行数が変わった場合は以降のタイルも行がずれるので作り直す）。
+	"""
+	LINE_HEIGHT = 2
+	TILE_LINES = 256
+	MAX_TILES = 32  # 保持するタイルの数（古いものから捨てる）
+	
 	def __init__(self, parent=None):
 		super().__init__(parent)
 		self.editor = parent
@@ -10,6 +24,74 @@ class MiniMap(QWidget):
 		self.scale_factor = 0.1
 		self.viewport_color = QColor(100, 100, 100, 50)
 		self.scroll_offset = 0
+		self.tiles = OrderedDict()  # タイル番号 -> (QImage, バッファ)
+		self._default = None
+		self._tile_width = 0
+		self._block_count = parent.document().blockCount() if parent else 0
+		if parent:
+			parent.document().contentsChange.connect(self.on_contents_change)
+	
+	def invalidate(self):
+		"""すべてのタイルを作り直す（テーマの変更時など）"""
+		self.tiles.clear()
+	
+	def invalidate_lines(self, first, last):
+		"""first行からlast行を含むタイルを捨てる"""
+		for index in range(first // self.TILE_LINES, last // self.TILE_LINES + 1):
+			self.tiles.pop(index, None)
+	
+	def on_contents_change(self, position, chars_removed, chars_added):
+		doc = self.editor.document()
+		# 編集前に色付けされた行は編集前の行番号なので先に反映する
+		self.take_highlighted()
+		first = doc.findBlock(position).blockNumber()
+		if doc.blockCount() != self._block_count:
+			# 行が増減した場合は以降の行がずれる
+			self._block_count = doc.blockCount()
+			for index in [index for index in self.tiles if index >= first // self.TILE_LINES]:
+				del self.tiles[index]
+		else:
+			last = doc.findBlock(position + chars_added).blockNumber()
+			self.invalidate_lines(first, max(first, last))
+	
+	def take_highlighted(self):
+		"""ハイライターが色付けし直した行のタイルを捨てる"""
+		highlighter = getattr(self.editor, 'highlighter', None)
+		if highlighter is None or not hasattr(highlighter, 'take_highlighted'):
+			return
+		lines = highlighter.take_highlighted()
+		if lines and self.tiles:
+			for index in {line // self.TILE_LINES for line in lines}:
+				self.tiles.pop(index, None)
+	
+	def tile(self, index):
+		entry = self.tiles.get(index)
+		if entry is not None:
+			self.tiles.move_to_end(index)
+			return entry[0]
+		entry = self.render_tile(index)
+		self.tiles[index] = entry
+		while len(self.tiles) > self.MAX_TILES:
+			self.tiles.popitem(last=False)
+		return entry[0]
+	
+	def render_tile(self, index):
+		"""index番目のタイルを描き、(QImage, バッファ) を返す（QImageはバッファをコピーせずに使う）"""
+		texts = []
+		runs = Runs()
+		block = self.editor.document().findBlockByNumber(index * self.TILE_LINES)
+		while block.isValid() and len(texts) < self.TILE_LINES:
+			row = len(texts)
+			texts.append(block.text())
+			layout = block.layout()
+			for fmt_range in (layout.formats() if layout else ()):
+				color = fmt_range.format.foreground().color()
+				if color.isValid():
+					runs.add(row, fmt_range.start, fmt_range.start + fmt_range.length, color.rgb() & 0xFFFFFF)
+			block = block.next()
+		buffer, width, height = rasterize(texts, runs, self._default.rgb() & 0xFFFFFF, self.TILE_LINES, self._tile_width, self.LINE_HEIGHT)
+		image = QImage(buffer, width, height, width * 4, QImage.Format.Format_ARGB32_Premultiplied)
+		return image, buffer
 		
 	def paintEvent(self, event):
 		if not self.editor:
@@ -20,7 +102,7 @@ class MiniMap(QWidget):
 		bg_color = self.editor.palette().color(self.editor.backgroundRole())
 		painter.fillRect(self.rect(), bg_color.darker(105))
 		
-		line_height = 2
+		line_height = self.LINE_HEIGHT
 		total_blocks = self.editor.document().blockCount()
 		total_content_height = total_blocks * line_height
 		
@@ -32,57 +114,25 @@ class MiniMap(QWidget):
 		else:
 			self.scroll_offset = 0
 		
-		start_block_num = int(self.scroll_offset / line_height)
-		block = self.editor.document().findBlockByNumber(start_block_num)
-		y_pos = -(self.scroll_offset % line_height)
-		
 		default_color = self.editor.palette().color(self.editor.foregroundRole())
-		default_color.setAlpha(200)
-		
-		color_cache = {}
-		
-		while block.isValid() and y_pos < self.height():
-			if y_pos + line_height >= 0:
-				text = block.text()
-				if text:
-					layout = block.layout()
-					formats = layout.formats() if layout else []
-					
-					x_pos = 2
-					char_index = 0
-					current_format_idx = 0
-					
-					for char in text[:min(len(text), 80)]:
-						if not char.isspace():
-							color = default_color
-							
-							for i in range(current_format_idx, len(formats)):
-								fmt_range = formats[i]
-								if char_index < fmt_range.start:
-									break
-								if char_index < fmt_range.start + fmt_range.length:
-									current_format_idx = i
-									fmt_color = fmt_range.format.foreground().color()
-									if fmt_color.isValid():
-										color_key = (fmt_color.red(), fmt_color.green(), fmt_color.blue())
-										if color_key not in color_cache:
-											cached_color = QColor(fmt_color)
-											cached_color.setAlpha(200)
-											color_cache[color_key] = cached_color
-										color = color_cache[color_key]
-									break
-							
-							painter.setPen(color)
-							painter.drawPoint(x_pos, y_pos + 1)
-							x_pos += 1
-						elif char == '\t':
-							x_pos += 2
-						else:
-							x_pos += 1
-						char_index += 1
-			
-			y_pos += line_height
-			block = block.next()
+		if default_color != self._default:
+			# テーマが変わった
+			self._default = default_color
+			self.invalidate()
+		if self.width() != self._tile_width:
+			self._tile_width = self.width()
+			self.invalidate()
+		self.take_highlighted()
+		
+		# 表示範囲のタイルを貼る
+		tile_height = self.TILE_LINES * line_height
+		index = self.scroll_offset // tile_height
+		last_tile = (total_blocks - 1) // self.TILE_LINES
+		y_pos = index * tile_height - self.scroll_offset
+		while index <= last_tile and y_pos < self.height():
+			painter.drawImage(0, y_pos, self.tile(index))
+			index += 1
+			y_pos += tile_height
 		
 		self.draw_viewport_indicator(painter, line_height)
 	
@@ -129,13 +179,37 @@ class MiniMap(QWidget):
 		scrollbar.setValue(int(ratio * max_scroll))
 
 class LineNumberArea(QWidget):
+	"""行番号の余白。行番号はQStaticTextにして使い回す（フォントが変わったら作り直す）"""
+	MAX_NUMBERS = 4096  # 保持する行番号の数（超えたら作り直す）
+	
 	def __init__(self, editor):
 		super().__init__(editor)
 		self.editor = editor
+		self.numbers = {}  # 行番号 -> QStaticText
+		self._font = None
 	
 	def sizeHint(self):
 		return QSize(self.editor.line_number_area_width(), 0)
 	
+	def number(self, value):
+		"""行番号valueのQStaticText"""
+		text = self.numbers.get(value)
+		if text is None:
+			if len(self.numbers) >= self.MAX_NUMBERS:
+				self.numbers.clear()
+			text = QStaticText(str(value))
+			text.setTextFormat(Qt.TextFormat.PlainText)
+			text.prepare(font=self.font())
+			self.numbers[value] = text
+		return text
+	
+	def check_font(self):
+		"""フォントが変わっていれば行番号を作り直す"""
+		font = self.font()
+		if font != self._font:
+			self._font = QFont(font)
+			self.numbers.clear()
+	
 	def paintEvent(self, event):
 		self.editor.line_number_area_paint_event(event)
 
@@ -179,6 +253,8 @@ class Editor(QPlainTextEdit):
 		self.folding_area = FoldingArea(self)
 		
 		self.folded_blocks = {}  # {start_line: end_line}
+		self.fold_index = FoldIndex([''])  # 折りたたみ範囲（contentsChangeで編集された行だけ更新する）
+		self.document().contentsChange.connect(self.on_fold_contents_change)
 		
 		self.minimap = MiniMap(self)
 		self._minimap_update_pending = False
@@ -191,13 +267,25 @@ class Editor(QPlainTextEdit):
 		self._last_hover_word = None
 		self._hover_link_selection = None  # Ctrl+ホバー時のリンクスタイル選択
 		
+		# 表示範囲のシンボルのツールチップと定義位置の先読み
+		self.prefetcher = SymbolPrefetcher(self)
+		self.prefetcher.analyzed.connect(self._on_semantic_analyzed)
+		self._prefetch_timer = QTimer(self)
+		self._prefetch_timer.setSingleShot(True)
+		self._prefetch_timer.setInterval(150)
+		self._prefetch_timer.timeout.connect(self.prefetch_symbols)
+		
 		self.blockCountChanged.connect(self.update_line_number_area_width)
 		self.updateRequest.connect(lambda rect, dy: self.update_line_number_area(rect, dy))
 		self.cursorPositionChanged.connect(self.highlight_current_line)
+		self.cursorPositionChanged.connect(self.update_current_line_number)
+		self._current_line = 0
 		
 		self.textChanged.connect(self.schedule_minimap_update)
-		self.textChanged.connect(self.update_folding_areas)
+		# ハイライターが裏で色付けし直した場合もミニマップを更新する
+		self.document().documentLayout().update.connect(lambda *args: self.schedule_minimap_update())
 		self.verticalScrollBar().valueChanged.connect(self.update_minimap)
+		self.verticalScrollBar().valueChanged.connect(self.update_visible_range)
 		
 		self.update_line_number_area_width(0)
 		self.highlight_current_line()
@@ -238,7 +326,9 @@ class Editor(QPlainTextEdit):
 		if dy:
 			self.line_number_area.scroll(0, dy)
 			self.folding_area.scroll(0, dy)
-		else:
+		elif rect.width() >= self.viewport().width():
+			# カーソルの点滅や行の一部だけの描き直しでは行番号と折りたたみの印は変わらないので描き直さない
+			# （行の高さや行数が変わる場合は表示全体、現在行の移動は行の幅で届く）
 			self.line_number_area.update(0, rect.y(), self.line_number_area.width(), rect.height())
 			self.folding_area.update(0, rect.y(), self.folding_area.width(), rect.height())
 		
@@ -262,6 +352,7 @@ class Editor(QPlainTextEdit):
 		self.minimap.setGeometry(
 			QRect(cr.right() - 100, cr.top(), 100, cr.height())
 		)
+		self.update_visible_range()
 	
 	def changeEvent(self, event):
 		if event.type() in (QEvent.Type.StyleChange, QEvent.Type.PaletteChange):
@@ -272,37 +363,56 @@ class Editor(QPlainTextEdit):
 	
 	def line_number_area_paint_event(self, event):
 		painter = QPainter(self.line_number_area)
-		painter.fillRect(event.rect(), self.get_line_number_bg_color())
+		rect = event.rect()
+		painter.fillRect(rect, self.get_line_number_bg_color())
+		self.line_number_area.check_font()
 		
+		doc = self.document()
 		block = self.firstVisibleBlock()
 		block_number = block.blockNumber()
 		top = self.blockBoundingGeometry(block).translated(self.contentOffset()).top()
-		bottom = top + self.blockBoundingRect(block).height()
 		
 		current_line = self.textCursor().blockNumber()
-		
-		while block.isValid() and top <= event.rect().bottom():
-			if block.isVisible() and bottom >= event.rect().top():
-				number = str(block_number + 1)
-				
-				if block_number == current_line:
-					painter.setPen(self.get_current_line_number_fg_color())
-				else:
-					painter.setPen(self.get_line_number_fg_color())
+		right = self.line_number_area.width() - 5
+		fg_color = self.get_line_number_fg_color()
+		current_fg_color = self.get_current_line_number_fg_color()
+		painter.setPen(fg_color)
+		
+		while block.isValid() and top <= rect.bottom():
+			if block.isVisible():
+				bottom = top + self.blockBoundingRect(block).height()
+				if bottom >= rect.top():
+					number = self.line_number_area.number(block_number + 1)
+					if block_number == current_line:
+						painter.setPen(current_fg_color)
+					painter.drawStaticText(QPointF(right - number.size().width(), top), number)
+					if block_number == current_line:
+						painter.setPen(fg_color)
+				top = bottom
 				
-				painter.drawText(
-					0, int(top), 
-					self.line_number_area.width() - 5, 
-					self.fontMetrics().height(),
-					Qt.AlignmentFlag.AlignRight, 
-					number
-				)
+				end_line = self.folded_blocks.get(block_number, -1)
+				if end_line > block_number and not block.next().isVisible():
+					# 折りたたまれた行は範囲の終わりまでまとめて飛ばす
+					block_number = end_line + 1
+					block = doc.findBlockByNumber(block_number)
+					continue
 			
 			block = block.next()
-			top = bottom
-			bottom = top + self.blockBoundingRect(block).height()
 			block_number += 1
 	
+	def update_current_line_number(self):
+		"""現在行が変わったら、前の行と新しい行の行番号だけを描き直す"""
+		line = self.textCursor().blockNumber()
+		if line == self._current_line:
+			return
+		for number in (self._current_line, line):
+			block = self.document().findBlockByNumber(number)
+			if block.isValid() and block.isVisible():
+				geometry = self.blockBoundingGeometry(block).translated(self.contentOffset()).toRect()
+				if geometry.intersects(self.viewport().rect()):
+					self.line_number_area.update(0, geometry.y(), self.line_number_area.width(), geometry.height())
+		self._current_line = line
+	
 	def highlight_current_line(self):
 		extra_selections = []
 		
@@ -334,77 +444,101 @@ class Editor(QPlainTextEdit):
 	def update_minimap(self):
 		self.minimap.update()
 	
+	def update_visible_range(self):
+		"""表示中の行範囲をハイライターに知らせる（表示範囲から先に色付けされる）"""
+		highlighter = getattr(self, 'highlighter', None)
+		if highlighter is None:
+			return
+		first = self.firstVisibleBlock().blockNumber()
+		last = self.cursorForPosition(self.viewport().rect().bottomLeft()).blockNumber()
+		highlighter.set_visible_range(first, max(first, last))
+		self.schedule_prefetch()
+	
+	def _python_highlighter(self):
+		highlighter = getattr(self, 'highlighter', None)
+		if highlighter is None or highlighter.lexer is None or highlighter.lexer.name != "Python":
+			return None
+		return highlighter
+	
+	def _current_semantic(self, highlighter, text):
+		"""ハイライターのSemanticが今の内容のものならそれを返す（違えばNone）"""
+		semantic = highlighter.semantic
+		return semantic if semantic is not None and semantic.text == text else None
+	
+	def schedule_prefetch(self):
+		"""解析やスクロールが落ち着いたら表示範囲のシンボルを先読みする"""
+		self._prefetch_timer.start()
+	
+	def prefetch_symbols(self):
+		"""表示範囲の識別子のツールチップと定義位置を別スレッドで解決しておく"""
+		highlighter = self._python_highlighter()
+		if highlighter is None:
+			return
+		first, last = highlighter.visible_range
+		items = visible_identifiers(self.document(), first, last)
+		if items:
+			text = self.document().toPlainText()
+			self.prefetcher.prefetch(text, highlighter.semantic, items, getattr(self, 'file_path', None))
+	
+	def _on_semantic_analyzed(self, semantic):
+		"""先読みのスレッドが解析し直したSemanticを、内容が今も同じならハイライターに渡す"""
+		highlighter = getattr(self, 'highlighter', None)
+		if highlighter is None or self._current_semantic(highlighter, semantic.text) is not None:
+			return
+		if semantic.text == self.document().toPlainText():
+			highlighter.semantic = semantic
+	
+	def request_definition(self, symbol, callback):
+		"""symbol（単語, 行番号, 前にある a.b）の定義位置をcallbackに渡す。先読みしていなければ別スレッドで求める"""
+		highlighter = self._python_highlighter()
+		if highlighter is None:
+			callback(None)
+			return
+		text = self.document().toPlainText()
+		semantic = self._current_semantic(highlighter, text)
+		found, definition = self.prefetcher.cached("definition", semantic, symbol)
+		if found:
+			callback(definition)
+		else:
+			self.prefetcher.request("definition", text, semantic or highlighter.semantic, symbol, getattr(self, 'file_path', None), callback)
+	
 	# ============== Code Folding Methods ==============
 	
-	def get_indent_level(self, text):
-		"""テキストのインデントレベルを取得"""
-		indent = 0
-		for char in text:
-			if char == '\t':
-				indent += 4
-			elif char == ' ':
-				indent += 1
-			else:
-				break
-		return indent
+	def on_fold_contents_change(self, position, chars_removed, chars_added):
+		"""編集された行の折りたたみ範囲の索引を更新し、印が変わりうる場合だけ描き直す"""
+		doc = self.document()
+		first = doc.findBlock(position).blockNumber()
+		last = doc.findBlock(min(position + chars_added, doc.characterCount() - 1)).blockNumber()
+		first = max(0, first)
+		last = max(first, last)
+		# 行数の増減から、置き換えられた編集前の行数を求める
+		delta = doc.blockCount() - len(self.fold_index)
+		removed = max(0, last - first + 1 - delta)
+		texts = []
+		block = doc.findBlockByNumber(first)
+		for _ in range(last - first + 1):
+			texts.append(block.text())
+			block = block.next()
+		if delta and self.folded_blocks:
+			# 折りたたみを編集後の行番号にずらす（置き換えられた行から始まるものは捨てる）
+			folded = {}
+			for start, end in self.folded_blocks.items():
+				if start > first:
+					if start < first + removed:
+						continue
+					start += delta
+				if end >= first:
+					end += delta
+				if end > start:
+					folded[start] = end
+			self.folded_blocks = folded
+		if self.fold_index.replace(first, removed, texts):
+			self.update_folding_areas()
 	
 	def is_foldable_line(self, block_number):
 		"""折りたたみ可能な行かどうかを判定"""
-		block = self.document().findBlockByNumber(block_number)
-		if not block.isValid():
-			return False, -1
-		
-		text = block.text()
-		stripped = text.strip()
-		
-		# 空行やコメントのみの行は折りたたみ不可
-		if not stripped or stripped.startswith('#'):
-			return False, -1
-		
-		# コロンで終わる行（関数、クラス、if文など）をチェック
-		if not stripped.endswith(':'):
-			return False, -1
-		
-		current_indent = self.get_indent_level(text)
-		next_block = block.next()
-		
-		# 次の行が存在し、インデントが深い場合は折りたたみ可能
-		if next_block.isValid():
-			next_text = next_block.text().strip()
-			if next_text:  # 空行でない
-				next_indent = self.get_indent_level(next_block.text())
-				if next_indent > current_indent:
-					# 折りたたみ範囲の終端を見つける
-					end_line = self.find_fold_end(block_number, current_indent)
-					return True, end_line
-		
-		return False, -1
-	
-	def find_fold_end(self, start_line, base_indent):
-		"""折りたたみ範囲の終端行を見つける"""
-		block = self.document().findBlockByNumber(start_line + 1)
-		end_line = start_line
-		
-		while block.isValid():
-			text = block.text()
-			stripped = text.strip()
-			
-			# 空行はスキップ
-			if not stripped:
-				block = block.next()
-				end_line += 1
-				continue
-			
-			indent = self.get_indent_level(text)
-			
-			# インデントが同じかそれより浅い場合は終了
-			if indent <= base_indent:
-				break
-			
-			end_line += 1
-			block = block.next()
-		
-		return end_line
+		end_line = self.fold_index.fold_end(block_number)
+		return end_line >= 0, end_line
 	
 	def toggle_fold_at_pos(self, pos):
 		"""指定位置の折りたたみを切り替え"""
@@ -424,58 +558,120 @@ class Editor(QPlainTextEdit):
 	def fold(self, start_line, end_line):
 		"""指定範囲を折りたたむ"""
 		self.folded_blocks[start_line] = end_line
-		
-		# start_line + 1 から end_line までを非表示にする
-		for line_num in range(start_line + 1, end_line + 1):
-			block = self.document().findBlockByNumber(line_num)
-			if block.isValid():
-				block.setVisible(False)
-		
-		self.document().markContentsDirty(
-			self.document().findBlockByNumber(start_line).position(),
-			self.document().findBlockByNumber(end_line).position()
-		)
-		self.viewport().update()
-		self.folding_area.update()
-		self.update_minimap()
+		self.apply_folding(start_line, end_line)
 	
 	def unfold(self, start_line):
 		"""指定行の折りたたみを展開"""
 		if start_line not in self.folded_blocks:
 			return
-		
-		end_line = self.folded_blocks[start_line]
-		del self.folded_blocks[start_line]
-		
-		# 行を再表示
-		for line_num in range(start_line + 1, end_line + 1):
-			block = self.document().findBlockByNumber(line_num)
-			if block.isValid():
-				block.setVisible(True)
-		
-		self.document().markContentsDirty(
-			self.document().findBlockByNumber(start_line).position(),
-			self.document().findBlockByNumber(end_line).position()
-		)
-		self.viewport().update()
+		end_line = self.folded_blocks.pop(start_line)
+		self.apply_folding(start_line, end_line)
+	
+	def fold_all(self):
+		"""すべての範囲を折りたたむ"""
+		self.folded_blocks = {start: end for start, end, _ in self.fold_index.regions()}
+		self.apply_folding(0, self.blockCount() - 1)
+	
+	def unfold_all(self):
+		"""すべての折りたたみを展開"""
+		self.folded_blocks.clear()
+		self.apply_folding(0, self.blockCount() - 1)
+	
+	def fold_to_level(self, level):
+		"""深さlevelの範囲をすべて折りたたむ（ほかの範囲の折りたたみはそのまま）"""
+		for start, end, depth in self.fold_index.regions():
+			if depth == level:
+				self.folded_blocks[start] = end
+		self.apply_folding(0, self.blockCount() - 1)
+	
+	def apply_folding(self, first, last):
+		"""first行からlast行の表示/非表示をfolded_blocksに合わせる。
+
+		折りたたみの範囲から表示する区間と隠す区間を先に求めてから、ブロックをnext()で順にたどる。
+		変わった範囲のレイアウトの更新とミニマップの更新は最後に1回だけ行う。
+		"""
+		last = min(last, self.blockCount() - 1)
+		# first行より前から始まる折りたたみに含まれる行は非表示のまま
+		hidden_until = max((end for start, end in self.folded_blocks.items() if start < first), default=-1)
+		runs = []  # [(区間の終わりの次の行, 表示するか)]
+		line = first
+		for start in sorted(start for start in self.folded_blocks if first <= start <= last):
+			if start > hidden_until:
+				if hidden_until >= line:
+					runs.append((hidden_until + 1, False))
+				runs.append((start + 1, True))
+				line = start + 1
+			hidden_until = max(hidden_until, self.folded_blocks[start])
+		if hidden_until >= line:
+			runs.append((min(hidden_until, last) + 1, False))
+		runs.append((last + 1, True))
+		
+		# 10万行では1行ごとのメソッドの参照も目立つので、先に取り出しておく
+		is_visible, set_visible, next_block = QTextBlock.isVisible, QTextBlock.setVisible, QTextBlock.next
+		block = self.document().findBlockByNumber(first)
+		changed_first = changed_last = -1
+		line = first
+		for end, visible in runs:
+			for number in range(line, end):
+				if is_visible(block) != visible:
+					set_visible(block, visible)
+					if changed_first < 0:
+						changed_first = number
+					changed_last = number
+				block = next_block(block)
+			line = max(line, end)
+		
+		if changed_first >= 0:
+			self.relayout_lines(changed_first, changed_last)
+			if not self.textCursor().block().isVisible():
+				# カーソルが隠れた場合は折りたたんだ行へ移す
+				cursor = self.textCursor()
+				block = cursor.block()
+				while not block.isVisible() and block.previous().isValid():
+					block = block.previous()
+				cursor.setPosition(block.position())
+				self.setTextCursor(cursor)
+			self.viewport().update()
+			self.line_number_area.update()
+			self.schedule_minimap_update()
 		self.folding_area.update()
-		self.update_minimap()
-		self.update_minimap()
+	
+	def relayout_lines(self, first, last):
+		"""first行からlast行をレイアウトし直す（ブロックの表示/非表示の変更を反映する）。
+
+		文字は変わらないので、文書のシグナルを止めてハイライターや折りたたみの索引が編集として扱わないようにする。
+		"""
+		doc = self.document()
+		start = doc.findBlockByNumber(first)
+		end = doc.findBlockByNumber(last)
+		blocked = doc.blockSignals(True)
+		try:
+			doc.markContentsDirty(start.position(), end.position() + end.length() - start.position())
+		finally:
+			doc.blockSignals(blocked)
 	
 	def get_line_number_at_pos(self, pos):
 		"""Y座標から行番号を取得"""
+		doc = self.document()
 		block = self.firstVisibleBlock()
 		block_number = block.blockNumber()
 		top = self.blockBoundingGeometry(block).translated(self.contentOffset()).top()
-		bottom = top + self.blockBoundingRect(block).height()
 		
-		while block.isValid():
-			if top <= pos.y() <= bottom:
-				return block_number
+		while block.isValid() and top <= pos.y():
+			if block.isVisible():
+				bottom = top + self.blockBoundingRect(block).height()
+				if pos.y() <= bottom:
+					return block_number
+				top = bottom
+				
+				end_line = self.folded_blocks.get(block_number, -1)
+				if end_line > block_number and not block.next().isVisible():
+					# 折りたたまれた行は範囲の終わりまでまとめて飛ばす
+					block_number = end_line + 1
+					block = doc.findBlockByNumber(block_number)
+					continue
 			
 			block = block.next()
-			top = bottom
-			bottom = top + self.blockBoundingRect(block).height()
 			block_number += 1
 		
 		return -1
@@ -487,58 +683,66 @@ class Editor(QPlainTextEdit):
 	def folding_area_paint_event(self, event):
 		"""折りたたみエリアの描画"""
 		painter = QPainter(self.folding_area)
-		painter.fillRect(event.rect(), self.get_line_number_bg_color())
+		rect = event.rect()
+		painter.fillRect(rect, self.get_line_number_bg_color())
 		
+		doc = self.document()
 		block = self.firstVisibleBlock()
 		block_number = block.blockNumber()
 		top = self.blockBoundingGeometry(block).translated(self.contentOffset()).top()
-		bottom = top + self.blockBoundingRect(block).height()
 		
 		icon_size = 8
 		icon_margin = 4
-		
-		while block.isValid() and top <= event.rect().bottom():
-			if block.isVisible() and bottom >= event.rect().top():
-				is_foldable, end_line = self.is_foldable_line(block_number)
-				is_folded = block_number in self.folded_blocks
-				
-				if is_foldable or is_folded:
-					center_y = int(top + self.fontMetrics().height() / 2)
-					center_x = self.folding_area.width() // 2
-					
-					# ホバー時の背景
-					if block_number == self.folding_area.hover_line:
-						hover_rect = QRect(
-							center_x - icon_size, 
-							center_y - icon_size,
-							icon_size * 2, 
-							icon_size * 2
-						)
-						painter.fillRect(hover_rect, QColor(100, 100, 100, 50))
+		half_height = self.fontMetrics().height() / 2
+		center_x = self.folding_area.width() // 2
+		painter.setPen(QPen(self.get_line_number_fg_color(), 1.5))
+		
+		while block.isValid() and top <= rect.bottom():
+			if block.isVisible():
+				bottom = top + self.blockBoundingRect(block).height()
+				end_line = self.folded_blocks.get(block_number, -1)
+				if bottom >= rect.top():
+					is_foldable, _ = self.is_foldable_line(block_number)
+					is_folded = end_line >= 0
 					
-					# 矢印アイコンを描画
-					painter.setPen(QPen(self.get_line_number_fg_color(), 1.5))
-					
-					if is_folded:
-						# 右向き矢印（折りたたまれている）
-						arrow = QPolygon([
-							QPoint(center_x - 2, center_y - 3),
-							QPoint(center_x + 2, center_y),
-							QPoint(center_x - 2, center_y + 3)
-						])
-					else:
-						# 下向き矢印（展開されている）
-						arrow = QPolygon([
-							QPoint(center_x - 3, center_y - 2),
-							QPoint(center_x, center_y + 2),
-							QPoint(center_x + 3, center_y - 2)
-						])
-					
-					painter.drawPolyline(arrow)
+					if is_foldable or is_folded:
+						center_y = int(top + half_height)
+						
+						# ホバー時の背景
+						if block_number == self.folding_area.hover_line:
+							hover_rect = QRect(
+								center_x - icon_size, 
+								center_y - icon_size,
+								icon_size * 2, 
+								icon_size * 2
+							)
+							painter.fillRect(hover_rect, QColor(100, 100, 100, 50))
+						
+						if is_folded:
+							# 右向き矢印（折りたたまれている）
+							arrow = QPolygon([
+								QPoint(center_x - 2, center_y - 3),
+								QPoint(center_x + 2, center_y),
+								QPoint(center_x - 2, center_y + 3)
+							])
+						else:
+							# 下向き矢印（展開されている）
+							arrow = QPolygon([
+								QPoint(center_x - 3, center_y - 2),
+								QPoint(center_x, center_y + 2),
+								QPoint(center_x + 3, center_y - 2)
+							])
+						
+						painter.drawPolyline(arrow)
+				top = bottom
+				
+				if end_line > block_number and not block.next().isVisible():
+					# 折りたたまれた行は範囲の終わりまでまとめて飛ばす
+					block_number = end_line + 1
+					block = doc.findBlockByNumber(block_number)
+					continue
 			
 			block = block.next()
-			top = bottom
-			bottom = top + self.blockBoundingRect(block).height()
 			block_number += 1
 	
 	# ============== Go to Definition Methods ==============
@@ -578,11 +782,13 @@ class Editor(QPlainTextEdit):
 				self.viewport().setCursor(QCursor(Qt.CursorShape.IBeamCursor))
 				self._clear_link_style()
 				self._hover_timer.stop()
+				self.prefetcher.cancel_request()
 				QToolTip.hideText()
 		else:
 			self.viewport().setCursor(QCursor(Qt.CursorShape.IBeamCursor))
 			self._clear_link_style()
 			self._hover_timer.stop()
+			self.prefetcher.cancel_request()
 			self._last_hover_word = None
 			QToolTip.hideText()
 		super().mouseMoveEvent(event)
@@ -605,6 +811,7 @@ class Editor(QPlainTextEdit):
 	def leaveEvent(self, event):
 		"""エディタからマウスが離れた時"""
 		self._hover_timer.stop()
+		self.prefetcher.cancel_request()
 		self._last_hover_word = None
 		self._clear_link_style()
 		QToolTip.hideText()
@@ -621,6 +828,7 @@ class Editor(QPlainTextEdit):
 		if word != self._last_hover_word:
 			self._last_hover_word = word
 			self._hover_timer.stop()
+			self.prefetcher.cancel_request()
 			QToolTip.hideText()
 			
 			if word and word.isidentifier():
@@ -640,19 +848,22 @@ class Editor(QPlainTextEdit):
 		if not word or not word.isidentifier():
 			return
 		
-		# シンボル情報を取得
-		from Semantic import get_symbol_info, get_import_info
+		# 先読みしたツールチップを使い、無ければ別スレッドでタブのSemanticから求める（スコープ→インポート先の順に検索）
+		highlighter = self._python_highlighter()
+		if highlighter is None:
+			return
 		
+		item = (word, cursor.blockNumber() + 1, None)
 		text = self.document().toPlainText()
-		line = cursor.blockNumber() + 1
-		
-		# まずローカルの定義を検索
-		info = get_symbol_info(text, word, line)
+		semantic = self._current_semantic(highlighter, text)
+		global_pos = self._hover_global_pos
 		
-		# インポートされたシンボルも検索
-		if not info:
-			info = get_import_info(text, word)
+		def show(tooltip_text):
+			if tooltip_text:
+				QToolTip.showText(global_pos, tooltip_text, self.viewport())
 		
-		if info:
-			tooltip_text = info.to_tooltip()
-			QToolTip.showText(self._hover_global_pos, tooltip_text, self.viewport())
+		found, tooltip_text = self.prefetcher.cached("tooltip", semantic, item)
+		if found:
+			show(tooltip_text)
+		else:
+			self.prefetcher.request("tooltip", text, semantic or highlighter.semantic, item, getattr(self, 'file_path', None), show)
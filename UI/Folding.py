@@ -0,0 +1,114 @@
+"""インデントから求める折りたたみ範囲の索引"""
+from array import array
+
+BLANK = -1  # 空行のインデント（範囲の終端を決めない）
+
+def indent_level(text):
+	"""テキストのインデントレベル（タブは4）"""
+	indent = 0
+	for char in text:
+		if char == '\t':
+			indent += 4
+		elif char == ' ':
+			indent += 1
+		else:
+			break
+	return indent
+
+def is_header(text):
+	"""折りたたみ範囲を始めうる行か（コロンで終わる行。コメントのみの行は除く）"""
+	stripped = text.strip()
+	return bool(stripped) and not stripped.startswith('#') and stripped.endswith(':')
+
+class FoldIndex:
+	"""行ごとのインデントと、コロンで終わる行かを持ち、折りたたみ範囲を引く。
+
+	範囲は「コロンで終わる行の次の行がより深いインデントなら、同じかより浅いインデントの行の
+	手前まで（間の空行も含む）」。範囲の終端は引かれたときに求めて覚えておき、編集では
+	編集された行にかかる範囲だけを忘れる（以降の範囲は行番号をずらす）。
+	"""
+	def __init__(self, texts=()):
+		self.indents = array('i')
+		self.headers = bytearray()
+		self._ends = {}  # 先頭行 -> 終端行（折りたためなければ-1）
+		self.replace(0, 0, texts)
+
+	def __len__(self):
+		return len(self.headers)
+
+	def replace(self, first, removed, texts):
+		"""first行からremoved行をtextsの行に置き換え、折りたたみの印が変わりうるならTrueを返す"""
+		indents = array('i', (indent_level(text) if text.strip() else BLANK for text in texts))
+		headers = bytearray(is_header(text) for text in texts)
+		changed = len(indents) != removed or self.indents[first:first + removed] != indents or self.headers[first:first + removed] != headers
+		self.indents[first:first + removed] = indents
+		self.headers[first:first + removed] = headers
+		if not changed:
+			return False
+
+		delta = len(indents) - removed
+		ends = {}
+		for start, end in self._ends.items():
+			if start < first:
+				# 範囲（折りたためない行は次の行）が編集より前で終わっていれば変わらない
+				if max(start, end) + 1 < first:
+					ends[start] = end
+			elif start >= first + removed:
+				ends[start + delta] = end + delta if end >= 0 else -1
+		self._ends = ends
+		return True
+
+	def regions(self):
+		"""すべての折りたたみ範囲を [(先頭行, 終端行, 深さ（1から）)] で先頭行の順に返す。
+
+		開いている範囲をスタックに積んで1回たどるだけで求め、終端は fold_end 用にも覚えておく。
+		"""
+		indents = self.indents
+		headers = self.headers
+		count = len(indents)
+		regions = []
+		ends = {}
+		stack = []  # (regionsの位置, インデント)。インデントは奥ほど深い
+		for line in range(count):
+			indent = indents[line]
+			if indent == BLANK:
+				continue
+			while stack and indent <= stack[-1][1]:
+				# この行の手前（間の空行を含む）で終わる
+				position = stack.pop()[0]
+				start, _, depth = regions[position]
+				regions[position] = (start, line - 1, depth)
+				ends[start] = line - 1
+			if headers[line]:
+				if line + 1 < count and indents[line + 1] > indent:
+					stack.append((len(regions), indent))
+					regions.append((line, -1, len(stack)))
+				else:
+					ends[line] = -1
+		for position, _ in stack:
+			start, _, depth = regions[position]
+			regions[position] = (start, count - 1, depth)
+			ends[start] = count - 1
+		self._ends = ends
+		return regions
+
+	def fold_end(self, line):
+		"""lineから始まる折りたたみ範囲の終端行（折りたためなければ-1）"""
+		if not 0 <= line < len(self.headers) or not self.headers[line]:
+			return -1
+		end = self._ends.get(line)
+		if end is None:
+			indents = self.indents
+			base = indents[line]
+			count = len(indents)
+			if line + 1 >= count or indents[line + 1] <= base:
+				end = -1
+			else:
+				end = line + 1
+				while end + 1 < count:
+					indent = indents[end + 1]
+					if indent != BLANK and indent <= base:
+						break
+					end += 1
+			self._ends[line] = end
+		return end
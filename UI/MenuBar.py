@@ -3,6 +3,7 @@ from PySide6.QtGui import QAction, QActionGroup
 from PySide6.QtCore import Qt
 import os
 from GoToDefinition import go_to_definition
+from FindReferences import find_references
 #from main import window as win
 
 class MenuBar:
@@ -110,6 +111,10 @@ class MenuBar:
 		goto_def_action.setShortcut("F12")
 		goto_def_action.triggered.connect(lambda: go_to_definition(self.window))
 
+		find_refs_action = QAction("すべての参照を検索", self.window)
+		find_refs_action.setShortcut("Shift+F12")
+		find_refs_action.triggered.connect(lambda: find_references(self.window))
+
 		self.edit_menu.addAction(undo_action)
 		self.edit_menu.addAction(redo_action)
 		self.edit_menu.addSeparator()
@@ -123,6 +128,7 @@ class MenuBar:
 		self.edit_menu.addAction(replace_action)
 		self.edit_menu.addSeparator()
 		self.edit_menu.addAction(goto_def_action)
+		self.edit_menu.addAction(find_refs_action)
 
 	def viewmenu(self):
 		self.view_menu = self.menubar.addMenu("表示(&V)")
@@ -141,6 +147,26 @@ class MenuBar:
 		self.view_menu.addAction(fullscreen_action)
 		self.view_menu.addAction(wrap_action)
 		
+		self.folding_menu = self.view_menu.addMenu("折りたたみ")
+		self.folding_menu.setFont(self.window.FONT)
+
+		fold_all_action = QAction("すべて折りたたむ", self.window)
+		fold_all_action.setShortcut("Ctrl+K Ctrl+0")
+		fold_all_action.triggered.connect(lambda: self.fold_command("fold_all"))
+
+		unfold_all_action = QAction("すべて展開", self.window)
+		unfold_all_action.setShortcut("Ctrl+K Ctrl+J")
+		unfold_all_action.triggered.connect(lambda: self.fold_command("unfold_all"))
+
+		self.folding_menu.addAction(fold_all_action)
+		self.folding_menu.addAction(unfold_all_action)
+		self.folding_menu.addSeparator()
+		for level in range(1, 8):
+			fold_level_action = QAction(f"レベル{level}で折りたたむ", self.window)
+			fold_level_action.setShortcut(f"Ctrl+K Ctrl+{level}")
+			fold_level_action.triggered.connect(lambda checked, l=level: self.fold_command("fold_to_level", l))
+			self.folding_menu.addAction(fold_level_action)
+		
 		self.theme_menu = self.view_menu.addMenu("配色テーマ")
 		self.theme_menu.setFont(self.window.FONT)
 
@@ -169,6 +195,12 @@ class MenuBar:
 			self.theme_action_group.addAction(theme_action)
 			self.theme_menu.addAction(theme_action)
 
+	def fold_command(self, name, *args):
+		"""現在のタブがエディタなら折りたたみのコマンドを実行"""
+		index = self.window.tabs.currentIndex()
+		if 0 <= index < len(self.window.tablist) and hasattr(self.window.tablist[index], name):
+			getattr(self.window.tablist[index], name)(*args)
+
 	def runmenu(self):
 		self.run_menu = self.menubar.addMenu("実行(&R)")
 		self.run_menu.setFont(self.window.FONT)
@@ -0,0 +1,167 @@
+"""ミニマップのタイルのピクセルを作る。
+
+行の文字と書式の範囲（色の区間）から、1文字1px（タブは2px）の乗算済みARGB32のバッファを作る。
+1行はline_height px の高さで、その最後の1px の行に描く（残りは行の間のすき間）。幅を超える文字は描かない。
+NumPyがあれば全行をまとめて配列の演算で計算し、無ければ行ごとに計算する。
+どちらもQImageにそのまま渡せるバッファ（コピーしない）を返す。
+"""
+import sys
+from array import array
+try:
+	import numpy as np
+except ImportError:
+	np = None
+
+COLUMNS = 80  # 1行で描く文字数
+LEFT = 2  # 左の余白(px)
+WIDTH = LEFT + COLUMNS * 2 + 2  # 全部タブでも収まる幅(px)（幅を指定しない場合）
+ALPHA = 200
+# str.isspaceが真になる文字（描かない）。0x3000（全角空白）より大きいものは無い
+WHITESPACE = [code for code in range(0x3001) if chr(code).isspace()]
+if np is not None:
+	# 文字コード -> 空白か（0x3001以上は最後の要素に丸めて引く）
+	SPACE_TABLE = np.zeros(0x3002, dtype=bool)
+	SPACE_TABLE[WHITESPACE] = True
+
+def premultiplied(rgb, alpha=ALPHA):
+	"""0xRRGGBBをアルファalphaの乗算済みARGB32の値にする"""
+	r, g, b = ((rgb >> shift & 0xFF) * alpha // 255 for shift in (16, 8, 0))
+	return (alpha << 24) | (r << 16) | (g << 8) | b
+
+class Runs:
+	"""書式の範囲（色の区間）を列ごとの配列で持つ（NumPyからはコピーせずに読める）。
+
+	色は追加した順に番号を振り、paletteの何番目か（0xRRGGBB）で持つ。
+	"""
+	def __init__(self):
+		self.rows = array('i')
+		self.starts = array('i')
+		self.ends = array('i')
+		self.colors = array('i')  # paletteの番号
+		self.palette = []
+		self._numbers = {}
+
+	def add(self, row, start, end, rgb):
+		number = self._numbers.get(rgb)
+		if number is None:
+			number = self._numbers[rgb] = len(self.palette)
+			self.palette.append(rgb)
+		self.rows.append(row)
+		self.starts.append(start)
+		self.ends.append(end)
+		self.colors.append(number)
+
+	def __len__(self):
+		return len(self.rows)
+
+def rasterize(texts, runs, default, lines=None, width=WIDTH, line_height=1):
+	"""texts（1行ずつの文字列）をlines行分のバッファに描き、(バッファ, 幅, 高さ) を返す。
+
+	runsは書式の範囲（Runs）で、同じ行の範囲は重ならないものとする。
+	範囲外の文字はdefault（0xRRGGBB）の色で描く。
+	"""
+	lines = len(texts) if lines is None else lines
+	if np is not None:
+		buffer = rasterize_numpy(texts, runs, default, lines, width, line_height)
+	else:
+		buffer = rasterize_python(texts, runs, default, lines, width, line_height)
+	return buffer, width, lines * line_height
+
+def rasterize_numpy(texts, runs, default, lines, width=WIDTH, line_height=1):
+	image = np.zeros((lines * line_height, width), dtype=np.uint32)
+	texts = [text[:COLUMNS] for text in texts[:lines]]
+	count = len(texts)
+	# 全行の文字をつなげて1つの文字コードの配列にし、行ごとの長さと先頭の位置を持つ
+	codes = np.frombuffer(''.join(texts).encode('utf-32-le', errors='surrogatepass'), dtype=np.uint32)
+	total = len(codes)
+	if not total:
+		return image
+	lengths = np.fromiter(map(len, texts), dtype=np.intp, count=count)
+	starts_of_row = np.zeros(count, dtype=np.intp)
+	np.cumsum(lengths[:-1], out=starts_of_row[1:])
+
+	# 文字のx = 左の余白 + 列 + その前のタブの数（タブは2px）。
+	# 列とタブの数は全体の通し番号と累積和から、行の先頭までの分を引いて求める
+	tabs = codes == 9
+	before = np.cumsum(tabs, dtype=np.intp)
+	before -= tabs
+	x = np.repeat(LEFT - starts_of_row - before[np.minimum(starts_of_row, total - 1)], lengths)
+	x += np.arange(total, dtype=np.intp)
+	x += before
+	# 描くのは各行の最後の1px の行
+	row_base = np.arange(line_height - 1, count * line_height, line_height, dtype=np.intp) * width
+	position = np.repeat(row_base, lengths)
+	position += x
+	# 制御文字と空白は描かない（0x85以上の空白はまれなので、その文字だけ表で調べる）
+	visible = codes > 32
+	high = np.flatnonzero(codes >= 0x85)
+	if len(high):
+		visible[high] = ~SPACE_TABLE[np.minimum(codes[high], len(SPACE_TABLE) - 1)]
+
+	# 色番号は 0: 描かない, 1: 既定の色, 2以降: 書式の色（runs.paletteの番号 + 2）
+	colors = [0, premultiplied(default)] + [premultiplied(rgb) for rgb in runs.palette]
+	palette = np.array(colors, dtype=np.uint32)
+	color = visible.astype(np.int32)
+	if len(runs):
+		rows = np.frombuffer(runs.rows, dtype=np.int32)
+		keep = rows < count
+		rows = rows[keep]
+		length = lengths[rows]
+		starts = np.minimum(np.frombuffer(runs.starts, dtype=np.int32)[keep], length)
+		ends = np.minimum(np.frombuffer(runs.ends, dtype=np.int32)[keep], length)
+		nonempty = starts < ends
+		offset = starts_of_row[rows[nonempty]]
+		numbers = np.frombuffer(runs.colors, dtype=np.int32)[keep][nonempty] + 1
+		# 区間の始まりに (色番号 - 既定の色番号) を置き、終わりで戻して累積和をとると文字ごとの色番号になる。
+		# 同じ行の区間は重ならないので、終わりと始まりはそれぞれ重複しない
+		delta = np.zeros(total + 1, dtype=np.int32)
+		delta[offset + ends[nonempty]] = -numbers
+		delta[offset + starts[nonempty]] += numbers
+		shift = np.cumsum(delta[:total], dtype=np.int32)
+		color += shift * visible
+		np.clip(color, 0, len(palette) - 1, out=color)
+
+	# 同じ行で文字の位置は重ならないので、空白も0として書いてよい（幅を超える文字は捨てる）
+	inside = x < width
+	if not inside.all():
+		position = position[inside]
+		color = color[inside]
+	image.reshape(-1)[position] = palette[color]
+	return image
+
+def rasterize_python(texts, runs, default, lines, width=WIDTH, line_height=1):
+	stride = width * 4
+	buffer = bytearray(stride * lines * line_height)
+	pixels = {}
+
+	def pixel(rgb):
+		value = pixels.get(rgb)
+		if value is None:
+			value = pixels[rgb] = premultiplied(rgb).to_bytes(4, sys.byteorder)
+		return value
+
+	by_row = {}
+	for row, start, end, number in zip(runs.rows, runs.starts, runs.ends, runs.colors):
+		by_row.setdefault(row, []).append((start, end, runs.palette[number]))
+	for row, text in enumerate(texts[:lines]):
+		text = text[:COLUMNS]
+		if not text.strip():
+			continue
+		colors = [pixel(default)] * len(text)
+		for start, end, rgb in by_row.get(row, ()):
+			end = min(end, len(text))
+			if start < end:
+				colors[start:end] = [pixel(rgb)] * (end - start)
+		offset = (row * line_height + line_height - 1) * stride
+		x = LEFT
+		for char, value in zip(text, colors):
+			if x >= width:
+				break
+			if char == '\t':
+				x += 2
+			elif char <= ' ' or char.isspace():
+				x += 1
+			else:
+				buffer[offset + x * 4:offset + x * 4 + 4] = value
+				x += 1
+	return buffer
@@ -0,0 +1,99 @@
+"""折りたたみの余白（ガター）の描画時間を、大きなクラスの先頭を表示した状態で計測する
+
+大きなクラスの折りたたみ/展開、すべて折りたたむ/展開、レベルで折りたたむの時間と、
+すべて折りたたんだ状態の描画時間も計測する。
+
+使い方: python -m benchmarks.folding [--lines 100000] [--repeat 20]
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+	sys.path.insert(0, ROOT)
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PySide6.QtCore import QPoint
+from PySide6.QtWidgets import QApplication
+from PySide6.QtGui import QImage, QPainter
+from UI.Editor import Editor
+from benchmarks.token_cache_memory import repo_sources, scale
+
+def large_class(lines):
+	"""全体が1つのクラスの中にあるソース（先頭の行の範囲がファイルの終わりまで続く）"""
+	body = scale(repo_sources(), lines).split('\n')
+	return "class Large:\n" + "\n".join("\t" + line if line.strip() else line for line in body)
+
+def paint(widget, image):
+	"""widgetをimageに描いた時間（秒）"""
+	start = time.perf_counter()
+	painter = QPainter(image)
+	widget.render(painter, QPoint())
+	painter.end()
+	return time.perf_counter() - start
+
+def timed(action):
+	"""actionを実行して表示に反映されるまでの時間（秒）"""
+	start = time.perf_counter()
+	action()
+	QApplication.processEvents()
+	return time.perf_counter() - start
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("--lines", type=int, default=100000)
+	parser.add_argument("--repeat", type=int, default=20)
+	args = parser.parse_args()
+	app = QApplication(sys.argv)
+
+	editor = Editor()
+	editor.resize(1200, 900)
+	start = time.perf_counter()
+	editor.setPlainText(large_class(args.lines))
+	print(f"{editor.document().blockCount()} lines, setPlainText {(time.perf_counter() - start) * 1000:.1f} ms")
+	editor.show()
+	app.processEvents()
+	gutter = editor.folding_area
+	image = QImage(gutter.size(), QImage.Format.Format_ARGB32_Premultiplied)
+
+	print(f"  {'first paint':<16} {paint(gutter, image) * 1000:8.2f} ms")
+	total = 0
+	for i in range(args.repeat):
+		total += paint(gutter, image)
+	print(f"  {'repaint':<16} {total / args.repeat * 1000:8.2f} ms/paint")
+	total = 0
+	for i in range(args.repeat):
+		cursor = editor.cursorForPosition(editor.viewport().rect().center())
+		start = time.perf_counter()
+		cursor.insertText("x")
+		total += time.perf_counter() - start + paint(gutter, image)
+	print(f"  {'typing':<16} {total / args.repeat * 1000:8.2f} ms/keystroke")
+	total = 0
+	for i in range(args.repeat):
+		cursor = editor.cursorForPosition(editor.viewport().rect().center())
+		start = time.perf_counter()
+		cursor.insertText("\n\t")
+		total += time.perf_counter() - start + paint(gutter, image)
+	print(f"  {'new line':<16} {total / args.repeat * 1000:8.2f} ms/keystroke")
+
+	# 入力した文字が空行の行頭に入るとクラスがそこで終わってしまうので、元のテキストに戻してから測る
+	document = editor.document()
+	while document.isUndoAvailable():
+		document.undo()
+	app.processEvents()
+	end_line = editor.fold_index.fold_end(0)
+	print(f"  {'fold class':<16} {timed(lambda: editor.fold(0, end_line)) * 1000:8.2f} ms  ({end_line} lines)")
+	print(f"  {'unfold class':<16} {timed(lambda: editor.unfold(0)) * 1000:8.2f} ms")
+	print(f"  {'fold all':<16} {timed(editor.fold_all) * 1000:8.2f} ms  ({len(editor.folded_blocks)} regions)")
+	total = 0
+	for i in range(args.repeat):
+		total += paint(gutter, image)
+	print(f"  {'repaint (folded)':<16} {total / args.repeat * 1000:8.2f} ms/paint")
+	print(f"  {'unfold all':<16} {timed(editor.unfold_all) * 1000:8.2f} ms")
+	print(f"  {'fold level 2':<16} {timed(lambda: editor.fold_to_level(2)) * 1000:8.2f} ms  ({len(editor.folded_blocks)} regions)")
+	print(f"  {'unfold all':<16} {timed(editor.unfold_all) * 1000:8.2f} ms")
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,191 @@
+"""HighlightとSemanticのベンチマーク（画面なしで実行する）
+
+Tokenizer.run、Highlighter.highlightBlock（キャッシュあり/なし）、rehighlight、
+Semantic.__init__（色分け用のdetails=Falseも）、get_module_fileの時間を、Python/JavaScript/Markdownの
+small/medium/hugeのファイルで計測し、実時間・最大RSS・Pythonのメモリ確保量を出す。
+
+使い方: python -m benchmarks.highlighting [--json result.json] [--compare old.json] [--sizes small,medium]
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+	sys.path.insert(0, ROOT)
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PySide6.QtGui import QGuiApplication, QTextDocument
+from Highlight import Highlighter, Tokenizer
+from Highlight.Semantic import Semantic, get_module_file
+from benchmarks.token_cache_memory import repo_sources, scale
+
+SIZES = {"small": 200, "medium": 5000, "huge": 50000}
+
+JS_SAMPLE = '''// generated sample
+import { readFile } from "fs";
+
+export class Store {
+	constructor(name, options = {}) {
+		this.name = name;
+		this.items = new Map();
+		this.options = { limit: 100, ...options };
+	}
+
+	/* multi-line
+	   comment */
+	add(key, value) {
+		if (this.items.size >= this.options.limit) {
+			throw new Error(`store ${this.name} is full`);
+		}
+		this.items.set(key, value);
+		return this;
+	}
+}
+
+const total = [1, 2, 3].map((x) => x * 2).reduce((a, b) => a + b, 0);
+readFile("data.json", "utf8", (err, text) => console.log(err ?? JSON.parse(text)));
+'''
+
+MARKDOWN_SAMPLE = '''# Heading
+
+Some *emphasis*, **strong** text and `inline code` with a [link](https://example.com).
+
+- item one
+- item two
+  1. nested
+  2. list
+
+> quoted text
+> over two lines
+
+```python
+def hello(name):
+    return f"Hello, {name}"
+```
+
+| column | value |
+|--------|-------|
+| a      | 1     |
+'''
+
+def corpus(sizes):
+	"""(名前, ファイル名, 本文) の一覧"""
+	python = repo_sources()
+	samples = (("python", "sample.py", python), ("javascript", "sample.js", JS_SAMPLE), ("markdown", "sample.md", MARKDOWN_SAMPLE))
+	files = []
+	for lang, filename, text in samples:
+		for size in sizes:
+			lines = SIZES[size]
+			body = '\n'.join(scale(text, lines).split('\n')[:lines])
+			files.append((f"{lang}-{size}", filename, body))
+	return files
+
+def peak_rss():
+	"""プロセスの最大RSS（バイト）。取得できない環境ではNone"""
+	try:
+		import resource
+	except ImportError:
+		return None
+	rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	return rss if sys.platform == "darwin" else rss * 1024
+
+def measure(func, repeat):
+	"""funcを実行して最短時間、最大RSS、tracemallocで見たメモリ確保量のピークを返す"""
+	times = []
+	for _ in range(repeat):
+		gc.collect()
+		start = time.perf_counter()
+		func()
+		times.append(time.perf_counter() - start)
+	gc.collect()
+	tracemalloc.start()
+	func()
+	alloc_peak = tracemalloc.get_traced_memory()[1]
+	tracemalloc.stop()
+	return {"seconds": min(times), "peak_rss": peak_rss(), "alloc_peak": alloc_peak}
+
+def bench_file(name, filename, text, style, repeat):
+	results = {}
+	doc = QTextDocument()
+	doc.setPlainText(text)
+	highlighter = Highlighter(parent=doc, filename=filename, style=style)
+	lexer = highlighter.lexer
+
+	def tokenize():
+		tokenizer = Tokenizer(text, lexer, highlighter.replace)
+		tokenizer.finished.connect(lambda result: results.setdefault("_result", result))
+		tokenizer.run()
+	results["Tokenizer.run"] = measure(tokenize, repeat)
+	result = results.pop("_result")
+
+	def highlight_blocks():
+		block = doc.firstBlock()
+		while block.isValid():
+			highlighter.rehighlightBlock(block)
+			block = block.next()
+	results["highlightBlock (lexer)"] = measure(highlight_blocks, repeat)
+
+	highlighter.token_cache = result.cache
+	highlighter.lex_states = result.states
+	highlighter.use_cache = True
+	results["highlightBlock (cache)"] = measure(highlight_blocks, repeat)
+	results["rehighlight"] = measure(highlighter.rehighlight, repeat)
+
+	if filename.endswith(".py"):
+		semantic = Semantic(text)
+		results["Semantic.__init__"] = measure(lambda: Semantic(text), repeat)
+		results["Semantic (details=False)"] = measure(lambda: Semantic(text, details=False), repeat)
+		modules = list(semantic.modules)
+		results["get_module_file"] = measure(lambda: [get_module_file(module) for module in modules], repeat)
+
+	lines = doc.blockCount()
+	return [dict(file=name, lines=lines, target=target, **values) for target, values in results.items()]
+
+def compare(rows, path):
+	"""以前のJSONと比べて時間の比を表示する"""
+	with open(path, "r", encoding="utf-8") as f:
+		old = {(row["file"], row["target"]): row for row in json.load(f)["results"]}
+	print(f"\ncompared with {path}")
+	for row in rows:
+		before = old.get((row["file"], row["target"]))
+		if before:
+			ratio = row["seconds"] / max(before["seconds"], 1e-9)
+			print(f"  {row['file']:<18} {row['target']:<24} {before['seconds'] * 1000:9.2f} -> {row['seconds'] * 1000:9.2f} ms ({ratio:.2f}x)")
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("--json", help="結果をJSONで保存するパス")
+	parser.add_argument("--compare", help="比較する以前の結果のJSON")
+	parser.add_argument("--sizes", default="small,medium,huge", help="計測するサイズ（カンマ区切り）")
+	parser.add_argument("--repeat", type=int, default=3)
+	args = parser.parse_args()
+	app = QGuiApplication(sys.argv)
+	with open(os.path.join(ROOT, "themes", "onedarkpro.json"), "r", encoding="utf-8") as f:
+		style = json.load(f)["highlight"]
+
+	rows = []
+	for name, filename, text in corpus(args.sizes.split(",")):
+		for row in bench_file(name, filename, text, style, args.repeat):
+			rows.append(row)
+			rss = f"{row['peak_rss'] / 1024 / 1024:8.1f} MiB" if row["peak_rss"] else "       -    "
+			print(f"{row['file']:<18} {row['target']:<24} {row['seconds'] * 1000:9.2f} ms  rss {rss}  alloc {row['alloc_peak'] / 1024 / 1024:8.2f} MiB")
+
+	if args.json:
+		with open(args.json, "w", encoding="utf-8") as f:
+			json.dump({
+				"python": sys.version.split()[0],
+				"platform": platform.platform(),
+				"time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+				"results": rows
+			}, f, indent=2)
+	if args.compare:
+		compare(rows, args.compare)
+
+if __name__ == "__main__":
+	main()
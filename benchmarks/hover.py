@@ -0,0 +1,84 @@
+"""ホバーの時間とast.parseの回数を、以前の方法（毎回get_symbol_info/get_import_infoで解析する）と
+ハイライターのSemanticを使う方法で比較する
+
+使い方: python -m benchmarks.hover [--lines 20000] [--hovers 50]
+"""
+import argparse
+import ast
+import json
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+	sys.path.insert(0, ROOT)
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PySide6.QtGui import QGuiApplication, QTextDocument
+from Highlight import Highlighter
+from Highlight.Semantic import get_symbol_info, get_import_info
+from benchmarks.token_cache_memory import repo_sources, scale
+
+class ParseCounter:
+	"""ast.parseの呼び出し回数を数える"""
+	def __init__(self):
+		self.count = 0
+		self.parse = ast.parse
+
+	def __enter__(self):
+		def parse(*args, **kwargs):
+			self.count += 1
+			return self.parse(*args, **kwargs)
+		ast.parse = parse
+		return self
+
+	def __exit__(self, *exc):
+		ast.parse = self.parse
+
+def hover_targets(text, count):
+	"""(単語, 行番号) を本文の識別子からランダムに選ぶ"""
+	rng = random.Random(0)
+	lines = text.split('\n')
+	targets = []
+	while len(targets) < count:
+		lineno = rng.randrange(len(lines))
+		words = [word for word in lines[lineno].replace('(', ' ').replace(')', ' ').replace('.', ' ').split() if word.isidentifier()]
+		if words:
+			targets.append((rng.choice(words), lineno + 1))
+	return targets
+
+def run(label, func, targets):
+	with ParseCounter() as counter:
+		start = time.perf_counter()
+		found = sum(1 for word, lineno in targets if func(word, lineno))
+		elapsed = time.perf_counter() - start
+	print(f"  {label:<22} {elapsed / len(targets) * 1000:8.2f} ms/hover  ast.parse {counter.count / len(targets):5.2f}/hover  found {found}/{len(targets)}")
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("--lines", type=int, default=20000)
+	parser.add_argument("--hovers", type=int, default=50)
+	args = parser.parse_args()
+	app = QGuiApplication(sys.argv)
+	with open(os.path.join(ROOT, "themes", "onedarkpro.json"), "r", encoding="utf-8") as f:
+		style = json.load(f)["highlight"]
+
+	text = scale(repo_sources(), args.lines)
+	doc = QTextDocument()
+	doc.setPlainText(text)
+	highlighter = Highlighter(parent=doc, filename="sample.py", style=style)
+	targets = hover_targets(text, args.hovers)
+	print(f"{doc.blockCount()} lines, {len(targets)} hovers")
+
+	run("parse per hover", lambda word, lineno: get_symbol_info(text, word, lineno) or get_import_info(text, word), targets)
+	# 解析済みのSemanticを使う（最初の1回はハイライターの解析の代わり）
+	highlighter.current_semantic(text)
+	run("highlighter Semantic", lambda word, lineno: highlighter.current_semantic(text).symbol_info(word, lineno), targets)
+	# 1行編集した後の最初のホバーは変わった文だけを解析する
+	edited = text.replace("\n", "\nEDITED = 1\n", 1)
+	run("after an edit", lambda word, lineno: highlighter.current_semantic(edited).symbol_info(word, lineno), targets[:1])
+
+if __name__ == "__main__":
+	main()
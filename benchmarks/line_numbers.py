@@ -0,0 +1,71 @@
+"""行番号の余白の描画時間を、スクロール・カーソルの移動・すべて折りたたんだ状態で計測する
+
+使い方: python -m benchmarks.line_numbers [--lines 100000] [--repeat 20]
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+	sys.path.insert(0, ROOT)
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PySide6.QtWidgets import QApplication
+from PySide6.QtGui import QImage, QTextCursor
+from UI.Editor import Editor
+from benchmarks.folding import large_class, paint
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("--lines", type=int, default=100000)
+	parser.add_argument("--repeat", type=int, default=20)
+	args = parser.parse_args()
+	app = QApplication(sys.argv)
+
+	editor = Editor()
+	editor.resize(1200, 900)
+	editor.setPlainText(large_class(args.lines))
+	editor.show()
+	app.processEvents()
+	gutter = editor.line_number_area
+	image = QImage(gutter.size(), QImage.Format.Format_ARGB32_Premultiplied)
+	scrollbar = editor.verticalScrollBar()
+	print(f"{editor.document().blockCount()} lines")
+
+	print(f"  {'first paint':<16} {paint(gutter, image) * 1000:8.2f} ms")
+	total = 0
+	for i in range(args.repeat):
+		scrollbar.setValue(scrollbar.value() + 3)
+		total += paint(gutter, image)
+	print(f"  {'scroll':<16} {total / args.repeat * 1000:8.2f} ms/paint")
+
+	# カーソルの移動で描き直しを頼まれる範囲（現在行が変わった行だけ）を描く時間
+	total = 0
+	for i in range(args.repeat):
+		start = time.perf_counter()
+		editor.moveCursor(QTextCursor.MoveOperation.Down)
+		app.processEvents()
+		total += time.perf_counter() - start
+	print(f"  {'cursor down':<16} {total / args.repeat * 1000:8.2f} ms/move")
+
+	editor.fold_to_level(2)
+	app.processEvents()
+	scrollbar.setValue(0)
+	total = 0
+	for i in range(args.repeat):
+		scrollbar.setValue(scrollbar.value() + 3)
+		total += paint(gutter, image)
+	print(f"  {'scroll (folded)':<16} {total / args.repeat * 1000:8.2f} ms/paint  ({len(editor.folded_blocks)} regions)")
+
+	# クラスごと折りたたむと表示される行は1行だけになり、残りの行はすべて範囲の終わりまで飛ばして描く
+	editor.fold_all()
+	app.processEvents()
+	total = 0
+	for i in range(args.repeat):
+		total += paint(gutter, image)
+	print(f"  {'all folded':<16} {total / args.repeat * 1000:8.2f} ms/paint  ({len(editor.folded_blocks)} regions)")
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,107 @@
+"""ミニマップの描画時間を、最初の描画・スクロール・1文字の入力・全体の再ハイライト後で計測する
+
+全行のピクセルを作る時間も、NumPyを使う場合と使わない場合で比べる。
+
+使い方: python -m benchmarks.minimap [--lines 100000] [--repeat 20]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+	sys.path.insert(0, ROOT)
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PySide6.QtWidgets import QApplication
+from PySide6.QtGui import QImage, QPainter
+from PySide6.QtCore import QPoint
+from Highlight import Highlighter
+from UI.Editor import Editor
+from UI import MiniMapRaster
+from UI.MiniMapRaster import Runs
+from benchmarks.token_cache_memory import repo_sources, scale
+
+def paint(minimap, image):
+	"""ミニマップをimageに描いた時間（秒）"""
+	start = time.perf_counter()
+	painter = QPainter(image)
+	minimap.render(painter, QPoint())
+	painter.end()
+	return time.perf_counter() - start
+
+def document_runs(editor):
+	"""文書の全行の文字と書式の範囲"""
+	texts = []
+	runs = Runs()
+	block = editor.document().firstBlock()
+	while block.isValid():
+		row = len(texts)
+		texts.append(block.text())
+		for fmt_range in block.layout().formats():
+			color = fmt_range.format.foreground().color()
+			if color.isValid():
+				runs.add(row, fmt_range.start, fmt_range.start + fmt_range.length, color.rgb() & 0xFFFFFF)
+		block = block.next()
+	return texts, runs
+
+def rasterize_all(editor):
+	"""全行のピクセルを作る時間（秒）を NumPy, Python の順に返す（NumPyが無ければNone）"""
+	texts, runs = document_runs(editor)
+	default = editor.palette().color(editor.foregroundRole()).rgb() & 0xFFFFFF
+	results = []
+	for rasterize in (MiniMapRaster.rasterize_numpy if MiniMapRaster.np is not None else None, MiniMapRaster.rasterize_python):
+		if rasterize is None:
+			results.append(None)
+			continue
+		start = time.perf_counter()
+		rasterize(texts, runs, default, len(texts))
+		results.append(time.perf_counter() - start)
+	return results
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("--lines", type=int, default=100000)
+	parser.add_argument("--repeat", type=int, default=20)
+	args = parser.parse_args()
+	app = QApplication(sys.argv)
+	with open(os.path.join(ROOT, "themes", "onedarkpro.json"), "r", encoding="utf-8") as f:
+		style = json.load(f)["highlight"]
+
+	editor = Editor()
+	editor.resize(1200, 900)
+	editor.setPlainText(scale(repo_sources(), args.lines))
+	editor.highlighter = Highlighter(parent=editor.document(), filename="sample.py", style=style)
+	editor.highlighter.rehighlight()
+	editor.show()
+	app.processEvents()
+	minimap = editor.minimap
+	image = QImage(minimap.size(), QImage.Format.Format_ARGB32_Premultiplied)
+	scrollbar = editor.verticalScrollBar()
+	print(f"{editor.document().blockCount()} lines, minimap {minimap.width()}x{minimap.height()}")
+
+	# 表示したときに描かれたタイルを捨ててから測る
+	minimap.invalidate()
+	print(f"  {'first paint':<16} {paint(minimap, image) * 1000:8.2f} ms")
+	total = 0
+	for i in range(args.repeat):
+		scrollbar.setValue(scrollbar.value() + 3)
+		total += paint(minimap, image)
+	print(f"  {'scroll':<16} {total / args.repeat * 1000:8.2f} ms/paint")
+	total = 0
+	for i in range(args.repeat):
+		cursor = editor.cursorForPosition(editor.viewport().rect().center())
+		cursor.insertText("x")
+		total += paint(minimap, image)
+	print(f"  {'typing':<16} {total / args.repeat * 1000:8.2f} ms/paint")
+	editor.highlighter.rehighlight()
+	print(f"  {'after rehighlight':<16} {paint(minimap, image) * 1000:8.2f} ms")
+	numpy_time, python_time = rasterize_all(editor)
+	if numpy_time is not None:
+		print(f"  {'rasterize numpy':<16} {numpy_time * 1000:8.2f} ms")
+	print(f"  {'rasterize python':<16} {python_time * 1000:8.2f} ms")
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,55 @@
+"""すべての参照を検索する時間を、識別子の索引が無い場合（全ファイルを読む）と索引済みの場合で比較する
+
+使い方: python -m benchmarks.references <フォルダー> <名前> [--repeat 5]
+フォルダーをワークスペースとして索引し、<名前> が最初に定義されたファイルの定義位置から参照を探す。
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+	sys.path.insert(0, ROOT)
+
+from Highlight.References import ReferenceIndex
+from Highlight.Workspace import workspace_index
+import FindReferences
+from FindReferences import ReferenceFinder, Source
+
+def search(paths, source, word, line):
+	finder = ReferenceFinder([source], paths)
+	target = finder.target(source, word, line, None)
+	return sum(len(found) for _, found in finder.search(word, target, lambda: False))
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("root")
+	parser.add_argument("name")
+	parser.add_argument("--repeat", type=int, default=5)
+	args = parser.parse_args()
+
+	workspace_index.set_root(args.root)
+	workspace_index.wait()
+	paths = workspace_index.paths()
+	location = next((workspace_index.find(qualname) for qualname in workspace_index._definitions if qualname.rsplit('.', 1)[-1] == args.name and not workspace_index.module_file(qualname)), None)
+	if location is None:
+		print(f"{args.name} is not defined in {args.root}")
+		return
+	path, line, _ = location
+	with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+		source = Source(None, path, f.read())
+	print(f"{len(paths)} files, {args.name} defined at {os.path.relpath(path, args.root)}:{line}")
+
+	# 保存した結果を使わない索引で、最初の検索（全ファイルを字句解析する）と2回目以降を比べる
+	FindReferences.reference_index = ReferenceIndex()
+	start = time.perf_counter()
+	count = search(paths, source, args.name, line)
+	print(f"  {'cold index':<14} {(time.perf_counter() - start) * 1000:8.1f} ms  {count} references")
+	start = time.perf_counter()
+	for _ in range(args.repeat):
+		search(paths, source, args.name, line)
+	print(f"  {'warm index':<14} {(time.perf_counter() - start) / args.repeat * 1000:8.1f} ms")
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,79 @@
+"""rehighlight()の時間を、書式の解決をキャッシュする場合としない場合（毎回token.parentをたどる）で比較する
+
+使い方: python -m benchmarks.rehighlight_formats [--lines 50000] [--repeat 3] [ファイル...]
+ファイルを省略するとリポジトリ内の*.pyを連結したものを使う。
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+	sys.path.insert(0, ROOT)
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PySide6.QtGui import QGuiApplication, QTextDocument
+from Highlight import Highlighter, Tokenizer
+from Highlight.TokenTable import TOKEN_TYPES
+from benchmarks.token_cache_memory import repo_sources, scale
+
+class WalkParents:
+	"""以前の実装と同じく、引くたびにtoken.parentをたどって書式を探す"""
+	def __init__(self, formats):
+		self.formats = formats
+
+	def __getitem__(self, tid):
+		token = TOKEN_TYPES[tid]
+		if token in self.formats:
+			return self.formats[token]
+		while token.parent is not None:
+			token = token.parent
+			if token in self.formats:
+				return self.formats[token]
+		return None
+
+def best(func, repeat):
+	times = []
+	for _ in range(repeat):
+		start = time.perf_counter()
+		func()
+		times.append(time.perf_counter() - start)
+	return min(times)
+
+def run(name, text, style, repeat):
+	doc = QTextDocument()
+	doc.setPlainText(text)
+	highlighter = Highlighter(parent=doc, filename=name, style=style)
+	result = Tokenizer(text, highlighter.lexer, highlighter.replace).tokenize()
+	highlighter.token_cache = result.cache
+	highlighter.lex_states = result.states
+	highlighter.use_cache = True
+
+	cached = best(highlighter.rehighlight, repeat)
+	walk = WalkParents(highlighter.formats)
+	highlighter.formats_by_id = lambda: walk
+	uncached = best(highlighter.rehighlight, repeat)
+
+	print(f"{name}: {doc.blockCount()} lines")
+	print(f"  walk token.parent : {uncached * 1000:8.1f} ms")
+	print(f"  resolved formats  : {cached * 1000:8.1f} ms ({uncached / max(cached, 1e-9):.2f}x faster)")
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("files", nargs="*")
+	parser.add_argument("--lines", type=int, default=50000, help="この行数になるまで内容を繰り返す")
+	parser.add_argument("--repeat", type=int, default=3)
+	args = parser.parse_args()
+	app = QGuiApplication(sys.argv)
+	with open(os.path.join(ROOT, "themes", "onedarkpro.json"), "r", encoding="utf-8") as f:
+		style = json.load(f)["highlight"]
+	if not args.files:
+		run("pycode.py", scale(repo_sources(), args.lines), style, args.repeat)
+	for path in args.files:
+		with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+			run(os.path.basename(path), scale(f.read(), args.lines), style, args.repeat)
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,77 @@
+"""Semantic.find_scopeとlookupの時間を、行番号の索引と以前の子スコープをたどる方法で比較する
+
+Semantic.definition（名前ごとの定義の索引を二分探索する）の時間も出す。
+
+使い方: python -m benchmarks.scope_lookup [--classes 200] [--methods 20]
+クラスごとにメソッドを持つファイルを生成し、全行について名前を引く。
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+	sys.path.insert(0, ROOT)
+
+from Highlight.Semantic import Semantic
+
+def generate(classes, methods):
+	lines = ["import os", "LIMIT = 10", ""]
+	for c in range(classes):
+		lines.append(f"class Class{c}:")
+		for m in range(methods):
+			lines.append(f"\tdef method{m}(self, value{m}):")
+			lines.append(f"\t\tresult = value{m} + LIMIT")
+			lines.append(f"\t\treturn os.path.join(str(result), Class{c}.__name__)")
+		lines.append("")
+	return '\n'.join(lines)
+
+def walk_scope(scope, lineno):
+	"""以前のfind_scope（子スコープを先頭から順に調べる）"""
+	if not scope.contains(lineno):
+		return None
+	for child in scope.children:
+		if child.contains(lineno):
+			return walk_scope(child, lineno)
+	return scope
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("--classes", type=int, default=200)
+	parser.add_argument("--methods", type=int, default=20)
+	args = parser.parse_args()
+
+	text = generate(args.classes, args.methods)
+	line_count = text.count('\n') + 1
+	semantic = Semantic(text)
+	names = ("result", "LIMIT", "os", "self")
+
+	start = time.perf_counter()
+	for lineno in range(1, line_count + 1):
+		scope = walk_scope(semantic.root, lineno)
+		for name in names:
+			scope.lookup(name)
+	walk = time.perf_counter() - start
+
+	start = time.perf_counter()
+	semantic._scope_index = None
+	for lineno in range(1, line_count + 1):
+		for name in names:
+			semantic.lookup(name, lineno)
+	indexed = time.perf_counter() - start
+
+	print(f"{line_count} lines, {args.classes * args.methods} functions, {line_count * len(names)} lookups")
+	print(f"  walk children : {walk * 1000:8.1f} ms")
+	print(f"  line index    : {indexed * 1000:8.1f} ms ({walk / max(indexed, 1e-9):.1f}x faster, includes building the index)")
+
+	start = time.perf_counter()
+	semantic._definitions = None
+	for lineno in range(1, line_count + 1):
+		for name in names:
+			semantic.definition(name, lineno)
+	definitions = time.perf_counter() - start
+	print(f"  definition    : {definitions * 1000:8.1f} ms (includes building the name index)")
+
+if __name__ == "__main__":
+	main()
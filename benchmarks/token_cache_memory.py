@@ -0,0 +1,81 @@
+"""token_cacheのメモリ使用量を旧形式（行→タプルのリスト）とTokenTableで比較する
+
+使い方: python -m benchmarks.token_cache_memory [--lines 50000] [ファイル...]
+ファイルを省略するとリポジトリ内の*.pyを連結したものを使う。
+"""
+import argparse
+import gc
+import os
+import sys
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+	sys.path.insert(0, ROOT)
+
+from pygments.lexers import get_lexer_for_filename
+from Highlight import Tokenizer
+from Highlight.TokenTable import TokenTable
+
+def repo_sources():
+	"""リポジトリ内の*.pyを連結する（実行中のPythonで構文解析できないファイルは除く）"""
+	texts = []
+	for dirpath, dirnames, filenames in os.walk(ROOT):
+		dirnames[:] = [d for d in dirnames if not d.startswith('.') and d != '__pycache__']
+		for filename in sorted(filenames):
+			if filename.endswith('.py'):
+				path = os.path.join(dirpath, filename)
+				with open(path, 'r', encoding='utf-8') as f:
+					text = f.read()
+				try:
+					compile(text, path, 'exec', dont_inherit=True)
+				except SyntaxError:
+					# 新しいバージョンの構文（3.12のf-stringなど）はこのバージョンでは意味解析できない
+					continue
+				texts.append(text)
+	return '\n'.join(texts)
+
+def scale(text, lines):
+	"""少なくともlines行になるまで繰り返す"""
+	count = text.count('\n') + 1
+	return '\n'.join([text] * max(1, -(-lines // count)))
+
+def measure(build):
+	gc.collect()
+	tracemalloc.start()
+	before = tracemalloc.get_traced_memory()[0]
+	value = build()
+	size = tracemalloc.get_traced_memory()[0] - before
+	tracemalloc.stop()
+	return value, size
+
+def run(name, text):
+	result = Tokenizer(text, get_lexer_for_filename(name), {}).tokenize()
+	texts = text.split('\n')
+	lines = [result.cache.tokens(num, texts[num]) for num in range(len(texts))]
+	tokens = sum(len(tokens) for tokens in lines)
+	del lines
+
+	# 旧形式: {行番号: [(トークン種別, 部分文字列, 位置), ...]}
+	old, old_size = measure(lambda: {num: result.cache.tokens(num, texts[num]) for num in range(len(texts))})
+	del old
+	new, new_size = measure(lambda: TokenTable(result.cache.tokens(num, texts[num]) for num in range(len(texts))))
+	del new
+
+	print(f"{name}: {len(texts)} lines, {tokens} tokens")
+	print(f"  dict of tuples : {old_size / 1024 / 1024:8.2f} MiB")
+	print(f"  TokenTable     : {new_size / 1024 / 1024:8.2f} MiB ({old_size / max(1, new_size):.1f}x smaller)")
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("files", nargs="*")
+	parser.add_argument("--lines", type=int, default=50000, help="この行数になるまで内容を繰り返す")
+	args = parser.parse_args()
+	if not args.files:
+		run("pycode.py", scale(repo_sources(), args.lines))
+	for path in args.files:
+		with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+			run(os.path.basename(path), scale(f.read(), args.lines))
+
+if __name__ == "__main__":
+	main()
@@ -18,6 +18,9 @@ from Color import css_color, icon_color
 from pygments.lexers import guess_lexer
 from utils import get_startupinfo, run_subprocess, apply_text_options, reset_highlighter
 from GoToDefinition import go_to_definition
+from Highlight.Workspace import workspace_index
+from Highlight.Resolver import module_resolver
+from Highlight.References import reference_index
 import Updater
 
 OS = platform.system()
@@ -137,6 +140,11 @@ class Window(QMainWindow):
 		self.horizontal_splitter = horizontal_splitter
 
 		self.load_settings()
+		# インポート先のモジュールは設定のインタープリターのsys.pathから探す
+		module_resolver.set_interpreter(self.settings.value("pythonInterpreter", sys.executable, type=str))
+		# 定義へ移動などに使うワークスペースの索引をバックグラウンドで作る
+		workspace_index.set_root(QDir.currentPath())
+		reference_index.warm()
 
 		MenuBar(self)
 		self.create_status_bar()
@@ -235,6 +243,8 @@ class Window(QMainWindow):
 		
 		apply_text_options(self.tablist[-1], wrap=self.word_wrap)
 		self.tablist[-1].highlighter = Highlighter(window=self,parent=self.tablist[-1].document(), filename=name, style=STYLE["highlight"])
+		# 解析が終わるたびに表示範囲のシンボルを先読みする
+		self.tablist[-1].highlighter.tokenized.connect(self.tablist[-1].schedule_prefetch)
 		
 		self.tabs.addTab(self.tablist[-1], name)
 		self.tabs.setCurrentIndex(len(self.tablist) - 1)
@@ -280,6 +290,8 @@ class Window(QMainWindow):
 		if folder_path:
 			self.sidebar.explorer.setRootIndex(self.sidebar.explorer.file_model.index(folder_path))
 			QDir.setCurrent(folder_path)
+			workspace_index.set_root(folder_path)
+			reference_index.warm()
 			self.settings.setValue("workspace", folder_path)
 			self.ConsoleGroup.add_terminal()
 			# Git Graph/Source Controlを更新
@@ -298,6 +310,7 @@ class Window(QMainWindow):
 			try:
 				with open(current_tab.file_path, 'w', encoding='utf-8') as file:
 					file.write(current_tab.toPlainText())
+				workspace_index.update_later(current_tab.file_path)
 			except Exception as e:
 				QMessageBox.critical(self, "エラー", f"ファイルの保存に失敗しました: {str(e)}")
 
@@ -310,6 +323,7 @@ class Window(QMainWindow):
 			try:
 				with open(file_path, 'w', encoding='utf-8') as file:
 					file.write(current_tab.toPlainText())
+				workspace_index.update_later(file_path)
 				current_tab.highlighter.set_filetype(file_path)
 				current_tab.highlighter.rehighlight()
 				self.tabs.setTabText(self.tabs.currentIndex(), QFileInfo(file_path).fileName())
@@ -469,6 +483,7 @@ class Window(QMainWindow):
 		if can_close:
 			# 設定を保存
 			self.save_settings()
+			workspace_index.cancel()
 			if self.settings.value("autoUpdate", True, type=bool):
 				th = Thread(target=Updater.update, args=("main" if not self.settings.value("DevUpdate", False, type=bool) else "dev",))
 				th.start()
@@ -0,0 +1,42 @@
+"""フォルダーの索引と色分け用の解析結果を作って保存する（次回開いたときに解析しない）
+
+使い方: python tools/index_workspace.py <フォルダー> [--definitions-only]
+"""
+import argparse
+import os
+import sys
+import time
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+	sys.path.insert(0, ROOT)
+# Highlight/__init__（ハイライターとPySide6）は読み込まず、解析に使うモジュールだけを読み込む
+if "Highlight" not in sys.modules:
+	package = types.ModuleType("Highlight")
+	package.__path__ = [os.path.join(ROOT, "Highlight")]
+	sys.modules["Highlight"] = package
+
+from Highlight.Store import semantic_store
+from Highlight.Workspace import WorkspaceIndex
+from Highlight.Semantic import module_cache
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("root", help="索引するフォルダー")
+	parser.add_argument("--definitions-only", action="store_true", help="定義の索引だけを作る")
+	args = parser.parse_args()
+
+	start = time.perf_counter()
+	index = WorkspaceIndex(semantic_store)
+	index.root = os.path.abspath(args.root)
+	index.scan()
+	if not args.definitions_only:
+		for path in index.paths():
+			module_cache.get(path)
+		module_cache.clear()
+	files, definitions = index.stats()
+	print(f"{files} files, {definitions} definitions in {time.perf_counter() - start:.2f} s -> {semantic_store.path}")
+
+if __name__ == "__main__":
+	main()
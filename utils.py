@@ -86,6 +86,7 @@ def reset_highlighter(highlighter, style, filename=None):
 	"""ハイライタのテーマをリセット"""
 	highlighter.formats.clear()
 	highlighter.replace.clear()
+	highlighter.invalidate_formats()
 	highlighter.style = style
 	highlighter.set_filetype(filename)
 	highlighter.rehighlight()